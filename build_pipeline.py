@@ -0,0 +1,225 @@
+import sqlite3
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import i_tree
+import vi_tree
+import vi_tree_central
+import vi_tree_conflict
+import vi_tree_edge
+import vi_tree_min_domain
+import vi_tree_on_demand
+import vi_tree_sqlite
+from cell_cache import CellCache
+from function_utils import generate_constraints, FunctionProfiler, box_bounds, box_vertices, box_crossing
+from insertion_order import order_ids, record_pairs
+from parallel_prefilter import load_and_prefilter
+from sqlite_utils import SQLiteReader, read_pairs
+
+# Result of one build: the tree, the number of records handed to it and the build time in seconds
+BuildResult = namedtuple("BuildResult", ["tree", "inserted", "elapsed"])
+
+
+def _create_insert(pipeline, track_adjacency=False, memory_budget=None, prune_constraints=False, transitivity=False,
+                   bucket_size=0, buffer_size=0, **_):
+    return vi_tree.VITree(track_adjacency, memory_budget, prune_constraints=prune_constraints,
+                          pairs=pipeline.order_pairs() if transitivity else None, bucket_size=bucket_size,
+                          buffer_size=buffer_size)
+
+
+def _create_conflict(pipeline, track_adjacency=False, **_):
+    return vi_tree_conflict.ConflictVITree(track_adjacency)
+
+
+def _create_paged(pipeline, cache_size=100000, **_):
+    return vi_tree_sqlite.PagedVITree(pipeline.conn, pipeline.m, pipeline.n, cache_size=cache_size)
+
+
+def _create_central(pipeline, track_adjacency=False, memory_budget=None, prune_constraints=False, transitivity=False,
+                    bucket_size=0, buffer_size=0, **_):
+    return vi_tree_central.CentralVITree(pipeline.records, pipeline.n * pipeline.var_max, track_adjacency,
+                                         memory_budget, prune_constraints=prune_constraints,
+                                         pairs=pipeline.order_pairs() if transitivity else None, bucket_size=bucket_size,
+                                         buffer_size=buffer_size, domain=pipeline.constraints)
+
+
+def _create_min_domain(pipeline, **_):
+    return vi_tree_min_domain.VITree()
+
+
+def _create_on_demand(pipeline, query_points=None, prune_constraints=False, **_):
+    return vi_tree_on_demand.VITree(query_points, prune_constraints=prune_constraints)
+
+
+def _create_itree(pipeline, **_):
+    return i_tree.ITree()
+
+
+def _create_edge(pipeline, **_):
+    return vi_tree_edge.VIETree()
+
+
+# Engine name -> factory(pipeline, **options). Options an engine does not use are ignored.
+ENGINES = {
+    "insert": _create_insert,
+    "central": _create_central,
+    "conflict": _create_conflict,
+    "paged": _create_paged,
+    "min_domain": _create_min_domain,
+    "on_demand": _create_on_demand,
+    "itree": _create_itree,
+    "edge": _create_edge,
+}
+
+
+class BuildPipeline:
+    """
+    Load a dataset once and share it between build engines.
+
+    The records are read into SQLiteReader with one query and the records crossing the root domain are found with
+    one vectorized test, or in a process pool while the table is read (see parallel_prefilter), so several engines or
+    insertion orders can be compared in one process without repeating I/O or prefiltering.
+    """
+
+    def __init__(self, m, n, db_name="test_intersections.db", var_min=0, var_max=1000, conn=None, workers=None,
+                 chunk_size=1 << 20, cell_cache=None, cell_cache_size=1000000):
+        """
+        Parameters:
+            m (int): Number of functions.
+            n (int): Dimension of functions.
+            db_name (str): Database file name.
+            var_min (float): Minimum value for variables.
+            var_max (float): Maximum value for variables.
+            conn: SQLite database connection, opened on db_name if not given.
+            workers (int): Prefilter in this many processes while loading, see parallel_prefilter; in-process if None.
+            chunk_size (int): Records per prefilter task when workers is given.
+            cell_cache (str): File of a CellCache shared by all runs on the dataset; no cache if None.
+            cell_cache_size (int): Number of cells kept in the cache file.
+        """
+        self.m = m
+        self.n = n
+        self.db_name = db_name
+        self.var_min = var_min
+        self.var_max = var_max
+        self.conn = conn if conn is not None else sqlite3.connect(db_name)
+
+        self.constraints = generate_constraints(n, var_min, var_max)
+        bounds = box_bounds(self.constraints)
+        # The corners of a box domain are closed-form, other domains go through cdd
+        self.vertices = box_vertices(*bounds) if bounds is not None else FunctionProfiler.compute_vertices(self.constraints)
+
+        if workers is not None:
+            records, self.records, self.satisfying_ids = load_and_prefilter(
+                m, n, bounds=bounds, vertices=self.vertices, conn=self.conn, chunk_size=chunk_size, workers=workers)
+            SQLiteReader.set_records(records, self.records)
+        else:
+            SQLiteReader.read_all_from_sqlite(m, n, db_name=db_name, conn=self.conn)
+            self.records = SQLiteReader.get_records_array()
+        self.ids = np.arange(1, len(self.records) + 1)  # SQLiteReader holds record ID i + 1 in row i
+        self.pairs = read_pairs(m, n, conn=self.conn)
+        # All hyperplanes pass through the corner of the domain at the origin, see vi_tree_central
+        self.central = vi_tree_central.is_central(self.records, var_min)
+
+        self.cell_cache = None
+        if cell_cache is not None:
+            self.cell_cache = CellCache(cell_cache, f"intersections_m{m}_n{n}", max_entries=cell_cache_size)
+            FunctionProfiler.cell_cache = self.cell_cache
+
+        if workers is None:
+            if bounds is not None:
+                # Closed-form crossing test for a box, O(num_records * n)
+                self.satisfying_ids = self.ids[box_crossing(self.records, *bounds)]
+            else:
+                # Records with root vertices strictly on both sides, same test as check_function
+                self.satisfying_ids = self.ids[FunctionProfiler.check_functions(self.records, self.vertices)]
+
+    def order(self, strategy="prefix", fraction=0.2, seed=0):
+        """
+        Choose the records to insert, a fraction of the whole table taken from the prefiltered IDs.
+        Returns:
+            list: Ordered record IDs, see insertion_order.order_ids.
+        """
+        sample_size = int(fraction * len(self.ids))
+        return order_ids(self.satisfying_ids.tolist(), strategy, sample_size, seed=seed, m=self.m,
+                         get_record=SQLiteReader.get_record_by_id, vertices=self.vertices, pairs=self.pairs)
+
+    def order_pairs(self):
+        """
+        Function pair of every record for transitivity pruning (see function_order), or None unless every record
+        has a zero constant, since only then do the records' signs chain.
+        """
+        if np.any(self.records[:, -1]):
+            return None
+        return self.pairs if self.pairs is not None else record_pairs(self.m)
+
+    def resolve(self, engine):
+        """
+        Resolve the "auto" engine: the central engine for central arrangements, the insert engine otherwise.
+        """
+        if engine == "auto":
+            return "central" if self.central else "insert"
+        return engine
+
+    def create(self, engine, **options):
+        """
+        Create an empty tree for an engine in ENGINES or "auto".
+        """
+        engine = self.resolve(engine)
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}, choose one of {sorted(ENGINES)}")
+        return ENGINES[engine](self, **options)
+
+    def build(self, engine, record_ids, manager=None, progress=False, **options):
+        """
+        Create a tree with an engine and insert the given (prefiltered) records into it.
+        Parameters:
+            engine (str): Name of the engine in ENGINES.
+            record_ids (list): Record IDs in insertion order.
+            manager (VertexManager): Passed on to engines whose insert accepts one.
+            progress (bool): Show a progress bar with the tree statistics.
+            options: Engine options, e.g. track_adjacency, memory_budget, prune_constraints, transitivity, cache_size,
+                query_points.
+        Returns:
+            BuildResult: The tree, the number of records inserted and the build time in seconds.
+        """
+        engine = self.resolve(engine)
+        tree = self.create(engine, **options)
+        common = dict(m=self.m, n=self.n, db_name=self.db_name, conn=self.conn)
+
+        start_time = time.time()
+        if engine == "conflict":
+            # All records cross the domain, so they are handed to the engine in one batch
+            tree.build(record_ids, self.constraints, self.vertices, **common)
+        else:
+            if engine == "edge":
+                extra = dict(var_min=self.var_min, var_max=self.var_max)
+            elif engine in ("itree", "paged"):
+                extra = {}
+            else:
+                extra = dict(manager=manager)
+
+            records = record_ids
+            if progress:
+                from tqdm import tqdm
+
+                records = tqdm(record_ids, desc="Processing Records", unit="sampled_records")
+            for count, record_id in enumerate(records, start=1):
+                tree.insert(record_id, self.constraints, self.vertices, **common, **extra)
+                if progress and count % 100 == 0:
+                    tree_stats = tree.stats()
+                    records.set_postfix(nodes=tree_stats["nodes"], leaves=tree_stats["leaves"], height=tree_stats["height"])
+
+        if engine == "paged":
+            tree.flush()
+        elif getattr(tree, "buffers", None):
+            # The bulk build is over, push the records still buffered to the leaves
+            tree.flush_buffers(**common)
+        return BuildResult(tree, len(record_ids), time.time() - start_time)
+
+    def close(self):
+        if self.cell_cache is not None:
+            self.cell_cache.close()
+            FunctionProfiler.cell_cache = None
+        self.conn.close()
@@ -0,0 +1,136 @@
+import numpy as np
+
+from sqlite_utils import SQLiteReader
+
+
+class LeafAdjacency:
+    """
+    Adjacency graph between leaf cells that share a facet, maintained locally while the tree is built.
+
+    Two leaves of the tree are separated by the record that splits their lowest common ancestor, so every edge is
+    labelled with that record and the shared facet lies on its hyperplane. When a leaf splits, its two children are
+    adjacent across the splitting record, and each child inherits a neighbour of the parent only if the part of the
+    shared facet on its side is still (d - 1)-dimensional.
+    """
+
+    def __init__(self, dimension, cell_vertices, atol=1e-4, get_vertices=None, get_record=None):
+        """
+        Parameters:
+            dimension (int): Dimension of the domain.
+            cell_vertices (callable): Maps a list of signed record IDs to the vertices of that cell.
+            atol (float): Tolerance for a vertex lying on a hyperplane.
+            get_vertices (callable): Returns the vertices of a node, defaults to reading node.vertices.
+            get_record (callable): Returns a record by ID, defaults to SQLiteReader.get_record_by_id.
+        """
+        self.dimension = dimension
+        self.cell_vertices = cell_vertices
+        self.get_vertices = get_vertices if get_vertices is not None else (lambda node: node.vertices)
+        self.get_record = get_record if get_record is not None else SQLiteReader.get_record_by_id
+        # compute_vertices rounds coordinates to integers, so a vertex can be up to sqrt(d) / 2 off its hyperplane
+        self.tolerance = 0.5 * np.sqrt(dimension) + atol
+        self.neighbours = {}  # Leaf -> {neighbouring leaf: ID of the record separating them}
+        self.facet_tests = 0  # Number of exact (cdd) facet tests performed
+
+    def add_root(self, root):
+        self.neighbours[root] = {}
+
+    def _link(self, a, b, record_id):
+        self.neighbours[a][b] = record_id
+        self.neighbours[b][a] = record_id
+
+    def _vertices_on(self, vertices, record_id):
+        """
+        Count the vertices lying on the hyperplane of a record.
+        """
+        *coefficients, constant = self.get_record(record_id)
+        coefficients = np.asarray(coefficients, dtype=np.float64)
+        distance = np.abs(np.asarray(vertices, dtype=np.float64) @ coefficients - constant) / np.linalg.norm(coefficients)
+        return int(np.count_nonzero(distance <= self.tolerance))
+
+    def _shares_facet(self, cell, neighbour, record_id):
+        """
+        Check whether two cells on opposite sides of a record share a (d - 1)-dimensional facet.
+        """
+        # A facet has at least d vertices, so both cells need d vertices on the separating hyperplane
+        cell_vertices = self.get_vertices(cell)
+        neighbour_vertices = self.get_vertices(neighbour)
+        if len(cell_vertices) == 0 or len(neighbour_vertices) == 0:
+            return False
+        if self._vertices_on(cell_vertices, record_id) < self.dimension:
+            return False
+        if self._vertices_on(neighbour_vertices, record_id) < self.dimension:
+            return False
+
+        # The intersection of the two cells is their common face on the hyperplane
+        self.facet_tests += 1
+        face = self.cell_vertices(cell.constraints + neighbour.constraints)
+        return len({tuple(vertex) for vertex in face}) >= self.dimension
+
+    def on_split(self, parent, left, right, record_id):
+        """
+        Replace a split leaf by its two children in the graph.
+        """
+        parent_neighbours = self.neighbours.pop(parent, {})
+        self.neighbours[left] = {}
+        self.neighbours[right] = {}
+
+        for neighbour, separating_id in parent_neighbours.items():
+            del self.neighbours[neighbour][parent]
+            for child in (left, right):
+                if self._shares_facet(child, neighbour, separating_id):
+                    self._link(child, neighbour, separating_id)
+
+        self._link(left, right, record_id)
+
+    def on_collapse(self, node, removed_leaves):
+        """
+        Replace the leaves of a collapsed subtree by its root, which is a leaf again.
+        Every facet between a removed leaf and a leaf outside the subtree lies on the boundary of the collapsed cell,
+        so the outside neighbours carry over with their separating records and no facet test is needed.
+        """
+        removed_leaves = set(removed_leaves)
+        self.neighbours[node] = {}
+        for leaf in removed_leaves:
+            for neighbour, separating_id in self.neighbours.pop(leaf, {}).items():
+                if neighbour in removed_leaves:
+                    continue
+                del self.neighbours[neighbour][leaf]
+                self._link(node, neighbour, separating_id)
+
+    def get_neighbours(self, leaf):
+        """
+        Return the leaves adjacent to a leaf, in O(degree).
+        """
+        return list(self.neighbours.get(leaf, ()))
+
+    def to_csr(self):
+        """
+        Export the graph as compressed sparse row arrays.
+        Returns:
+            dict: leaf_ids (node_id of every leaf, sorted), indptr and indices (neighbours of leaf_ids[i] are
+                  leaf_ids[indices[indptr[i]:indptr[i + 1]]]) and separators (the record separating each pair).
+        """
+        leaves = sorted(self.neighbours, key=lambda leaf: leaf.node_id)
+        position = {leaf: i for i, leaf in enumerate(leaves)}
+
+        indptr = np.zeros(len(leaves) + 1, dtype=np.int64)
+        indices = []
+        separators = []
+        for i, leaf in enumerate(leaves):
+            row = sorted((position[neighbour], separating_id) for neighbour, separating_id in self.neighbours[leaf].items())
+            indices.extend(column for column, _ in row)
+            separators.extend(separating_id for _, separating_id in row)
+            indptr[i + 1] = len(indices)
+
+        return {
+            "leaf_ids": np.array([leaf.node_id for leaf in leaves], dtype=np.int64),
+            "indptr": indptr,
+            "indices": np.array(indices, dtype=np.int32),
+            "separators": np.array(separators, dtype=np.int64),
+        }
+
+    def save(self, path):
+        """
+        Save the CSR arrays to an .npz file.
+        """
+        np.savez_compressed(path, **self.to_csr())
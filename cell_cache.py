@@ -0,0 +1,109 @@
+import hashlib
+import sqlite3
+
+import numpy as np
+
+from function_utils import signed_constraint_rows
+
+
+class CellCache:
+    """
+    On-disk cache of cell vertices shared between runs on the same dataset.
+
+    A cell is identified by the domain and its sorted signed record IDs; the key also hashes the records themselves,
+    so records changed by VITree.update or a different table in the same file never hit a stale entry. The cache is
+    an SQLite file holding at most max_entries cells; when it grows past that, the least recently used ones are
+    evicted. Lookups and insertions are buffered in memory and written every flush_every operations and on close.
+    """
+
+    def __init__(self, path, dataset, max_entries=1000000, flush_every=1000):
+        """
+        Parameters:
+            path (str): Cache file, e.g. next to the dataset's database.
+            dataset (str): Name of the dataset's table, part of every key.
+            max_entries (int): Number of cells kept in the file.
+            flush_every (int): Buffered lookups and insertions written in one transaction.
+        """
+        self.dataset = dataset.encode()
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cells (key BLOB PRIMARY KEY, d INTEGER, vertices BLOB, used INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_cells_used ON cells (used)")
+        self.tick = self.conn.execute("SELECT COALESCE(MAX(used), 0) FROM cells").fetchone()[0]
+        self.pending = {}  # Key -> (d, vertex bytes) of cells not yet written
+        self.touched = {}  # Key -> last use of cells read since the last flush
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, node_constraints, init_constraints, records=None):
+        """
+        Canonical key of the cell of a list of signed record IDs within a domain.
+        records replaces the records loaded in SQLiteReader, as for signed_constraint_rows.
+        """
+        ids = np.sort(np.asarray(node_constraints, dtype=np.int64))
+        digest = hashlib.sha1(self.dataset)
+        digest.update(np.asarray(init_constraints, dtype=np.float64).tobytes())
+        digest.update(ids.tobytes())
+        digest.update(signed_constraint_rows(ids, records).tobytes())
+        return digest.digest()
+
+    def get(self, key):
+        """
+        Return the cached vertices of a cell as a list of lists, or None on a miss.
+        """
+        self.tick += 1
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = self.conn.execute("SELECT d, vertices FROM cells WHERE key = ?", (key,)).fetchone()
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.touched[key] = self.tick
+        self._maybe_flush()
+        d, data = entry
+        return np.frombuffer(data, dtype=np.int64).reshape(-1, d).tolist() if d else []
+
+    def put(self, key, vertices):
+        """
+        Cache the (integer) vertices of a cell. Empty cells are cached too, with dimension 0.
+        """
+        self.tick += 1
+        vertices = np.asarray(vertices, dtype=np.int64)
+        self.pending[key] = (vertices.shape[1] if vertices.size else 0, vertices.tobytes())
+        self.touched[key] = self.tick
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self.pending) + len(self.touched) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Write buffered cells and use times, then evict the least recently used cells above max_entries.
+        """
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?)",
+                                  [(key, d, data, self.touched[key]) for key, (d, data) in self.pending.items()])
+            self.conn.executemany("UPDATE cells SET used = ? WHERE key = ?",
+                                  [(used, key) for key, used in self.touched.items() if key not in self.pending])
+            excess = self.conn.execute("SELECT COUNT(*) FROM cells").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute("DELETE FROM cells WHERE key IN (SELECT key FROM cells ORDER BY used LIMIT ?)", (excess,))
+        self.pending.clear()
+        self.touched.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": self.conn.execute("SELECT COUNT(*) FROM cells").fetchone()[0] + len(self.pending),
+        }
+
+    def close(self):
+        self.flush()
+        self.conn.close()
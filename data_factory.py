@@ -2,7 +2,10 @@ import numpy as np
 import itertools
 import random
 import argparse
-from sqlite_utils import save_to_sqlite, read_from_sqlite
+import sqlite3
+from sqlite_utils import (save_to_sqlite, read_from_sqlite, save_functions, read_functions, save_pairs, read_pairs,
+                          table_exists, SQLiteReader)
+from vi_tree_sqlite import PagedVITree
 
 def generate_functions(m, n, low=0, high=100):
     """Generate m functions in n dimensions with random coefficients."""
@@ -20,6 +23,92 @@ def compute_differences_with_constants(functions, constant_low, constant_high):
         record_id += 1
     return records
 
+def reconstruct_functions(m, n, conn, low=0):
+    """
+    Recover the functions of a dataset saved without a functions table from the records of function 0.
+    Record (0, j) is f_0 - f_j, so the functions are only known up to a common offset; f_0 is chosen as the smallest
+    offset that keeps every coefficient at or above low. All differences, and therefore all records, are unchanged.
+    """
+    pairs = read_pairs(m, n, conn=conn)
+    if pairs is None:
+        pairs = np.column_stack(np.triu_indices(m, 1))
+    differences = np.zeros((m, n), dtype=np.int64)
+    records = read_from_sqlite(m, n, conn=conn)
+    for (i, j), record in zip(pairs, records):
+        if i == 0:
+            differences[j] = record[:-1]
+    f_0 = low + np.maximum(differences.max(axis=0), 0)
+    return (f_0 - differences).tolist()
+
+
+def rename_dataset(conn, m, new_m, n):
+    """
+    Rename every table of an m-function dataset, including a persisted VI tree, to the new function count.
+    Renaming keeps the rows and therefore the record IDs.
+    """
+    for old_name, new_name in ((f"intersections_m{m}_n{n}", f"intersections_m{new_m}_n{n}"),
+                               (f"functions_m{m}_n{n}", f"functions_m{new_m}_n{n}"),
+                               (f"pairs_m{m}_n{n}", f"pairs_m{new_m}_n{n}"),
+                               (f"vitree_m{m}_n{n}_nodes", f"vitree_m{new_m}_n{n}_nodes"),
+                               (f"vitree_m{m}_n{n}_meta", f"vitree_m{new_m}_n{n}_meta")):
+        if table_exists(conn, old_name):
+            conn.execute(f"ALTER TABLE {old_name} RENAME TO {new_name}")
+
+
+def append_functions(k, m, n, conn, low=0, high=100, constant_low=0, constant_high=0):
+    """
+    Append k random functions to an existing m-function dataset.
+    Existing records keep their IDs and constants. The records of the new pairs (i, j), with j a new function and
+    i any earlier one, get the following IDs, and the pair of every record is written to pairs_m{m+k}_n{n} since the
+    IDs no longer follow the combinations order. All tables are renamed to m + k functions.
+    Returns:
+        list: IDs of the new records.
+    """
+    functions = read_functions(m, n, conn=conn)
+    if functions is None:
+        functions = reconstruct_functions(m, n, conn, low)
+    pairs = read_pairs(m, n, conn=conn)
+    if pairs is None:
+        pairs = np.column_stack(np.triu_indices(m, 1))
+
+    new_functions = generate_functions(k, n, low, high)
+    next_id = len(pairs) + 1
+    records = []
+    new_pairs = []
+    for j, f_j in enumerate(new_functions, start=m):
+        for i, f_i in enumerate(functions + new_functions[:j - m]):
+            diff = [a - b for a, b in zip(f_i, f_j)]
+            constant = random.randint(constant_low, constant_high)
+            records.append((next_id + len(records), *diff, constant))
+            new_pairs.append((i, j))
+
+    with conn:
+        table_name = f"intersections_m{m}_n{n}"
+        placeholders = ", ".join(["?"] * (n + 2))
+        conn.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})", records)
+
+        pairs_table = f"pairs_m{m}_n{n}"
+        if not table_exists(conn, pairs_table):
+            conn.execute(f"CREATE TABLE {pairs_table} (id INTEGER PRIMARY KEY, i INTEGER, j INTEGER)")
+            conn.executemany(f"INSERT INTO {pairs_table} VALUES (?, ?, ?)",
+                             [(record_id, int(i), int(j)) for record_id, (i, j) in enumerate(pairs, start=1)])
+        conn.executemany(f"INSERT INTO {pairs_table} VALUES (?, ?, ?)",
+                         [(record[0], i, j) for record, (i, j) in zip(records, new_pairs)])
+
+        functions_table = f"functions_m{m}_n{n}"
+        if table_exists(conn, functions_table):
+            placeholders = ", ".join(["?"] * (n + 1))
+            conn.executemany(f"INSERT INTO {functions_table} VALUES ({placeholders})",
+                             [(i, *function) for i, function in enumerate(new_functions, start=m)])
+
+        rename_dataset(conn, m, m + k, n)
+
+    if read_functions(m + k, n, conn=conn) is None:
+        save_functions(functions + new_functions, m + k, n, conn=conn)
+
+    return [record[0] for record in records]
+
+
 if __name__ == '__main__':
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Generate and process random functions.")
@@ -29,6 +118,9 @@ if __name__ == '__main__':
     parser.add_argument("--high", type=int, default=100, help="Upper bound for coefficients (default: 100)")
     parser.add_argument("--constant-low", type=int, default=0, help="Lower bound for random constants (default: 0)")
     parser.add_argument("--constant-high", type=int, default=0, help="Upper bound for random constants (default: 100)")
+    parser.add_argument("--db", type=str, default="test_intersections.db", help="Database file (default: test_intersections.db)")
+    parser.add_argument("--append", type=int, default=None, metavar="K", help="Append K functions to the existing m-function dataset instead of creating a new one")
+    parser.add_argument("--extend_tree", action="store_true", help="With --append, insert the new records into the VI tree persisted by vi_tree_main.py --engine paged")
     args = parser.parse_args()
 
     m = args.m
@@ -38,11 +130,27 @@ if __name__ == '__main__':
     constant_low = args.constant_low
     constant_high = args.constant_high
 
-    # Step 1: Generate m functions with n dimensions
-    functions = generate_functions(m, n, low, high)
+    if args.append is not None:
+        conn = sqlite3.connect(args.db)
+        new_ids = append_functions(args.append, m, n, conn, low, high, constant_low, constant_high)
+        print(f"Appended {args.append} functions: records {new_ids[0]}-{new_ids[-1]} added to intersections_m{m + args.append}_n{n}.")
+
+        if args.extend_tree and not table_exists(conn, f"vitree_m{m + args.append}_n{n}_meta"):
+            print("No persisted VI tree found for this dataset, build one with vi_tree_main.py --engine paged first.")
+        elif args.extend_tree:
+            SQLiteReader.read_all_from_sqlite(m + args.append, n, conn=conn)
+            vi_tree = PagedVITree(conn, m + args.append, n)
+            inserted = vi_tree.extend(new_ids)
+            print(f"Inserted {inserted} new records into the persisted tree, which now has {vi_tree.get_leaf_count()} leaves.")
+        conn.close()
+    else:
+        # Step 1: Generate m functions with n dimensions
+        functions = generate_functions(m, n, low, high)
 
-    # Step 2: Compute all unique differences between pairs of functions and match with constants
-    records = compute_differences_with_constants(functions, constant_low, constant_high)
+        # Step 2: Compute all unique differences between pairs of functions and match with constants
+        records = compute_differences_with_constants(functions, constant_low, constant_high)
 
-    # Step 3: Save the records to an SQLite table dynamically based on m and n
-    save_to_sqlite(records, m, n)
+        # Step 3: Save the records to an SQLite table dynamically based on m and n
+        save_to_sqlite(records, m, n, args.db)
+        save_functions(functions, m, n, args.db)
+        save_pairs(itertools.combinations(range(m), 2), m, n, args.db)
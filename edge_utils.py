@@ -1,4 +1,3 @@
-from scipy.spatial import ConvexHull
 import numpy as np
 
 def get_edges_from_hull(vertices):
@@ -24,6 +23,8 @@ def get_edges_from_hull(vertices):
         return edges, convex_hull_vertices
 
     # Compute the convex hull
+    from scipy.spatial import ConvexHull
+
     hull = ConvexHull(vertices)
     edges = set()
 
@@ -0,0 +1,60 @@
+class FunctionOrder:
+    """
+    Partial order of the functions implied by the signed records on a path of the VI tree.
+
+    Record (i, j) is f_i - f_j, so with a zero constant its right side is f_i > f_j and its left side f_j > f_i
+    inside a cell. Along a path these relations chain: a cell below f_i > f_j and f_j > f_k lies entirely on the
+    right side of (i, k), and that record cannot cross it. The order is kept as its transitive closure, below[f]
+    being a bitmask of the functions known to be smaller than f; only functions on the path have an entry, so the
+    order of a node at depth k holds at most 2k masks. Orders are immutable, a child extends its parent's with one
+    record.
+    """
+
+    __slots__ = ("below",)
+
+    def __init__(self, below=None):
+        self.below = below if below is not None else {}
+
+    @classmethod
+    def from_constraints(cls, node_constraints, pairs):
+        """
+        Order implied by a node's signed record IDs.
+        Parameters:
+            node_constraints (list): Signed record IDs of the node.
+            pairs (numpy.ndarray): Function pair (i, j) of every record, row k holding record ID k + 1.
+        """
+        order = cls()
+        for signed_id in node_constraints:
+            order = order.with_record(signed_id, pairs)
+        return order
+
+    def with_record(self, signed_id, pairs):
+        """
+        Order of the cell on the given side of a record.
+        """
+        i, j = pairs[abs(signed_id) - 1].tolist()
+        return self.with_edge(i, j) if signed_id > 0 else self.with_edge(j, i)
+
+    def with_edge(self, high, low):
+        """
+        Order extended by f_high > f_low and everything it implies.
+        """
+        added = self.below.get(low, 0) | (1 << low)
+        below = dict(self.below)
+        for function, mask in below.items():
+            if function == high or mask >> high & 1:
+                below[function] = mask | added
+        below.setdefault(high, added)
+        return FunctionOrder(below)
+
+    def implies(self, i, j):
+        """
+        Sign of f_i - f_j implied by the order.
+        Returns:
+            int: 1 if f_i > f_j, -1 if f_j > f_i, 0 if the order leaves it open.
+        """
+        if self.below.get(i, 0) >> j & 1:
+            return 1
+        if self.below.get(j, 0) >> i & 1:
+            return -1
+        return 0
@@ -1,8 +1,8 @@
+import itertools
 import sqlite3
 import time
 from copy import deepcopy
 
-import cdd
 import numpy as np
 
 from sqlite_utils import read_from_sqlite, SQLiteReader
@@ -28,6 +28,62 @@ def generate_constraints(n, var_min, var_max):
         constraints.append((*upper_bound, var_max))
 
     return constraints
+
+
+def box_bounds(constraints):
+    """
+    Recognise an axis-aligned box, such as the domain from generate_constraints.
+    Constraints are in the format (coe1, ..., coen, constant), meaning A x + b >= 0.
+    Returns:
+        tuple: (lower, upper) arrays of shape (n,), or None if the constraints do not describe a box.
+    """
+    matrix = np.asarray(constraints, dtype=np.float64)
+    if matrix.ndim != 2 or len(matrix) == 0:
+        return None
+    coefficients, constants = matrix[:, :-1], matrix[:, -1]
+    if np.any(np.count_nonzero(coefficients, axis=1) != 1):
+        return None
+
+    n = coefficients.shape[1]
+    lower = np.full(n, -np.inf)
+    upper = np.full(n, np.inf)
+    for row, constant in zip(coefficients, constants):
+        axis = np.flatnonzero(row)[0]
+        bound = -constant / row[axis]
+        if row[axis] > 0:
+            lower[axis] = max(lower[axis], bound)
+        else:
+            upper[axis] = min(upper[axis], bound)
+    if not (np.all(np.isfinite(lower)) and np.all(np.isfinite(upper))):
+        return None
+    return lower, upper
+
+
+def box_vertices(lower, upper):
+    """
+    Enumerate the 2^n corners of a box without cdd, rounded to integers like compute_vertices.
+    """
+    return [[round(coord) for coord in corner] for corner in itertools.product(*zip(lower, upper))]
+
+
+def box_crossing(records, lower, upper):
+    """
+    Vectorized crossing test of records against an axis-aligned box in O(num_records * n).
+    Over a box, a·x ranges from sum(min(a_i * lower_i, a_i * upper_i)) to sum(max(...)), so a record crosses the box
+    when its constant lies strictly between the two, i.e. some corner is strictly on each side as in check_functions.
+    Parameters:
+        records (array-like): Records of shape (num_records, n + 1) as (coefficients..., constant).
+        lower (array-like): Lower corner of the box.
+        upper (array-like): Upper corner of the box.
+    Returns:
+        numpy.ndarray: Boolean mask, True for records whose hyperplane cuts the box.
+    """
+    records = np.asarray(records, dtype=np.float64).reshape(-1, len(lower) + 1)
+    at_lower = records[:, :-1] * np.asarray(lower, dtype=np.float64)
+    at_upper = records[:, :-1] * np.asarray(upper, dtype=np.float64)
+    low = np.minimum(at_lower, at_upper).sum(axis=1)
+    high = np.maximum(at_lower, at_upper).sum(axis=1)
+    return (low < records[:, -1]) & (records[:, -1] < high)
 #
 # def compute_vertices(constraints):
 #     # Define inequalities in the form A x + b > 0
@@ -107,7 +163,7 @@ def check_function(func, vertices, atol=0.0001) -> bool:
     return has_positive and has_negative
 
 
-def merge_constraints(node_constraints, init_constraints, m, n, db_name, conn):
+def merge_constraints(node_constraints, init_constraints, m, n, db_name, conn, records=None):
     """
     Merge node.constraints with init_constraints by fetching records from the database.
     Parameters:
@@ -117,23 +173,25 @@ def merge_constraints(node_constraints, init_constraints, m, n, db_name, conn):
         n (int): Dimension of functions.
         db_name (str): Database file name.
         conn: SQLite database connection.
+        records (numpy.ndarray): Records to use instead of those loaded in SQLiteReader, row i holding record ID i + 1.
     Returns:
         list of tuples: Merged constraints.
     """
     # Deep-copy init_constraints to avoid modifying the original
     merged_constraints = deepcopy(init_constraints)
+    get_record = SQLiteReader.get_record_by_id if records is None else (lambda i: tuple(records[i - 1].tolist()))
 
 
     for record_id in node_constraints:
         # Fetch record from the database
         if record_id < 0:
             # record = FunctionProfiler.read_from_sqlite(m=m, n=n, db_name=db_name, record_id=-record_id, conn=conn)
-            record = SQLiteReader.get_record_by_id(record_id)
+            record = get_record(-record_id)
             # Negate coefficients, keep constant unchanged
             record = tuple(-coeff for coeff in record[:-1]) + (record[-1],)  # Convert to a tuple
         else:
             # record = FunctionProfiler.read_from_sqlite(m=m, n=n, db_name=db_name, record_id=record_id, conn=conn)
-            record = SQLiteReader.get_record_by_id(record_id)
+            record = get_record(record_id)
             # Keep coefficients, negate constant
             record = tuple(record[:-1]) + (-record[-1],)  # Convert to a tuple
 
@@ -144,48 +202,88 @@ def merge_constraints(node_constraints, init_constraints, m, n, db_name, conn):
     return merged_constraints
 
 
-def check_function_tight(func, vertices, atol=0.0001) -> bool:
-    *coefficients, constant = func  # Unpack coefficients and constant
-
-    # Convert coefficients to a NumPy array for vectorized operations
-    coefficients_array = np.array(coefficients)
-    # print("coefficients_array: ", coefficients_array)
-    # print("vertices: ", vertices)
-    counter = 0
-
-    for vertex in vertices:
-        # Convert vertex to a NumPy array
-        vertex_array = np.array(vertex)
-
-        # Evaluate AX - b for the current vertex
-        value = np.dot(coefficients_array, vertex_array) - constant
-
-        # Use np.isclose to check if the value is close to zero
-        if np.isclose(value, 0, atol=atol):
-            counter += 1
+def signed_constraint_rows(node_constraints, records=None):
+    """
+    Vectorized merge_constraints for the record part of a node: one row (a1, ..., ad, b) per signed record ID,
+    meaning a·x + b >= 0, taken from records or else from the records loaded in SQLiteReader.
+    """
+    ids = np.asarray(node_constraints, dtype=np.int64)
+    records = (SQLiteReader.get_records_array() if records is None else records)[np.abs(ids) - 1]
+    signs = np.where(ids < 0, -1.0, 1.0)[:, None]
+    return np.hstack((signs * records[:, :-1], -signs * records[:, -1:]))
 
-        if counter == 2:
-            return True
 
-    # If no crossing is found, return False
-    return False
+def prune_constraints(node_constraints, vertices, init_constraints, atol=1e-4, records=None):
+    """
+    Reduce a node's signed record IDs to the ones whose hyperplanes define a facet of the cell.
 
-def get_tight_constraints(constraints, vertices, m, n, db_name, conn):
-    # print("constraints: ", constraints)
-    # print("vertices: ", vertices)
-    tight_constraints = []
+    A facet of a d-dimensional cell contains at least d of its vertices. compute_vertices rounds coordinates to
+    integers, so a vertex counts as lying on a row when it is within the rounding error of sqrt(d) / 2. Rows with no
+    vertex on them miss the cell and are dropped, and rows with more than d are kept. The remaining, marginal rows
+    (1 to d vertices, which is every row through the apex of a central arrangement) are left to cdd's redundancy
+    check. If that dropped any row, the pruned system must give back the same vertices, or the full list is kept.
 
+    Parameters:
+        node_constraints (list): Signed record IDs of the node.
+        vertices (list): Vertices of the node's cell.
+        init_constraints (list): Constraints of the initial domain.
+        atol (float): Tolerance added to the rounding error.
+        records (numpy.ndarray): Records to use instead of those loaded in SQLiteReader, as for merge_constraints.
+    Returns:
+        list: The facet-defining signed record IDs, in their original order.
+    """
+    if not node_constraints:
+        return []
+
+    rows = signed_constraint_rows(node_constraints, records)
+    d = rows.shape[1] - 1
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, d)
+
+    norms = np.linalg.norm(rows[:, :-1], axis=1)
+    distance = np.abs(vertices @ rows[:, :-1].T + rows[:, -1]) / norms
+    on_row = (distance <= 0.5 * np.sqrt(d) + atol).sum(axis=0)
+    if len(np.unique(vertices, axis=0)) > d:
+        keep = on_row > d
+        marginal = (on_row > 0) & ~keep
+    else:
+        # Too degenerate for counting vertices: cdd decides for every row
+        keep = np.zeros(len(rows), dtype=bool)
+        marginal = ~keep
+
+    if marginal.any():
+        import cdd
+
+        candidates = np.flatnonzero(keep | marginal)
+        matrix = [[constant] + list(coefficients) for *coefficients, constant in init_constraints]
+        matrix += [[row[-1]] + row[:-1].tolist() for row in rows[candidates]]
+        redundant = cdd.redundant_rows(cdd.matrix_from_array(matrix, rep_type=cdd.RepType.INEQUALITY))
+        offset = len(init_constraints)
+        for i, row_index in enumerate(candidates):
+            keep[row_index] = keep[row_index] or i + offset not in redundant
+
+        if (marginal & ~keep).any():
+            pruned = list(init_constraints) + [tuple(row) for row in rows[keep].tolist()]
+            if sorted(FunctionProfiler.compute_vertices(pruned)) != sorted(vertices.tolist()):
+                return list(node_constraints)
+
+    return [record_id for record_id, kept in zip(node_constraints, keep) if kept]
 
-    for record_id in constraints:
-        record = read_from_sqlite(m=m, n=n, db_name=db_name, record_id=abs(record_id), conn=conn)
 
-        if check_function_tight(record, vertices):
-            tight_constraints.append(record_id)
+def check_function_tight(func, vertices, atol=0.0001) -> bool:
+    """
+    Check whether at least two vertices lie on the hyperplane AX = b.
+    """
+    *coefficients, constant = func
+    values = np.asarray(vertices, dtype=np.float64) @ np.asarray(coefficients, dtype=np.float64) - constant
+    return np.count_nonzero(np.isclose(values, 0, atol=atol)) >= 2
 
-    # print("loose_constraints: ", constraints)
-    # print("tight_constraints: ", tight_constraints)
 
-    return tight_constraints
+def get_tight_constraints(constraints, vertices, m, n, db_name, conn, init_constraints=None):
+    """
+    Return the signed record IDs of a node that define a facet of its cell, see prune_constraints.
+    Records are taken from SQLiteReader, so m, n, db_name and conn are only kept for the original call sites.
+    """
+    return prune_constraints(constraints, vertices, init_constraints or [])
 
 
 from decimal import Decimal, getcontext
@@ -231,10 +329,13 @@ class FunctionProfiler:
     total_time_check_function = 0.0
     total_time_read_from_sqlite = 0.0
     total_time_satisfies_all_constraints = 0.0  # New accumulator for satisfies_all_constraints
+    cell_cache = None  # Optional cell_cache.CellCache consulted by compute_cell_vertices
 
     @classmethod
-    def compute_vertices(cls, constraints):
+    def compute_vertices(cls, constraints, round_vertices=True):
         # print("constraints: ", constraints)
+        import cdd  # pycddlib is only loaded by the code paths that enumerate vertices
+
         start_time = time.time()
         try:
             rows = []
@@ -254,7 +355,9 @@ class FunctionProfiler:
             vertices = []
             for row in ext.array:
                 if row[0] == 1.0:  # This indicates a vertex
-                    vertex = [round(coord) for coord in row[1:]]
+                    # Snap float noise first, so that a coordinate at .5 rounds the same way whichever redundant
+                    # rows cdd was given
+                    vertex = [round(round(coord, 6)) for coord in row[1:]] if round_vertices else list(row[1:])
                     # vertex = [coord for coord in row[1:]]
                     vertices.append(vertex)
 
@@ -266,6 +369,28 @@ class FunctionProfiler:
         cls.total_time_compute_vertices += elapsed_time
         return vertices
 
+    @classmethod
+    def compute_cell_vertices(cls, node_constraints, init_constraints, m=None, n=None, db_name=None, conn=None,
+                              records=None):
+        """
+        Compute the vertices of the cell described by a list of signed record IDs within the initial domain.
+        The records are taken from records if given (see merge_constraints), else from SQLiteReader.
+        If a cell cache is set, it is consulted before merging the constraints and calling cdd. Cached vertices are
+        stored sorted, since cdd's order depends on the order of the constraints and the cache key does not; the tree
+        compares vertex lists as multisets, so the order does not change the tree.
+        """
+        if cls.cell_cache is None:
+            merged = merge_constraints(node_constraints, init_constraints, m, n, db_name, conn, records)
+            return cls.compute_vertices(merged)
+
+        key = cls.cell_cache.key(node_constraints, init_constraints, records)
+        vertices = cls.cell_cache.get(key)
+        if vertices is None:
+            merged = merge_constraints(node_constraints, init_constraints, m, n, db_name, conn, records)
+            vertices = sorted(cls.compute_vertices(merged))
+            cls.cell_cache.put(key, vertices)
+        return vertices
+
     # @classmethod
     # def check_function(cls, func, vertices, cache=None) -> bool:
     #     # Convert vertices to a hashable type (tuple of tuples)
@@ -345,6 +470,28 @@ class FunctionProfiler:
 
         return result
 
+    @classmethod
+    def check_functions(cls, records, vertices):
+        """
+        Vectorized check_function for a batch of records against one vertex set.
+        Parameters:
+            records (array-like): Records of shape (num_records, d + 1) as (coefficients..., constant).
+            vertices (array-like): Vertices of shape (num_vertices, d).
+        Returns:
+            numpy.ndarray: Boolean mask, True for records with vertices strictly on both sides.
+        """
+        start_time = time.time()
+
+        records = np.asarray(records, dtype=np.float64).reshape(-1, np.shape(vertices)[-1] + 1)
+        vertices = np.asarray(vertices, dtype=np.float64)
+        # values has shape (num_vertices, num_records); exact zeros lie on the hyperplane and are ignored
+        values = vertices @ records[:, :-1].T - records[:, -1]
+        result = (values > 0).any(axis=0) & (values < 0).any(axis=0)
+
+        elapsed_time = time.time() - start_time
+        cls.total_time_check_function += elapsed_time
+        return result
+
     @classmethod
     def read_from_sqlite(cls, m, n, db_name="test_intersections.db", record_id=None, conn=None):
         """
@@ -385,23 +532,33 @@ class FunctionProfiler:
         Check if the given vertex satisfies all linear inequalities of the form:
         a1*x1 + a2*x2 + ... + c > 0
         """
-        start_time = time.time()
+        return bool(cls.points_satisfying_constraints([vertex], inequalities, atol=atol)[0])
 
-        vertex = tuple(vertex)  # Ensure it's a tuple for consistency
-
-        for constraint in inequalities:
-            *coefficients, c = constraint
-            lhs = sum(coef * v for coef, v in zip(coefficients, vertex)) + c
+    @classmethod
+    def points_satisfying_constraints(cls, points, inequalities, atol=1e-9, strict=True):
+        """
+        Vectorized containment test of a batch of points against linear inequalities of the form:
+        a1*x1 + a2*x2 + ... + c > 0
+        Parameters:
+            points (array-like): Points of shape (num_points, d).
+            inequalities (list of tuples): Inequalities as (a1, ..., ad, c).
+            atol (float): Tolerance on the left-hand side.
+            strict (bool): Require lhs > atol if True, otherwise lhs >= -atol.
+        Returns:
+            numpy.ndarray: Boolean mask of shape (num_points,).
+        """
+        start_time = time.time()
 
-            # Check lhs > 0 with a tolerance
-            if not (lhs > 0 + atol):
-                elapsed_time = time.time() - start_time
-                cls.total_time_satisfies_all_constraints += elapsed_time
-                return False
+        points = np.asarray(points, dtype=np.float64)
+        matrix = np.asarray(inequalities, dtype=np.float64)
+        # lhs has shape (num_points, num_constraints)
+        lhs = points @ matrix[:, :-1].T + matrix[:, -1]
+        mask = (lhs > atol).all(axis=1) if strict else (lhs >= -atol).all(axis=1)
 
         elapsed_time = time.time() - start_time
         cls.total_time_satisfies_all_constraints += elapsed_time
-        return True
+        return mask
+
 # Usage Example:
 # FunctionProfiler.compute_vertices(constraints_list)
 # FunctionProfiler.check_function((1, 2, 3, 4), vertices_list)
@@ -0,0 +1,110 @@
+import numpy as np
+
+STRATEGIES = ("prefix", "shuffle", "interleave", "central", "reservoir")
+
+
+def record_pairs(m):
+    """
+    Return the (i, j) function pair of every record as an array of shape (m * (m - 1) / 2, 2).
+    Row k belongs to record ID k + 1, following the itertools.combinations order used by data_factory.
+    """
+    return np.column_stack(np.triu_indices(m, 1))
+
+
+def reservoir_sample(ids, sample_size, rng):
+    """
+    Draw a uniform sample of sample_size IDs from a stream in one pass (Algorithm R).
+    """
+    reservoir = []
+    for seen, record_id in enumerate(ids):
+        if seen < sample_size:
+            reservoir.append(record_id)
+        else:
+            slot = rng.integers(0, seen + 1)
+            if slot < sample_size:
+                reservoir[slot] = record_id
+    return reservoir
+
+
+def interleaved_order(ids, m, pairs=None):
+    """
+    Order records so that consecutive records involve different functions.
+    Pairs are taken by increasing gap j - i, e.g. (0, 1), (1, 2), (2, 3), ..., (0, 2), (1, 3), ...
+    instead of all pairs of function 0 first.
+    pairs overrides record_pairs(m) for datasets grown by data_factory's append mode (see sqlite_utils.read_pairs).
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    pairs = (record_pairs(m) if pairs is None else np.asarray(pairs))[ids - 1]
+    order = np.lexsort((pairs[:, 0], pairs[:, 1] - pairs[:, 0]))
+    return ids[order]
+
+
+def centrality_scores(records, vertices, num_samples=4096, seed=0, chunk_size=4096):
+    """
+    Estimate how evenly each record splits the root domain.
+    Points are sampled uniformly in the bounding box of the domain vertices and the score is the fraction on the
+    smaller side of the hyperplane, so 0.5 means the record halves the domain and 0 means it barely crosses it.
+    Parameters:
+        records (array-like): Records of shape (num_records, d + 1) as (coefficients..., constant).
+        vertices (array-like): Vertices of the root domain.
+    Returns:
+        numpy.ndarray: Score per record.
+    """
+    records = np.asarray(records, dtype=np.float64)
+    vertices = np.asarray(vertices, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    samples = rng.uniform(vertices.min(axis=0), vertices.max(axis=0), size=(num_samples, vertices.shape[1]))
+
+    scores = np.empty(len(records))
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        positive = (samples @ chunk[:, :-1].T - chunk[:, -1] > 0).mean(axis=0)
+        scores[start:start + chunk_size] = np.minimum(positive, 1 - positive)
+    return scores
+
+
+def order_ids(ids, strategy="prefix", sample_size=None, seed=0, m=None, get_record=None, vertices=None, pairs=None):
+    """
+    Choose which records to insert and in which order.
+    Parameters:
+        ids (list): Candidate record IDs in table order.
+        strategy (str): One of STRATEGIES.
+            prefix: The first sample_size IDs in table order.
+            shuffle: A seeded random permutation, truncated to sample_size.
+            interleave: Pair-interleaved order (see interleaved_order), truncated to sample_size. Needs m.
+            central: Records that split the root domain most evenly first. Needs get_record and vertices.
+            reservoir: A uniform reservoir sample of sample_size IDs drawn in one pass over the stream.
+        sample_size (int): Number of IDs to return, defaults to all.
+        seed (int): Seed for randomised strategies.
+        m (int): Number of functions.
+        get_record (callable): Maps a record ID to its record.
+        vertices (list): Vertices of the root domain.
+        pairs (array-like): Function pair of every record, from sqlite_utils.read_pairs, for the interleave order.
+    Returns:
+        list: Ordered record IDs.
+    """
+    ids = list(ids)
+    if sample_size is None:
+        sample_size = len(ids)
+    rng = np.random.default_rng(seed)
+
+    if strategy == "prefix":
+        ordered = ids
+    elif strategy == "shuffle":
+        ordered = [ids[i] for i in rng.permutation(len(ids))]
+    elif strategy == "interleave":
+        if m is None:
+            raise ValueError("The interleave order needs the number of functions m.")
+        ordered = interleaved_order(ids, m, pairs).tolist()
+    elif strategy == "central":
+        if get_record is None or vertices is None:
+            raise ValueError("The central order needs get_record and the root vertices.")
+        scores = centrality_scores([get_record(record_id) for record_id in ids], vertices, seed=seed)
+        # Stable sort keeps table order among equally central records
+        ordered = [ids[i] for i in np.argsort(-scores, kind="stable")]
+    elif strategy == "reservoir":
+        ordered = reservoir_sample(iter(ids), sample_size, rng)
+    else:
+        raise ValueError(f"Unknown insertion order: {strategy}")
+
+    return ordered[:sample_size]
@@ -0,0 +1,53 @@
+import argparse
+
+from build_pipeline import BuildPipeline
+from insertion_order import STRATEGIES
+
+
+if __name__ == '__main__':
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Compare insertion order strategies and construction engines for the VI tree.")
+    parser.add_argument("m", type=int, help="Number of functions (m)")
+    parser.add_argument("n", type=int, help="Dimension of functions (n)")
+    parser.add_argument("--db", type=str, default="test_intersections.db", help="Database file (default: test_intersections.db)")
+    parser.add_argument("--var_min", type=float, default=0, help="Minimum value for variables (default: 0)")
+    parser.add_argument("--var_max", type=float, default=1000, help="Maximum value for variables (default: 1000)")
+    parser.add_argument("--fraction", type=float, default=0.2, help="Fraction of IDs to insert (default: 0.2)")
+    parser.add_argument("--orders", type=str, nargs="+", default=list(STRATEGIES), choices=STRATEGIES, help="Strategies to compare (default: all)")
+    parser.add_argument("--engines", type=str, nargs="+", default=["insert"], choices=["auto", "insert", "central", "conflict", "min_domain", "itree"], help="Construction engines to compare (default: insert)")
+    parser.add_argument("--bucket_sizes", type=int, nargs="+", default=[0], help="Leaf bucket sizes to compare for the insert and central engines, 0 splits on every record (default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for randomised insertion orders (default: 0)")
+    parser.add_argument("--workers", type=int, default=None, help="Prefilter the records in this many processes while loading them (default: in-process)")
+    parser.add_argument("--chunk_size", type=int, default=1 << 20, help="Records per parallel prefilter task (default: 1048576)")
+    parser.add_argument("--cell_cache", action="store_true", help="Reuse cell vertices across runs through a cache file next to the database (<db>.cells)")
+    parser.add_argument("--cell_cache_size", type=int, default=1000000, help="Cells kept in the cache file (default: 1000000)")
+    args = parser.parse_args()
+
+    m = args.m
+    n = args.n
+
+    # The dataset is loaded and prefiltered once for every strategy and engine
+    pipeline = BuildPipeline(m, n, args.db, args.var_min, args.var_max, workers=args.workers, chunk_size=args.chunk_size,
+                             cell_cache=f"{args.db}.cells" if args.cell_cache else None, cell_cache_size=args.cell_cache_size)
+    sample_size = int(args.fraction * len(pipeline.ids))
+    print(f"Found {len(pipeline.ids)} IDs, {len(pipeline.satisfying_ids)} cross the domain, inserting {sample_size} per strategy.")
+
+    results = []
+    for strategy in args.orders:
+        sampled_ids = pipeline.order(strategy, fraction=args.fraction, seed=args.seed)
+        for engine in args.engines:
+            bucketed = pipeline.resolve(engine) in ("insert", "central")
+            for bucket_size in args.bucket_sizes if bucketed else [0]:
+                vi_tree, _, elapsed = pipeline.build(engine, sampled_ids, bucket_size=bucket_size)
+                tree_stats = vi_tree.stats()
+                results.append((strategy, pipeline.resolve(engine), bucket_size, elapsed, tree_stats["height"],
+                                tree_stats["nodes"], tree_stats["leaves"]))
+                print(f"{strategy}/{engine}/B={bucket_size}: {elapsed:.2f} seconds, height {tree_stats['height']}, "
+                      f"{tree_stats['nodes']} nodes")
+
+    print()
+    print(f"{'order':<12}{'engine':<12}{'bucket':>8}{'time (s)':>10}{'height':>8}{'nodes':>10}{'leaves':>10}")
+    for strategy, engine, bucket_size, elapsed, height, nodes, leaves in results:
+        print(f"{strategy:<12}{engine:<12}{bucket_size:>8}{elapsed:>10.2f}{height:>8}{nodes:>10}{leaves:>10}")
+
+    pipeline.close()
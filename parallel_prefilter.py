@@ -0,0 +1,87 @@
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from function_utils import FunctionProfiler, box_crossing
+
+# Shared record matrix and domain of a worker process, set once by _attach
+_worker = {}
+
+
+def _attach(name, shape, bounds, vertices):
+    shm = shared_memory.SharedMemory(name=name)
+    _worker["shm"] = shm
+    _worker["records"] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _worker["bounds"] = bounds
+    _worker["vertices"] = vertices
+
+
+def _surviving_ids(start, stop):
+    """
+    IDs of the records in rows [start, stop) of the shared matrix that cross the domain.
+    """
+    records = _worker["records"][start:stop]
+    if _worker["bounds"] is not None:
+        mask = box_crossing(records, *_worker["bounds"])
+    else:
+        mask = FunctionProfiler.check_functions(records, _worker["vertices"])
+    return np.flatnonzero(mask) + start + 1
+
+
+def load_and_prefilter(m, n, bounds=None, vertices=None, db_name="test_intersections.db", conn=None,
+                       chunk_size=1 << 20, workers=None):
+    """
+    Load all records of a dataset and find the ones crossing the root domain in a process pool.
+    Records are fetched chunk by chunk into a shared memory matrix and every chunk is handed to the pool as soon as it
+    is written, so the crossing tests overlap with reading the rest of the table.
+    Parameters:
+        m (int): Number of functions.
+        n (int): Dimension of functions.
+        bounds (tuple): Lower and upper corner of a box domain, tested in closed form (see box_crossing).
+        vertices (array-like): Vertices of the domain, used with check_functions when it is not a box.
+        db_name (str): Database file name.
+        conn: SQLite database connection, opened on db_name if not given.
+        chunk_size (int): Records fetched and tested per task.
+        workers (int): Worker processes, os.cpu_count() if not given.
+    Returns:
+        tuple: The records as tuples (without the index), the same records as a float64 array of shape
+            (num_records, n + 1) and the IDs of the records crossing the domain in ascending order.
+    """
+    if bounds is None and vertices is None:
+        raise ValueError("Give the bounds of a box domain or the vertices of the domain.")
+
+    close_conn = False
+    if conn is None:
+        conn = sqlite3.connect(db_name)
+        close_conn = True
+
+    table_name = f"intersections_m{m}_n{n}"
+    num_records = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    shape = (num_records, n + 1)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, num_records * (n + 1) * 8))
+    try:
+        shared = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        records = []
+        tasks = []
+        with ProcessPoolExecutor(workers or os.cpu_count(), initializer=_attach,
+                                 initargs=(shm.name, shape, bounds, vertices)) as pool:
+            cursor = conn.execute(f"SELECT * FROM {table_name}")
+            while rows := cursor.fetchmany(chunk_size):
+                start = len(records)
+                records.extend(tuple(row[1:]) for row in rows)  # Skip index column
+                shared[start:len(records)] = records[start:]
+                tasks.append(pool.submit(_surviving_ids, start, len(records)))
+            satisfying_ids = np.concatenate([task.result() for task in tasks]) if tasks else np.empty(0, dtype=np.int64)
+        records_array = shared.copy()
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+        if close_conn:
+            conn.close()
+
+    print(f"Records loaded from table {table_name}, {len(satisfying_ids)} of {num_records} cross the domain.")
+    return records, records_array, satisfying_ids
@@ -0,0 +1,337 @@
+import asyncio
+import json
+import socket
+import sqlite3
+import time
+from collections import deque
+
+import numpy as np
+
+from sqlite_utils import read_from_sqlite, read_pairs, table_exists
+from tree_query import dataset_pairs, locate_points, top_functions, LeafRankings
+from vi_tree_sqlite import PagedVITree
+
+
+class LoadedDataset:
+    """
+    Records, function pairs and (if one was persisted) the paged VI tree of one dataset, loaded once and shared by
+    every request.
+    """
+
+    def __init__(self, conn, m, n, cache_size=100000):
+        self.m = m
+        self.n = n
+        self.records = np.array(read_from_sqlite(m, n, conn=conn), dtype=np.float64).reshape(-1, n + 1)
+        self.pairs = dataset_pairs(m, read_pairs(m, n, conn=conn))
+        self.tree = PagedVITree(conn, m, n, cache_size=cache_size) if table_exists(conn, f"vitree_m{m}_n{n}_meta") else None
+        self.rankings = None  # LeafRankings, created on the first rank request
+
+    def locate(self, points):
+        if self.tree is None:
+            raise ValueError(f"No persisted tree for m={self.m}, n={self.n}.")
+        leaves = locate_points(self.tree, points, self.records, self.tree.init_constraints)
+        return [None if leaf is None else {"leaf": leaf.node_id, "depth": leaf.depth, "constraints": list(leaf.constraints)}
+                for leaf in leaves]
+
+    def top(self, points, k):
+        top, wins = top_functions(points, self.records, self.pairs, self.m, k)
+        return [{"functions": functions, "wins": counts} for functions, counts in zip(top.tolist(), wins.tolist())]
+
+    def rank(self, points, k):
+        if self.rankings is None:
+            if self.tree is None:
+                raise ValueError(f"No persisted tree for m={self.m}, n={self.n}.")
+            self.rankings = LeafRankings(self.tree, self.records, self.pairs, self.m, self.tree.init_constraints)
+        return [{"functions": functions} for functions in self.rankings.top_k(points, k).tolist()]
+
+
+class RequestBatcher:
+    """
+    Coalesce concurrent requests for the same query into one vectorized call.
+    The first request of a batch starts a timer of window seconds; the batch runs when the timer fires or as soon as
+    it holds max_batch points.
+    """
+
+    def __init__(self, handler, window, max_batch):
+        """
+        Parameters:
+            handler (callable): Maps an array of points to a list with one result per point.
+            window (float): Time in seconds a batch waits for more requests.
+            max_batch (int): Number of points that triggers a batch immediately.
+        """
+        self.handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []  # (points, future) per request
+        self.pending_points = 0
+        self.timer = None
+        self.batches = 0
+        self.batched_points = 0
+
+    def submit(self, points):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((points, future))
+        self.pending_points += len(points)
+        if self.pending_points >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        return future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        pending, self.pending = self.pending, []
+        self.pending_points = 0
+        if not pending:
+            return
+
+        self.batches += 1
+        try:
+            results = self.handler(np.vstack([points for points, _ in pending]))
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batched_points += len(results)
+        start = 0
+        for points, future in pending:
+            if not future.done():
+                future.set_result(results[start:start + len(points)])
+            start += len(points)
+
+
+class LatencyRecorder:
+    """
+    Request latencies over a sliding window of the most recent requests.
+    """
+
+    def __init__(self, window=100000):
+        self.latencies = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.latencies.append(seconds)
+        self.count += 1
+
+    def percentiles(self, quantiles=(50, 90, 99, 99.9)):
+        """
+        Latency percentiles in milliseconds.
+        """
+        if not self.latencies:
+            return {}
+        values = np.percentile(np.fromiter(self.latencies, dtype=np.float64), quantiles) * 1000
+        return {f"p{q:g}": round(float(value), 3) for q, value in zip(quantiles, values)}
+
+
+class QueryServer:
+    """
+    Long-running asyncio service answering point-location and top-function queries over a Unix socket (one JSON
+    object per line) and/or localhost HTTP (POST /query, GET /stats).
+
+    A request looks like {"id": 1, "tree": "m20_n2", "op": "locate", "points": [[x1, x2], ...]}; "point" may be given
+    instead of "points", "tree" may be omitted when a single dataset is loaded, and "top" and "rank" requests take "k".
+    "rank" answers the same question as "top" from the leaf of each point (see tree_query.LeafRankings); it needs a
+    persisted tree and records with zero constants, and returns no win counts.
+    The response echoes the id with a "result" list (one entry per point) or an "error" message.
+    """
+
+    def __init__(self, datasets, window=0.002, max_batch=4096):
+        """
+        Parameters:
+            datasets (dict): Dataset name (e.g. "m20_n2") -> LoadedDataset.
+            window (float): Time in seconds a batch waits for more requests.
+            max_batch (int): Number of points that triggers a batch immediately.
+        """
+        self.datasets = datasets
+        self.window = window
+        self.max_batch = max_batch
+        self.batchers = {}  # (dataset name, op, k) -> RequestBatcher
+        self.latency = LatencyRecorder()
+        self.errors = 0
+
+    def _batcher(self, name, op, k):
+        key = (name, op, k)
+        if key not in self.batchers:
+            dataset = self.datasets[name]
+            if op == "locate":
+                handler = dataset.locate
+            elif op == "top":
+                handler = lambda points: dataset.top(points, k)
+            else:
+                handler = lambda points: dataset.rank(points, k)
+            self.batchers[key] = RequestBatcher(handler, self.window, self.max_batch)
+        return self.batchers[key]
+
+    def stats(self):
+        batches = sum(batcher.batches for batcher in self.batchers.values())
+        points = sum(batcher.batched_points for batcher in self.batchers.values())
+        return {
+            "requests": self.latency.count,
+            "errors": self.errors,
+            "batches": batches,
+            "mean_batch_points": round(points / batches, 2) if batches else 0,
+            "latency_ms": self.latency.percentiles(),
+        }
+
+    async def handle_request(self, request):
+        """
+        Answer one decoded request.
+        """
+        start_time = time.perf_counter()
+        response = {"id": request.get("id")}
+        try:
+            op = request.get("op", "locate")
+            if op == "stats":
+                response["result"] = self.stats()
+                return response
+            if op not in ("locate", "top", "rank"):
+                raise ValueError(f"Unknown op: {op}")
+
+            name = request.get("tree")
+            if name is None:
+                if len(self.datasets) != 1:
+                    raise ValueError(f"Specify a tree, one of {sorted(self.datasets)}.")
+                name = next(iter(self.datasets))
+            if name not in self.datasets:
+                raise ValueError(f"Unknown tree: {name}")
+
+            points = request["points"] if "points" in request else [request["point"]]
+            points = np.asarray(points, dtype=np.float64).reshape(len(points), self.datasets[name].n)
+            k = int(request.get("k", 1)) if op in ("top", "rank") else None
+            response["result"] = await self._batcher(name, op, k).submit(points)
+        except Exception as e:
+            self.errors += 1
+            response["error"] = str(e)
+        self.latency.add(time.perf_counter() - start_time)
+        return response
+
+    async def _answer_line(self, line, writer):
+        try:
+            response = await self.handle_request(json.loads(line))
+        except json.JSONDecodeError as e:
+            self.errors += 1
+            response = {"id": None, "error": f"Invalid JSON: {e}"}
+        writer.write(json.dumps(response).encode() + b"\n")
+
+    async def handle_stream(self, reader, writer):
+        """
+        Newline-delimited JSON over a stream. Requests on one connection run concurrently, so they can share a batch,
+        and responses are written as they complete.
+        """
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(self._answer_line(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def handle_http(self, reader, writer):
+        """
+        Minimal HTTP/1.1 with keep-alive: POST /query with a JSON request body, GET /stats.
+        """
+        try:
+            while request_line := await reader.readline():
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (header := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    key, _, value = header.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if method == "GET" and path == "/stats":
+                    status, payload = "200 OK", {"result": self.stats()}
+                elif method == "POST" and path == "/query":
+                    try:
+                        payload = await self.handle_request(json.loads(body))
+                        status = "200 OK" if "error" not in payload else "400 Bad Request"
+                    except json.JSONDecodeError as e:
+                        self.errors += 1
+                        status, payload = "400 Bad Request", {"error": f"Invalid JSON: {e}"}
+                else:
+                    status, payload = "404 Not Found", {"error": f"No route for {method} {path}"}
+
+                content = json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(content)}\r\n\r\n".encode() + content)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=None, port=None):
+        """
+        Serve until cancelled on a Unix socket, a localhost HTTP port, or both.
+        """
+        servers = []
+        if socket_path is not None:
+            servers.append(await asyncio.start_unix_server(self.handle_stream, path=socket_path))
+            print(f"Listening on unix socket {socket_path}")
+        if port is not None:
+            servers.append(await asyncio.start_server(self.handle_http, host="127.0.0.1", port=port))
+            print(f"Listening on http://127.0.0.1:{port}")
+        if not servers:
+            raise ValueError("Give a socket path, a port, or both.")
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+def load_datasets(db_name, trees, cache_size=100000):
+    """
+    Load the datasets of a list of (m, n) pairs from one database.
+    Returns:
+        dict: Dataset name (e.g. "m20_n2") -> LoadedDataset.
+    """
+    conn = sqlite3.connect(db_name)
+    return {f"m{m}_n{n}": LoadedDataset(conn, m, n, cache_size) for m, n in trees}
+
+
+class QueryClient:
+    """
+    Blocking client for the Unix socket of a QueryServer, for use from worker processes.
+    """
+
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.stream = self.sock.makefile("rwb")
+        self.next_id = 0
+
+    def request(self, **request):
+        self.next_id += 1
+        request["id"] = self.next_id
+        self.stream.write(json.dumps(request).encode() + b"\n")
+        self.stream.flush()
+        response = json.loads(self.stream.readline())
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def locate(self, points, tree=None):
+        return self.request(op="locate", points=np.asarray(points).tolist(), tree=tree)
+
+    def top(self, points, k=1, tree=None):
+        return self.request(op="top", points=np.asarray(points).tolist(), k=k, tree=tree)
+
+    def rank(self, points, k=1, tree=None):
+        return self.request(op="rank", points=np.asarray(points).tolist(), k=k, tree=tree)
+
+    def stats(self):
+        return self.request(op="stats")
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
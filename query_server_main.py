@@ -0,0 +1,29 @@
+import argparse
+import asyncio
+
+from query_server import QueryServer, load_datasets
+
+if __name__ == '__main__':
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Serve point-location and top-function queries on persisted VI trees.")
+    parser.add_argument("--db", type=str, default="test_intersections.db", help="Database file (default: test_intersections.db)")
+    parser.add_argument("--tree", type=int, nargs=2, action="append", metavar=("M", "N"), required=True, help="Dataset to load, repeat for several (trees built with vi_tree_main.py --engine paged)")
+    parser.add_argument("--socket", type=str, default=None, help="Unix socket path for newline-delimited JSON requests")
+    parser.add_argument("--port", type=int, default=None, help="Localhost HTTP port (POST /query, GET /stats)")
+    parser.add_argument("--window_ms", type=float, default=2.0, help="Time a batch waits for concurrent requests, in ms (default: 2)")
+    parser.add_argument("--max_batch", type=int, default=4096, help="Points that trigger a batch immediately (default: 4096)")
+    parser.add_argument("--cache_size", type=int, default=100000, help="Tree nodes kept in memory per dataset (default: 100000)")
+    args = parser.parse_args()
+
+    datasets = load_datasets(args.db, args.tree, args.cache_size)
+    for name, dataset in datasets.items():
+        leaves = "no tree" if dataset.tree is None else f"{dataset.tree.get_leaf_count()} leaves"
+        print(f"Loaded {name}: {len(dataset.records)} records, {leaves}")
+
+    server = QueryServer(datasets, window=args.window_ms / 1000, max_batch=args.max_batch)
+    try:
+        asyncio.run(server.serve(args.socket, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Query statistics:", server.stats())
@@ -1,4 +1,3 @@
-from scipy.optimize import linprog
 import numpy as np
 import time
 
@@ -45,6 +44,8 @@ def check_constraints_feasibility(constraints, function, var_min, var_max):
         # Set variable bounds based on var_min and var_max
         var_bounds = [(var_min, var_max)] * num_vars
 
+        from scipy.optimize import linprog
+
         # Solve for minimum value of the function
         result_min = linprog(function_coefficients, A_ub=A_ub, b_ub=b_ub, bounds=var_bounds, method='highs')
 
@@ -1,5 +1,7 @@
 import sqlite3
 
+import numpy as np
+
 
 def save_to_sqlite(records, m, n, db_name="test_intersections.db"):
     """
@@ -35,6 +37,66 @@ def save_to_sqlite(records, m, n, db_name="test_intersections.db"):
     print(f"Data saved to table {table_name} in {db_name} with an index on the ID column.")
 
 
+def save_functions(functions, m, n, db_name="test_intersections.db", conn=None):
+    """
+    Save the functions of a dataset to the functions_m{m}_n{n} table, one row per function in index order.
+    They are needed to append functions to the dataset later on.
+    """
+    close_conn = False
+    if conn is None:
+        conn = sqlite3.connect(db_name)
+        close_conn = True
+
+    table_name = f"functions_m{m}_n{n}"
+    columns = ", ".join([f"coe{i} INTEGER" for i in range(1, n + 1)])
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} (id INTEGER PRIMARY KEY, {columns})")
+    placeholders = ", ".join(["?"] * (n + 1))
+    conn.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})",
+                     [(i, *function) for i, function in enumerate(functions)])
+    conn.commit()
+
+    if close_conn:
+        conn.close()
+
+
+def save_pairs(pairs, m, n, db_name="test_intersections.db", conn=None):
+    """
+    Save the (i, j) function pair of every record to the pairs_m{m}_n{n} table, row k for record ID k + 1.
+    """
+    close_conn = False
+    if conn is None:
+        conn = sqlite3.connect(db_name)
+        close_conn = True
+
+    table_name = f"pairs_m{m}_n{n}"
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} (id INTEGER PRIMARY KEY, i INTEGER, j INTEGER)")
+    conn.executemany(f"INSERT INTO {table_name} VALUES (?, ?, ?)",
+                     [(record_id, int(i), int(j)) for record_id, (i, j) in enumerate(pairs, start=1)])
+    conn.commit()
+
+    if close_conn:
+        conn.close()
+
+
+def read_functions(m, n, db_name="test_intersections.db", conn=None):
+    """
+    Read the functions of a dataset in index order, or None if the dataset has no functions table.
+    """
+    close_conn = False
+    if conn is None:
+        conn = sqlite3.connect(db_name)
+        close_conn = True
+
+    try:
+        table_name = f"functions_m{m}_n{n}"
+        if not table_exists(conn, table_name):
+            return None
+        return [list(row[1:]) for row in conn.execute(f"SELECT * FROM {table_name} ORDER BY id")]
+    finally:
+        if close_conn:
+            conn.close()
+
+
 def read_from_sqlite(m, n, db_name="test_intersections.db", record_id=None, conn=None):
     """
     Read records from a dynamically named SQLite table based on m and n.
@@ -67,6 +129,65 @@ def read_from_sqlite(m, n, db_name="test_intersections.db", record_id=None, conn
 
 
 
+def read_many_from_sqlite(m, n, record_ids, db_name="test_intersections.db", conn=None, chunk_size=900):
+    """
+    Read a batch of records by ID with one query per chunk of IDs.
+    Chunks stay below SQLite's default limit on bound parameters.
+    Returns a dict mapping each found ID to its record (without the index) as a tuple.
+    """
+    close_conn = False
+    if conn is None:
+        conn = sqlite3.connect(db_name)
+        close_conn = True
+
+    cursor = conn.cursor()
+    table_name = f"intersections_m{m}_n{n}"
+
+    record_ids = list(dict.fromkeys(record_ids))  # Drop duplicates, keep order
+    result = {}
+    for start in range(0, len(record_ids), chunk_size):
+        chunk = record_ids[start:start + chunk_size]
+        placeholders = ", ".join(["?"] * len(chunk))
+        cursor.execute(f"SELECT * FROM {table_name} WHERE id IN ({placeholders})", chunk)
+        for row in cursor.fetchall():
+            result[row[0]] = tuple(row[1:])
+
+    if close_conn:
+        conn.close()
+
+    return result
+
+
+def table_exists(conn, table_name):
+    """
+    Check whether a table exists in the database.
+    """
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()
+    return row is not None
+
+
+def read_pairs(m, n, db_name="test_intersections.db", conn=None):
+    """
+    Read the (i, j) function pair of every record from the pairs_m{m}_n{n} table written by data_factory.
+    Returns an int64 array of shape (num_records, 2) where row k belongs to record ID k + 1, or None if the dataset has
+    no pairs table, in which case records follow the itertools.combinations order (see insertion_order.record_pairs).
+    """
+    close_conn = False
+    if conn is None:
+        conn = sqlite3.connect(db_name)
+        close_conn = True
+
+    try:
+        table_name = f"pairs_m{m}_n{n}"
+        if not table_exists(conn, table_name):
+            return None
+        rows = conn.execute(f"SELECT i, j FROM {table_name} ORDER BY id").fetchall()
+        return np.array(rows, dtype=np.int64).reshape(-1, 2)
+    finally:
+        if close_conn:
+            conn.close()
+
+
 def get_all_ids(m, n, db_name="test_intersections.db"):
     """
     Fetch all IDs from the specified table.
@@ -90,6 +211,7 @@ class SQLiteReader:
     Class to read records from SQLite and store them in a class variable.
     """
     records = []  # Class variable to store all fetched records
+    records_array = None  # Cached NumPy copy of records, built on first use
 
     @classmethod
     def read_all_from_sqlite(cls, m, n, db_name="test_intersections.db", conn=None):
@@ -108,14 +230,24 @@ class SQLiteReader:
         try:
             cursor.execute(f"SELECT * FROM {table_name}")
             cls.records = [tuple(row[1:]) for row in cursor.fetchall()]  # Skip index column
+            cls.records_array = None
             print(f"Records loaded from table {table_name}.")
         except sqlite3.OperationalError as e:
             print(f"Error reading table {table_name}: {e}")
             cls.records = []  # Reset records if there's an error
+            cls.records_array = None
         finally:
             if close_conn:
                 conn.close()
 
+    @classmethod
+    def set_records(cls, records, records_array=None):
+        """
+        Store records loaded elsewhere, e.g. by parallel_prefilter.load_and_prefilter, and optionally their array.
+        """
+        cls.records = records
+        cls.records_array = records_array
+
     @classmethod
     def get_records(cls):
         """
@@ -123,6 +255,31 @@ class SQLiteReader:
         """
         return cls.records
 
+    @classmethod
+    def get_records_array(cls):
+        """
+        Return all records as a float64 array of shape (num_records, n + 1), where row i holds record ID i + 1.
+        """
+        if cls.records_array is None:
+            cls.records_array = np.array(cls.records, dtype=np.float64).reshape(len(cls.records), -1)
+        return cls.records_array
+
+    @classmethod
+    def update_record(cls, record_id, record, m=None, n=None, conn=None):
+        """
+        Replace a loaded record, and its row in the table if a connection and the table's m and n are given.
+        """
+        record = tuple(record)
+        cls.records[record_id - 1] = record
+        if cls.records_array is not None:
+            cls.records_array[record_id - 1] = record
+
+        if conn is not None and m is not None and n is not None:
+            table_name = f"intersections_m{m}_n{n}"
+            columns = ", ".join([f"coe{i} = ?" for i in range(1, len(record))] + ["constant = ?"])
+            conn.execute(f"UPDATE {table_name} SET {columns} WHERE id = ?", (*record, record_id))
+            conn.commit()
+
     @classmethod
     def get_record_by_id(cls, record_id):
         """
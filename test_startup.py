@@ -0,0 +1,68 @@
+import json
+import os
+import subprocess
+import sys
+
+# Command-line entry points and the start-up budget each of them must meet
+ENTRY_POINTS = [
+    "vi_tree_main.py",
+    "vi_tree_main_on_demand.py",
+    "vi_tree_min_domain_main.py",
+    "vi_tree_edge_main.py",
+    "i_tree_main.py",
+    "insertion_order_main.py",
+    "query_server_main.py",
+    "data_factory.py",
+]
+STARTUP_BUDGET = 1.0  # Seconds from the first import to argument parsing
+MODULE_BUDGET = 400  # Entries in sys.modules at that point
+HEAVY_MODULES = ["matplotlib", "scipy", "cdd", "tqdm"]
+
+# Runs an entry point with --help in a fresh interpreter and reports the import time and the loaded modules
+PROBE = """
+import contextlib, io, json, runpy, sys, time
+script = sys.argv[1]
+sys.argv = [script, "--help"]
+start_time = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit:
+        pass
+print(json.dumps({"elapsed": time.perf_counter() - start_time, "modules": sorted(sys.modules)}))
+"""
+
+
+def probe_startup(script):
+    """
+    Start an entry point in a new process and stop it at argument parsing.
+    Returns:
+        dict: Start-up time in seconds ("elapsed") and the names of the imported modules ("modules").
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-c", PROBE, script], cwd=directory, capture_output=True, text=True,
+                            check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check_startup(script):
+    report = probe_startup(script)
+    heavy = [name for name in HEAVY_MODULES if name in report["modules"]]
+    assert not heavy, f"{script} imports {heavy} at start-up"
+    assert len(report["modules"]) <= MODULE_BUDGET, f"{script} imports {len(report['modules'])} modules"
+    assert report["elapsed"] <= STARTUP_BUDGET, f"{script} takes {report['elapsed']:.2f} s to start"
+    return report
+
+
+def test_startup():
+    """
+    Every entry point starts within the time and module budget without loading the heavy dependencies.
+    """
+    for script in ENTRY_POINTS:
+        check_startup(script)
+
+
+if __name__ == "__main__":
+    for script in ENTRY_POINTS:
+        report = check_startup(script)
+        print(f"{script}: {report['elapsed']:.3f} seconds, {len(report['modules'])} modules")
@@ -0,0 +1,90 @@
+import itertools
+import os
+import random
+import tempfile
+
+import numpy as np
+
+from build_pipeline import BuildPipeline
+from data_factory import generate_functions, compute_differences_with_constants
+from sqlite_utils import save_to_sqlite, save_pairs
+
+# Small dataset with constants, so that cells are small enough for the integer vertex rounding to matter
+M, N = 10, 3
+CONSTANT_HIGH = 50
+DELETIONS = 5
+
+
+def create_dataset(db_name, m=M, n=N, constant_high=CONSTANT_HIGH, seed=0):
+    """
+    Write a reproducible random dataset to db_name.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    functions = generate_functions(m, n)
+    save_to_sqlite(compute_differences_with_constants(functions, 0, constant_high), m, n, db_name)
+    save_pairs(itertools.combinations(range(m), 2), m, n, db_name)
+
+
+def leaf_cells(tree):
+    """
+    Signed record IDs and bucket of every leaf, independent of node IDs and traversal order.
+    """
+    tree.flush_buffers()
+    cells = []
+    stack = [tree.root]
+    while stack:
+        node = stack.pop()
+        if node.left_children is None and node.right_children is None:
+            cells.append((tuple(sorted(node.constraints)), tuple(node.bucket)))
+        else:
+            stack.append(node.left_children)
+            stack.append(node.right_children)
+    return sorted(cells)
+
+
+def check_delete_matches_rebuild(constant_high=CONSTANT_HIGH, **options):
+    """
+    Delete every third record one at a time and compare the tree with one built without the deleted records.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        db_name = os.path.join(directory, "delete.db")
+        create_dataset(db_name, constant_high=constant_high)
+        pipeline = BuildPipeline(M, N, db_name)
+        try:
+            record_ids = pipeline.order(fraction=1.0)
+            tree = pipeline.build("insert", record_ids, **options).tree
+            remaining = list(record_ids)
+            for record_id in record_ids[1::3][:DELETIONS]:
+                tree.delete(record_id)
+                remaining.remove(record_id)
+                rebuilt = pipeline.build("insert", remaining, **options).tree
+                assert leaf_cells(tree) == leaf_cells(rebuilt), f"tree differs from a rebuild after deleting {record_id}"
+        finally:
+            pipeline.close()
+
+
+def test_delete_matches_rebuild():
+    check_delete_matches_rebuild()
+
+
+def test_delete_matches_rebuild_with_buckets():
+    for bucket_size in (2, 4):
+        check_delete_matches_rebuild(bucket_size=bucket_size)
+
+
+def test_delete_matches_rebuild_with_buckets_and_buffers():
+    check_delete_matches_rebuild(bucket_size=2, buffer_size=3)
+
+
+def test_delete_matches_rebuild_with_transitivity():
+    # Transitivity needs zero constants
+    check_delete_matches_rebuild(constant_high=0, transitivity=True)
+
+
+if __name__ == "__main__":
+    test_delete_matches_rebuild()
+    test_delete_matches_rebuild_with_buckets()
+    test_delete_matches_rebuild_with_buckets_and_buffers()
+    test_delete_matches_rebuild_with_transitivity()
+    print("Delete matches a rebuild.")
@@ -0,0 +1,61 @@
+import os
+import tempfile
+
+from build_pipeline import BuildPipeline
+from test_vi_tree_delete import create_dataset
+
+# Zero constants make every hyperplane pass through the origin, so most rows touch a cell in one vertex only
+M, N = 20, 3
+VAR_MAX = 100
+FRACTION = 0.3
+SEEDS = (3, 4)
+
+
+def leaf_vertices(tree):
+    """
+    Vertex multiset of every leaf. Pruned trees keep fewer signed record IDs, so leaves are compared by their cells.
+    """
+    tree.flush_buffers()
+    cells = []
+    stack = [tree.root]
+    while stack:
+        node = stack.pop()
+        if node.left_children is None and node.right_children is None:
+            cells.append(tuple(sorted(tuple(vertex) for vertex in tree.get_vertices(node))))
+        else:
+            stack.append(node.left_children)
+            stack.append(node.right_children)
+    return sorted(cells)
+
+
+def check_prune_matches_full(engine, seed):
+    """
+    Build the same records with and without pruned constraints and compare the leaves.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        db_name = os.path.join(directory, "prune.db")
+        create_dataset(db_name, M, N, constant_high=0, seed=seed)
+        pipeline = BuildPipeline(M, N, db_name, var_max=VAR_MAX)
+        try:
+            record_ids = pipeline.order(fraction=FRACTION)
+            full = pipeline.build(engine, record_ids).tree
+            pruned = pipeline.build(engine, record_ids, prune_constraints=True).tree
+            assert leaf_vertices(pruned) == leaf_vertices(full), f"pruned {engine} tree differs for seed {seed}"
+        finally:
+            pipeline.close()
+
+
+def test_prune_matches_full_on_central_data():
+    for seed in SEEDS:
+        check_prune_matches_full("insert", seed)
+
+
+def test_prune_matches_full_on_central_tree():
+    for seed in SEEDS:
+        check_prune_matches_full("central", seed)
+
+
+if __name__ == "__main__":
+    test_prune_matches_full_on_central_data()
+    test_prune_matches_full_on_central_tree()
+    print("Pruned constraints give the same trees.")
@@ -0,0 +1,153 @@
+import json
+from collections import deque, namedtuple
+
+import numpy as np
+
+from sqlite_utils import read_many_from_sqlite
+
+# Compact description of one tree node. Node IDs are the creation order assigned by TreeStats and parent_id is -1 for the root.
+NodeRecord = namedtuple("NodeRecord", ["node_id", "parent_id", "depth", "intersection_id", "is_leaf", "vertices"])
+
+
+def iter_nodes(tree, order="level"):
+    """
+    Walk a VI/I tree without recursion and yield one NodeRecord per node.
+    Works with every tree class whose nodes expose left_children and right_children.
+    Parameters:
+        tree: Tree with a root attribute.
+        order (str): "level" for level-order (layer by layer) or "dfs" for pre-order depth-first.
+    Yields:
+        NodeRecord: The node's ID, its parent's ID, depth, intersection ID, leaf flag and vertices.
+    """
+    if order not in ("level", "dfs"):
+        raise ValueError(f"Unknown traversal order: {order}")
+    if tree.root is None:
+        return
+
+    # The frontier holds (node, parent_id, depth); a deque gives O(1) pops from either end
+    frontier = deque([(tree.root, -1, 0)])
+    pop = frontier.popleft if order == "level" else frontier.pop
+    buffers = getattr(tree, "buffers", None)
+
+    while frontier:
+        node, parent_id, depth = pop()
+        if buffers and node in buffers:
+            # Records still buffered at the node (see VITree.flush_node) are pushed down before it is exported
+            tree.flush_node(node)
+
+        children = [child for child in (node.left_children, node.right_children) if child is not None]
+        # Trees with a memory budget may have evicted the vertices, get_vertices recomputes them
+        vertices = tree.get_vertices(node) if hasattr(tree, "get_vertices") else node.vertices
+        yield NodeRecord(node.node_id, parent_id, depth, node.intersection_id, not children, vertices)
+
+        # Push right first in DFS so that the left child is visited first
+        for child in (children if order == "level" else reversed(children)):
+            frontier.append((child, node.node_id, depth + 1))
+
+
+def iter_node_batches(tree, m, n, db_name=None, conn=None, order="level", batch_size=1024):
+    """
+    Group NodeRecords into batches and fetch the records of each batch with one query.
+    Yields:
+        list of (NodeRecord, tuple): Nodes paired with their (positive-ID) database record.
+    """
+    batch = []
+    for node_record in iter_nodes(tree, order):
+        batch.append(node_record)
+        if len(batch) == batch_size:
+            yield _attach_records(batch, m, n, db_name, conn)
+            batch = []
+    if batch:
+        yield _attach_records(batch, m, n, db_name, conn)
+
+
+def _attach_records(batch, m, n, db_name, conn):
+    records = read_many_from_sqlite(m, n, [abs(node.intersection_id) for node in batch], db_name=db_name, conn=conn)
+    return [(node, records.get(abs(node.intersection_id))) for node in batch]
+
+
+def write_jsonl(tree, path, m, n, db_name=None, conn=None, order="level", batch_size=1024):
+    """
+    Stream the tree to a JSON Lines file, one node per line.
+    Returns:
+        int: Number of nodes written.
+    """
+    count = 0
+    with open(path, "w") as f:
+        for batch in iter_node_batches(tree, m, n, db_name, conn, order, batch_size):
+            for node, record in batch:
+                f.write(json.dumps({
+                    "node_id": node.node_id,
+                    "parent_id": node.parent_id,
+                    "depth": node.depth,
+                    "intersection_id": node.intersection_id,
+                    "is_leaf": node.is_leaf,
+                    "vertices": [list(vertex) for vertex in node.vertices],
+                    "record": record,
+                }) + "\n")
+                count += 1
+    return count
+
+
+def write_npz_chunks(tree, path_prefix, m, n, db_name=None, conn=None, order="level", chunk_size=65536):
+    """
+    Stream the tree to a sequence of compressed .npz files of at most chunk_size nodes each.
+    Each file holds per-node arrays (node_id, parent_id, depth, intersection_id, is_leaf, records) and the
+    vertices of all nodes stacked into one (num_vertices, n) array, split by vertex_offsets.
+    Returns:
+        list of str: Paths of the written files.
+    """
+    paths = []
+    for batch in iter_node_batches(tree, m, n, db_name, conn, order, chunk_size):
+        nodes = [node for node, _ in batch]
+        vertex_counts = [len(node.vertices) for node in nodes]
+        vertices = [list(vertex) for node in nodes for vertex in node.vertices]
+        missing = (np.nan,) * (n + 1)
+
+        path = f"{path_prefix}_{len(paths):05d}.npz"
+        np.savez_compressed(
+            path,
+            node_id=np.array([node.node_id for node in nodes], dtype=np.int64),
+            parent_id=np.array([node.parent_id for node in nodes], dtype=np.int64),
+            depth=np.array([node.depth for node in nodes], dtype=np.int32),
+            intersection_id=np.array([node.intersection_id for node in nodes], dtype=np.int64),
+            is_leaf=np.array([node.is_leaf for node in nodes], dtype=bool),
+            vertex_offsets=np.concatenate(([0], np.cumsum(vertex_counts))).astype(np.int64),
+            vertices=np.array(vertices, dtype=np.float64).reshape(-1, n),
+            records=np.array([record if record is not None else missing for _, record in batch], dtype=np.float64),
+        )
+        paths.append(path)
+    return paths
+
+
+def export_tree(tree, path, m, n, db_name=None, conn=None, order="level"):
+    """
+    Export a tree to JSON Lines if path ends with .jsonl, otherwise to chunked .npz files using path as prefix.
+    """
+    if path.endswith(".jsonl"):
+        count = write_jsonl(tree, path, m, n, db_name, conn, order)
+        print(f"Exported {count} nodes to {path}")
+    else:
+        prefix = path[:-len(".npz")] if path.endswith(".npz") else path
+        paths = write_npz_chunks(tree, prefix, m, n, db_name, conn, order)
+        print(f"Exported tree to {len(paths)} chunk(s) with prefix {prefix}")
+
+
+def print_tree_by_layer(tree, m, n, db_name, conn, batch_size=1024):
+    """
+    Print the tree layer by layer, showing each node's ID, vertices, and database record.
+    Nodes are streamed, so memory stays bounded by the widest layer rather than the whole tree.
+    """
+    if tree.root is None:
+        print("The tree is empty.")
+        return
+
+    current_layer = None
+    for batch in iter_node_batches(tree, m, n, db_name, conn, "level", batch_size):
+        for node, record in batch:
+            if node.depth != current_layer:
+                if current_layer is not None:
+                    print()  # Blank line between layers
+                current_layer = node.depth
+                print(f"Layer {current_layer}:")
+            print(f"Node ID: {node.intersection_id}, Vertices: {node.vertices}, Record: {record}")
@@ -0,0 +1,295 @@
+import numpy as np
+
+from function_order import FunctionOrder
+from function_utils import FunctionProfiler
+from insertion_order import record_pairs
+
+
+def locate_points(tree, points, records, init_constraints=None):
+    """
+    Find the leaf cell of a batch of points with one descent of the tree.
+    Points travel down in groups: at every split node the group is partitioned by the sign of the splitting record,
+    with points on the hyperplane going to the right (non-negative) side as in vi_tree_on_demand.
+    Parameters:
+        tree: VI tree with a root whose right child carries the positive splitting record ID.
+        points (array-like): Points of shape (num_points, d).
+        records (numpy.ndarray): Records of the dataset, row i holding record ID i + 1.
+        init_constraints (list): Constraints of the initial domain; points outside it map to None.
+    Returns:
+        list: One leaf node or None per point, in query order.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, records.shape[1] - 1)
+    leaves = [None] * len(points)
+    if tree.root is None:
+        return leaves
+
+    point_ids = np.arange(len(points))
+    if init_constraints:
+        point_ids = point_ids[FunctionProfiler.points_satisfying_constraints(points, init_constraints, strict=False)]
+
+    buffers = getattr(tree, "buffers", None)
+    stack = [(tree.root, point_ids)]
+    while stack:
+        node, point_ids = stack.pop()
+        if point_ids.size == 0:
+            continue
+        if buffers and node in buffers:
+            # Records pending at the node are pushed down before the query looks at its children
+            tree.flush_node(node)
+        left, right = node.left_children, node.right_children
+        if left is None and right is None:
+            for point_id in point_ids.tolist():
+                leaves[point_id] = node
+            continue
+
+        record = records[abs(right.intersection_id) - 1]
+        on_right = points[point_ids] @ record[:-1] - record[-1] >= 0
+        stack.append((left, point_ids[~on_right]))
+        stack.append((right, point_ids[on_right]))
+    return leaves
+
+
+def bucket_signs(leaf, points, records):
+    """
+    Resolve the bucket of a leaf of a bucketed VI tree for points located in it, with one matrix product.
+    Parameters:
+        leaf: Leaf node returned by locate_points.
+        points (array-like): Points of shape (num_points, d) inside the leaf's cell.
+        records (numpy.ndarray): Records of the dataset, row i holding record ID i + 1.
+    Returns:
+        numpy.ndarray: Signed record IDs of shape (num_points, bucket size), positive for points on the right
+            (non-negative) side of a record. Together with leaf.constraints a row gives the full signed path of a point.
+    """
+    ids = np.asarray(getattr(leaf, "bucket", []), dtype=np.int64)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, records.shape[1] - 1)
+    bucket_records = records[ids - 1]
+    on_right = points @ bucket_records[:, :-1].T - bucket_records[:, -1] >= 0
+    return np.where(on_right, ids, -ids)
+
+
+ROUNDING_SLACK = 0.5  # Node vertices are rounded to integers, so each coordinate may be off by up to half a unit
+
+
+def box_constraints(lower, upper):
+    """
+    Constraints of the box [lower, upper] in the format of generate_constraints, with a bound per axis.
+    """
+    constraints = []
+    for axis, (low, high) in enumerate(zip(lower, upper)):
+        unit = [0] * len(lower)
+        unit[axis] = 1
+        constraints.append((*unit, -low))
+        unit[axis] = -1
+        constraints.append((*unit, high))
+    return constraints
+
+
+def _record_rows(node_constraints, records):
+    """
+    Rows (a1, ..., ad, b) meaning a·x + b >= 0 of a node's signed record IDs, as in signed_constraint_rows.
+    """
+    ids = np.asarray(node_constraints, dtype=np.int64)
+    signs = np.where(ids < 0, -1.0, 1.0)[:, None]
+    rows = records[np.abs(ids) - 1]
+    return np.hstack((signs * rows[:, :-1], -signs * rows[:, -1:]))
+
+
+def cells_in_polytope(tree, region, records, init_constraints=None, atol=1e-9, get_vertices=None,
+                      rounding=ROUNDING_SLACK):
+    """
+    Stream the leaves whose cells intersect a convex query region, without sampling points.
+    A subtree is pruned when the region lies strictly on the other side of its splitting record (tested on the
+    region's vertices), when the bounding box of the node's vertices misses the region's, or when all node vertices
+    violate one of the region's constraints. The last two tests allow for the rounding of node vertices. A leaf
+    that survives is reported if a region vertex lies in its cell or, failing that, if cdd finds a vertex of the cell
+    intersected with the region; cells touching the region on their boundary count as intersecting.
+    Parameters:
+        tree: VI tree with a root whose right child carries the positive splitting record ID.
+        region (list): Constraints (a1, ..., ad, b) meaning a·x + b >= 0, as from generate_constraints.
+        records (numpy.ndarray): Records of the dataset, row i holding record ID i + 1.
+        init_constraints (list): Constraints of the initial domain, which also bounds the region.
+        atol (float): Tolerance of the side and containment tests.
+        get_vertices (callable): Node -> points whose convex hull contains the node's cell, used by the pruning
+            tests and yielded for leaves; the tree's get_vertices (or the node's vertices) if None.
+        rounding (float): Largest error of a vertex coordinate returned by get_vertices.
+    Yields:
+        tuple: Node ID and vertex array of each leaf meeting the region.
+    """
+    if tree.root is None:
+        return
+    d = records.shape[1] - 1
+    region = np.asarray(region, dtype=np.float64).reshape(-1, d + 1)
+    domain = np.asarray(init_constraints if init_constraints else [], dtype=np.float64).reshape(-1, d + 1)
+    bounded_region = np.vstack((domain, region))
+    region_vertices = np.asarray(FunctionProfiler.compute_vertices(bounded_region.tolist(), round_vertices=False),
+                                 dtype=np.float64).reshape(-1, d)
+    if len(region_vertices) == 0:
+        return
+    lower, upper = region_vertices.min(axis=0), region_vertices.max(axis=0)
+    slack = rounding * np.abs(region[:, :-1]).sum(axis=1)
+    if get_vertices is None:
+        get_vertices = getattr(tree, "get_vertices", lambda node: node.vertices)
+    buffers = getattr(tree, "buffers", None)
+
+    stack = [tree.root]
+    while stack:
+        node = stack.pop()
+        if buffers and node in buffers:
+            tree.flush_node(node)
+        vertices = np.asarray(get_vertices(node), dtype=np.float64).reshape(-1, d)
+        if len(vertices):
+            if np.any(vertices.max(axis=0) < lower - rounding) or np.any(vertices.min(axis=0) > upper + rounding):
+                continue
+            if np.any(np.all(vertices @ region[:, :-1].T + region[:, -1] < -slack, axis=0)):
+                continue
+
+        left, right = node.left_children, node.right_children
+        if left is not None or right is not None:
+            record = records[abs(right.intersection_id) - 1]
+            side = region_vertices @ record[:-1] - record[-1]
+            if side.min() <= atol:
+                stack.append(left)
+            if side.max() >= -atol:
+                stack.append(right)
+            continue
+
+        cell = np.vstack((domain, _record_rows(node.constraints, records))) if node.constraints else domain
+        if len(cell) and not FunctionProfiler.points_satisfying_constraints(region_vertices, cell, atol=atol, strict=False).any():
+            if not FunctionProfiler.compute_vertices(np.vstack((cell, region)).tolist(), round_vertices=False):
+                continue
+        yield node.node_id, vertices
+
+
+def function_wins(points, records, pairs, m, chunk_size=1 << 22):
+    """
+    Count, for every point and function, the pairwise comparisons the function wins.
+    Record (i, j) is f_i - f_j with constant c, and function i wins at x when (f_i - f_j)·x >= c, i.e. when x lies on
+    the right side of the record. With zero constants this ranks the functions by their value at x.
+    Parameters:
+        points (array-like): Points of shape (num_points, d).
+        records (numpy.ndarray): Records of the dataset, row i holding record ID i + 1.
+        pairs (numpy.ndarray): Function pair (i, j) of every record, see sqlite_utils.read_pairs.
+        m (int): Number of functions.
+        chunk_size (int): Upper bound on points x records evaluated at once.
+    Returns:
+        numpy.ndarray: Win counts of shape (num_points, m).
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, records.shape[1] - 1)
+    wins = np.zeros((len(points), m), dtype=np.int64)
+    rows = max(1, chunk_size // max(1, len(records)))
+    for start in range(0, len(points), rows):
+        chunk = points[start:start + rows]
+        on_right = chunk @ records[:, :-1].T - records[:, -1] >= 0
+        winners = np.where(on_right, pairs[:, 0], pairs[:, 1])
+        flat = (winners + m * np.arange(len(chunk))[:, None]).ravel()
+        wins[start:start + len(chunk)] = np.bincount(flat, minlength=len(chunk) * m).reshape(len(chunk), m)
+    return wins
+
+
+def top_functions(points, records, pairs, m, k=1):
+    """
+    Return the k functions that win the most pairwise comparisons at each point.
+    Returns:
+        tuple: Function indices and their win counts, both of shape (num_points, k).
+    """
+    wins = function_wins(points, records, pairs, m)
+    top = np.argsort(-wins, axis=1, kind="stable")[:, :k]
+    return top, np.take_along_axis(wins, top, axis=1)
+
+
+def dataset_pairs(m, pairs=None):
+    """
+    Function pair of every record: the stored pairs of an appended dataset, or the combinations order otherwise.
+    """
+    return record_pairs(m) if pairs is None else np.asarray(pairs)
+
+
+class LeafRankings:
+    """
+    Top-k functions at query points, answered from the leaf of each point instead of all m functions.
+
+    With zero constants the signed records on a leaf's path imply a partial order of the functions (see
+    function_order), and a function with k or more functions known to be above it cannot be among the top k.
+    For every leaf, the number of functions known to be above each function is computed on the first query that
+    lands in it and kept as one small integer array. A query only compares the remaining candidates with each other,
+    through the records of their pairs; when the leaf order already ranks the top k, no record is evaluated at all.
+    """
+
+    def __init__(self, tree, records, pairs, m, init_constraints=None):
+        """
+        Parameters:
+            tree: VI tree whose nodes carry signed record IDs in node.constraints and a node_id.
+            records (numpy.ndarray): Records of the dataset, row i holding record ID i + 1, all with zero constants.
+            pairs (numpy.ndarray): Function pair (i, j) of every record, see dataset_pairs.
+            m (int): Number of functions.
+            init_constraints (list): Constraints of the initial domain; points outside it get -1.
+        """
+        if np.any(records[:, -1]):
+            raise ValueError("Leaf rankings need records with zero constants, use top_functions instead.")
+        self.tree = tree
+        self.records = records
+        self.pairs = np.asarray(pairs)
+        self.m = m
+        self.init_constraints = init_constraints
+        # Record ID of the pair (i, j), i < j, found by binary search on i * m + j
+        keys = self.pairs.min(axis=1) * m + self.pairs.max(axis=1)
+        self.key_order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.key_order]
+        self.above = {}  # Leaf node_id -> number of functions known to be above each function
+        self.evaluated_pairs = 0
+
+    def leaf_above(self, leaf):
+        """
+        Number of functions the leaf's order places above each function, built on first use.
+        """
+        above = self.above.get(leaf.node_id)
+        if above is None:
+            order = FunctionOrder.from_constraints(leaf.constraints, self.pairs)
+            counts = np.zeros(self.m, dtype=np.int64)
+            for mask in order.below.values():
+                bits = np.frombuffer(mask.to_bytes((self.m + 7) // 8, "little"), dtype=np.uint8)
+                counts += np.unpackbits(bits, bitorder="little")[:self.m]
+            above = counts.astype(np.min_scalar_type(self.m))
+            self.above[leaf.node_id] = above
+        return above
+
+    def _record_ids(self, first, second):
+        keys = np.minimum(first, second) * self.m + np.maximum(first, second)
+        return self.key_order[np.searchsorted(self.sorted_keys, keys)] + 1
+
+    def top_k(self, points, k=1):
+        """
+        Return the k largest functions at each point, best first, as top_functions would.
+        Returns:
+            numpy.ndarray: Function indices of shape (num_points, k), -1 for points outside the domain.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, self.records.shape[1] - 1)
+        k = min(k, self.m)
+        top = np.full((len(points), k), -1, dtype=np.int64)
+        groups = {}
+        for point_id, leaf in enumerate(locate_points(self.tree, points, self.records, self.init_constraints)):
+            if leaf is not None:
+                groups.setdefault(leaf.node_id, (leaf, []))[1].append(point_id)
+
+        for leaf, point_ids in groups.values():
+            above = self.leaf_above(leaf)
+            candidates = np.flatnonzero(above < k)
+            if len(candidates) == k and np.array_equal(np.sort(above[candidates]), np.arange(k)):
+                # The leaf order ranks the top k on its own
+                top[point_ids] = candidates[np.argsort(above[candidates])]
+                continue
+
+            # Rank the candidates at each point by the comparisons they win against each other
+            first, second = np.triu_indices(len(candidates), 1)
+            record_ids = self._record_ids(candidates[first], candidates[second])
+            candidate_records = self.records[record_ids - 1]
+            self.evaluated_pairs += len(record_ids) * len(point_ids)
+            # The right side of record (i, j) is f_i >= f_j, and the candidate pairs are ordered by index
+            on_right = points[point_ids] @ candidate_records[:, :-1].T >= 0
+            first_wins = on_right == (self.pairs[record_ids - 1, 0] == candidates[first])
+            winners = np.where(first_wins, first, second)
+            flat = (winners + len(candidates) * np.arange(len(point_ids))[:, None]).ravel()
+            wins = np.bincount(flat, minlength=len(point_ids) * len(candidates)).reshape(len(point_ids), -1)
+            # Ties go to the lower function index, as in top_functions
+            top[point_ids] = candidates[np.argsort(-wins, axis=1, kind="stable")[:, :k]]
+        return top
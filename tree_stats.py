@@ -0,0 +1,119 @@
+class TreeStats:
+    """
+    Tree statistics maintained incrementally while a tree is built, so that they can be polled in O(1).
+    Every registered node receives a unique node_id in creation order and a depth (the root has depth 0).
+    """
+
+    def __init__(self):
+        self.node_count = 0  # Number of nodes in the tree
+        self.leaf_count = 0  # Number of leaves, excluding leaves flagged as not having enough vertices
+        self.excluded_leaf_count = 0  # Leaves flagged as not having enough vertices
+        self.vertex_count = 0  # Total number of vertices stored over all nodes
+        self.split_count = 0  # Number of leaves split into two children
+        self.depth_histogram = []  # depth_histogram[d] is the number of nodes at depth d
+        self.next_node_id = 0  # Node IDs are never reused, even after nodes are removed
+
+    @property
+    def height(self):
+        """
+        Height of the tree as the number of layers (0 for an empty tree).
+        """
+        return len(self.depth_histogram)
+
+    def _add(self, node, depth):
+        node.node_id = self.next_node_id
+        node.depth = depth
+        self.next_node_id += 1
+        self.node_count += 1
+        self.vertex_count += len(node.vertices)
+        if depth == len(self.depth_histogram):
+            self.depth_histogram.append(0)
+        self.depth_histogram[depth] += 1
+
+    def add_root(self, node):
+        """
+        Register the root of a new tree.
+        """
+        self._add(node, 0)
+        self.leaf_count += 1
+
+    def add_children(self, parent, *children):
+        """
+        Register the children created by splitting the leaf parent.
+        """
+        for child in children:
+            self._add(child, parent.depth + 1)
+        self.leaf_count += len(children) - 1
+        self.split_count += 1
+
+    def remove_node(self, node, was_leaf):
+        """
+        Unregister a node that was removed from the tree. Used when subtrees are collapsed.
+        """
+        self.node_count -= 1
+        self.vertex_count -= len(node.vertices)
+        self.depth_histogram[node.depth] -= 1
+        while self.depth_histogram and self.depth_histogram[-1] == 0:
+            self.depth_histogram.pop()
+        if was_leaf:
+            if getattr(node, "not_enough_vertices", False):
+                self.excluded_leaf_count -= 1
+            else:
+                self.leaf_count -= 1
+
+    def collapse(self, node, removed):
+        """
+        Register that a split node became a leaf again after the nodes of its subtree were removed.
+        Parameters:
+            node: The node whose subtree was removed.
+            removed (list): The removed descendants, as (node, was_leaf) pairs.
+        """
+        for descendant, was_leaf in removed:
+            self.remove_node(descendant, was_leaf)
+            if not was_leaf:
+                self.split_count -= 1
+        self.split_count -= 1
+        self.leaf_count += 1
+
+    def set_vertices(self, node, vertices):
+        """
+        Assign vertices to a registered node and keep the vertex total in sync.
+        """
+        self.vertex_count += len(vertices) - len(node.vertices)
+        node.vertices = vertices
+
+    def exclude_leaf(self, node):
+        """
+        Flag a leaf as not having enough vertices, which removes it from the leaf count.
+        """
+        if not node.not_enough_vertices:
+            node.not_enough_vertices = True
+            self.leaf_count -= 1
+            self.excluded_leaf_count += 1
+
+    def restore(self, saved):
+        """
+        Restore counters from a dict produced by as_dict, e.g. when reopening a persisted tree.
+        """
+        self.node_count = saved["nodes"]
+        self.leaf_count = saved["leaves"]
+        self.excluded_leaf_count = saved["excluded_leaves"]
+        self.split_count = saved["splits"]
+        self.vertex_count = saved["vertices"]
+        self.depth_histogram = list(saved["depth_histogram"])
+        self.next_node_id = saved["next_node_id"]
+
+    def as_dict(self):
+        """
+        Return a snapshot of the statistics.
+        """
+        return {
+            "nodes": self.node_count,
+            "leaves": self.leaf_count,
+            "excluded_leaves": self.excluded_leaf_count,
+            "height": self.height,
+            "splits": self.split_count,
+            "vertices": self.vertex_count,
+            "depth_histogram": list(self.depth_histogram),
+            "next_node_id": self.next_node_id,
+        }
@@ -1,16 +1,103 @@
-from decimal import Decimal
+import hashlib
+from collections import OrderedDict
 
 import numpy as np
 
 from function_utils import check_smallest_intervals
 
 
-def create_lookup_table(variable_range_start, variable_range_end, interval, dimensions):
-    # Generate discretized values
-    discretized_values = np.round(np.arange(variable_range_start, variable_range_end + interval, interval) / interval) * interval
-    # Create a lookup table for all dimensions
-    lookup_table = {i: set(discretized_values) for i in range(dimensions)}
-    return lookup_table
+class GridLookupTable:
+    def __init__(self, variable_range_start, variable_range_end, interval, dimensions, joint=False,
+                 max_joint_cells=1 << 24):
+        """
+        Bitmap of visited grid cells for a discretised domain.
+
+        Values are mapped to integer cells round((value - start) / interval), so membership never
+        depends on comparing floats. In per-dimension mode each dimension has its own bitmap and a
+        vertex is new if any of its coordinates falls in an unvisited cell. In joint mode there is one
+        bitmap over the full grid and a vertex is new if its grid point is unvisited.
+
+        Parameters:
+        variable_range_start (float): Lower bound of every variable.
+        variable_range_end (float): Upper bound of every variable.
+        interval (float): Discretization interval.
+        dimensions (int): Number of variables.
+        joint (bool): Use a joint bitmap instead of the default per-dimension ones.
+        max_joint_cells (int): Largest joint grid to allocate; a larger one raises ValueError.
+        """
+        self.start = variable_range_start
+        self.interval = interval
+        self.dimensions = dimensions
+        self.cells_per_dim = int(np.floor((variable_range_end - variable_range_start) / interval + 0.5)) + 1
+
+        total_cells = self.cells_per_dim ** dimensions
+        if joint and total_cells > max_joint_cells:
+            raise ValueError(f"Joint grid of {total_cells} cells exceeds max_joint_cells={max_joint_cells}")
+        self.joint = joint
+        if self.joint:
+            self.visited = np.zeros(total_cells, dtype=bool)
+        else:
+            self.visited = np.zeros((dimensions, self.cells_per_dim), dtype=bool)
+
+    def _cells(self, vertices):
+        """
+        Return integer grid cells of the vertices and a mask of cells inside the grid.
+        """
+        vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, self.dimensions)
+        cells = np.rint((vertices - self.start) / self.interval).astype(np.int64)
+        in_range = (cells >= 0) & (cells < self.cells_per_dim)
+        return cells, in_range
+
+    def _flat_cells(self, cells, in_range):
+        """
+        Flatten the grid points of vertices lying entirely inside the grid.
+        """
+        inside = cells[in_range.all(axis=1)]
+        return np.ravel_multi_index(inside.T, (self.cells_per_dim,) * self.dimensions)
+
+    def check(self, vertices):
+        """
+        Return True if any vertex touches an unvisited cell.
+        """
+        cells, in_range = self._cells(vertices)
+        if self.joint:
+            return bool((~self.visited[self._flat_cells(cells, in_range)]).any())
+        dims = np.broadcast_to(np.arange(self.dimensions), cells.shape)
+        return bool((~self.visited[dims[in_range], cells[in_range]]).any())
+
+    def update(self, vertices):
+        """
+        Mark every cell touched by the vertices as visited.
+        """
+        cells, in_range = self._cells(vertices)
+        if self.joint:
+            self.visited[self._flat_cells(cells, in_range)] = True
+            return
+        dims = np.broadcast_to(np.arange(self.dimensions), cells.shape)
+        self.visited[dims[in_range], cells[in_range]] = True
+
+    def process(self, vertices):
+        """
+        Mark the vertices as visited if they touch an unvisited cell.
+        Returns True if they did.
+        """
+        if self.check(vertices):
+            self.update(vertices)
+            return True
+        return False
+
+    def unvisited_count(self):
+        """
+        Return the number of cells not yet visited.
+        """
+        return int(self.visited.size - np.count_nonzero(self.visited))
+
+
+def create_lookup_table(variable_range_start, variable_range_end, interval, dimensions, joint=False):
+    """
+    Create a GridLookupTable covering [variable_range_start, variable_range_end] in every dimension.
+    """
+    return GridLookupTable(variable_range_start, variable_range_end, interval, dimensions, joint=joint)
 
 
 def round_vertex(vertex, interval):
@@ -20,67 +107,196 @@ def round_vertex(vertex, interval):
     return [round(value / interval) * interval for value in vertex]
 
 
-def check_new_vertices(lookup_table, new_vertices, interval):
+def check_new_vertices(lookup_table, new_vertices, interval=None):
     """
     Check if any value in the new vertices is unvisited.
 
     Parameters:
-    lookup_table (dict): Current lookup table of unvisited values.
+    lookup_table (GridLookupTable): Current lookup table of visited cells.
     new_vertices (list of lists): New set of vertices.
-    interval (float): Discretization interval.
+    interval (float): Unused, the table carries its own discretization interval.
 
     Returns:
     bool: True if new values are found, False otherwise.
     """
-    for vertex in new_vertices:
-        for i, value in enumerate(vertex):
-            rounded_value = round(value / interval) * interval
-            if rounded_value in lookup_table[i]:
-                return True  # New value found
-    return False
+    return lookup_table.check(new_vertices)
 
 
-def update_visited(lookup_table, vertices, interval):
+def update_visited(lookup_table, vertices, interval=None):
     """
-    Update the lookup table by marking rounded values from the vertex set as visited.
+    Update the lookup table by marking the grid cells of the vertex set as visited.
     """
-    for vertex in vertices:
-        for i, value in enumerate(vertex):
-            rounded_value = round(value / interval) * interval
-            if rounded_value in lookup_table[i]:  # Mark as visited by removing from the table
-                lookup_table[i].remove(rounded_value)
+    lookup_table.update(vertices)
 
 
-def process_new_vertices(lookup_table, new_vertices, interval):
+def process_new_vertices(lookup_table, new_vertices, interval=None):
     """
     Check if new vertices introduce any unvisited values, and update the lookup table if so.
 
     Parameters:
-    lookup_table (dict): Current lookup table of unvisited values.
+    lookup_table (GridLookupTable): Current lookup table of visited cells.
     new_vertices (list of lists): New set of vertices to check and potentially update.
-    interval (float): Discretization interval.
+    interval (float): Unused, the table carries its own discretization interval.
 
     Returns:
     bool: True if new values were introduced (and the table updated), False otherwise.
     """
-    if check_new_vertices(lookup_table, new_vertices, interval):
-        update_visited(lookup_table, new_vertices, interval)
-        return True
-    return False
+    return lookup_table.process(new_vertices)
+
+
+class VertexBudget:
+    def __init__(self, max_bytes, recompute):
+        """
+        Keep the vertex sets of tree nodes within a memory budget.
+
+        Tracked nodes are kept in least-recently-used order. When the estimated size of the resident vertex sets
+        exceeds max_bytes, the coldest sets are dropped (node.vertices is set to None) and recomputed on the next
+        access.
+
+        Parameters:
+        max_bytes (int): Memory budget for resident vertex sets, in bytes.
+        recompute (callable): Maps a node with evicted vertices to its vertex list.
+        """
+        self.max_bytes = max_bytes
+        self.recompute = recompute
+        self.resident = OrderedDict()  # Node -> estimated size of its vertex set in bytes
+        self.used_bytes = 0
+        self.evictions = 0
+        self.recomputes = 0
+
+    @staticmethod
+    def estimate_bytes(vertices):
+        """
+        Rough size of a vertex list of lists: a list header and item pointers per vertex plus one number per coordinate.
+        """
+        if not vertices:
+            return 0
+        return len(vertices) * (64 + 36 * len(vertices[0]))
+
+    def track(self, node):
+        """
+        Start tracking the vertex set of a node, evicting colder sets if the budget is exceeded.
+        """
+        size = self.estimate_bytes(node.vertices)
+        self.used_bytes += size - self.resident.get(node, 0)
+        self.resident[node] = size
+        self.resident.move_to_end(node)
+        self._evict()
+
+    def untrack(self, node):
+        """
+        Stop tracking a node, e.g. when it is removed from the tree.
+        """
+        self.used_bytes -= self.resident.pop(node, 0)
+
+    def vertices(self, node):
+        """
+        Return the vertices of a node, recomputing them if they were evicted.
+        """
+        if node.vertices is None:
+            node.vertices = self.recompute(node)
+            self.recomputes += 1
+            self.track(node)
+        elif node in self.resident:
+            self.resident.move_to_end(node)
+        return node.vertices
+
+    def _evict(self):
+        # The most recently used set is never evicted, it is about to be read
+        while self.used_bytes > self.max_bytes and len(self.resident) > 1:
+            node, size = self.resident.popitem(last=False)
+            node.vertices = None
+            self.used_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Return the eviction and recompute counters and the resident size.
+        """
+        return {
+            "resident_sets": len(self.resident),
+            "resident_bytes": self.used_bytes,
+            "evictions": self.evictions,
+            "recomputes": self.recomputes,
+        }
+
+
+class CountingBloomFilter:
+    def __init__(self, size, num_hashes=4):
+        """
+        Initialize a counting Bloom filter with saturating 8-bit counters.
+
+        Parameters:
+        size (int): Number of counters in the filter.
+        num_hashes (int): Number of counters touched by each key.
+        """
+        self.size = size
+        self.num_hashes = num_hashes
+        self.counters = np.zeros(size, dtype=np.uint8)
+
+    def _positions(self, key):
+        """
+        Derive num_hashes counter positions from a digest using double hashing.
+        """
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:16], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.num_hashes)]
+
+    def add(self, key):
+        """
+        Increment the counters of a key and return its estimated count.
+        The estimate never undercounts, but may overcount on collisions.
+        """
+        positions = self._positions(key)
+        counters = self.counters[positions]
+        self.counters[positions] = np.minimum(counters.astype(np.uint16) + 1, 255)
+        return int(self.counters[positions].min())
+
+    def count(self, key):
+        """
+        Return the estimated count of a key without modifying the filter.
+        """
+        return int(self.counters[self._positions(key)].min())
 
 
 class VertexManager:
-    def __init__(self, precision, max_visits=1):
+    def __init__(self, precision, max_visits=1, max_entries=None, bloom_size=None, bloom_hashes=4):
         """
         Initialize the VertexManager with a given precision and max visits threshold.
 
         Parameters:
         precision (float): The precision to use for rounding and interval checking.
         max_visits (int): The number of times a rounded set can be visited before considering it a violation.
+        max_entries (int): If set, keep at most this many vertex sets, evicting the least recently visited.
+        bloom_size (int): If set, count visits in a counting Bloom filter of this many counters instead
+                          of an exact dict. Memory stays fixed, counts may be overestimated.
+        bloom_hashes (int): Number of counters per key in the Bloom filter.
         """
         self.precision = precision
         self.max_visits = max_visits
-        self.rounded_sets_list = []  # List to store each encountered rounded_set
+        self.max_entries = max_entries
+        self.visit_counts = OrderedDict()  # Digest of the canonical vertex set -> number of visits
+        self.bloom = CountingBloomFilter(bloom_size, bloom_hashes) if bloom_size else None
+        self.total_visits = 0
+        self.violations = 0
+        self.evictions = 0
+
+    def _quantise(self, vertices):
+        """
+        Map vertices onto the integer grid of the precision and canonicalise the set.
+
+        Parameters:
+        vertices (list of list): A list of vertices, each vertex being a list of coordinates.
+
+        Returns:
+        numpy.ndarray: Unique grid cells as int64 rows, sorted lexicographically.
+        """
+        vertices = np.asarray(vertices, dtype=np.float64)
+        if vertices.size == 0:
+            return np.empty((0, vertices.shape[-1] if vertices.ndim == 2 else 0), dtype=np.int64)
+        # Round before flooring so that e.g. 0.3 / 0.1 lands in cell 3 rather than 2
+        cells = np.floor(np.round(vertices / self.precision, 9)).astype(np.int64)
+        return np.unique(cells, axis=0)
 
     def _round_vertex_set(self, vertices):
         """
@@ -92,17 +308,34 @@ class VertexManager:
         Returns:
         frozenset: A set of rounded vertices as tuples.
         """
-        precision_decimal = Decimal(str(self.precision))
+        rounded = np.round(self._quantise(vertices) * self.precision, 12)
+        return frozenset(map(tuple, rounded.tolist()))
 
-        rounded_vertices = [
-            tuple(
-                float(Decimal(str(value)) // precision_decimal * precision_decimal)
-                for value in vertex
-            )
-            for vertex in vertices
-        ]
+    def _canonical_key(self, vertices):
+        """
+        Hash the canonical form of a vertex set into a 16-byte digest.
+        The shape is part of the digest so that sets of different dimension never collide.
+        """
+        cells = self._quantise(vertices)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.asarray(cells.shape, dtype=np.int64).tobytes())
+        digest.update(cells.tobytes())
+        return digest.digest()
 
-        return frozenset(rounded_vertices)
+    def _visit(self, key):
+        """
+        Record one visit of a key and return its visit count so far.
+        """
+        if self.bloom is not None:
+            return self.bloom.add(key)
+
+        count = self.visit_counts.get(key, 0) + 1
+        self.visit_counts[key] = count
+        self.visit_counts.move_to_end(key)
+        if self.max_entries is not None and len(self.visit_counts) > self.max_entries:
+            self.visit_counts.popitem(last=False)
+            self.evictions += 1
+        return count
 
     def process_vertex_set(self, vertices):
         """
@@ -114,32 +347,25 @@ class VertexManager:
         Returns:
         bool: True if the set of vertices violates the rules, False otherwise.
               Rules:
-              - If a set violates the interval condition, return True.
               - If a set has already been visited 'max_visits' times, return True.
               - Otherwise, return False.
         """
-        # Round the set of vertices
-        # rounded_set = self._round_vertex_set(vertices)
-
-        # Append the rounded_set to the list
-        self.rounded_sets_list.append(vertices)
-        # print(self.rounded_sets_list)
-
-        # Count how many times this rounded_set has appeared
-        current_count = self.rounded_sets_list.count(vertices)
+        self.total_visits += 1
+        current_count = self._visit(self._canonical_key(vertices))
 
         # If already visited max_visits times, return True (violation)
         if current_count > self.max_visits:
-            # print(f"Visited {current_count} times: {vertices}")
+            self.violations += 1
             return True
-        else:
-            return False
-
-        #
-        # # Check if the set satisfies the smallest interval condition
-        # if check_smallest_intervals(vertices, self.precision):
-        #     return True  # Valid and recorded
-        # else:
-        #     # Violates the interval condition
-        #     # print(f"Smallest interval violation: {vertices}")
-        #     return False
\ No newline at end of file
+        return False
+
+    def stats(self):
+        """
+        Return visit counters and the number of vertex sets currently held.
+        """
+        return {
+            "visits": self.total_visits,
+            "violations": self.violations,
+            "entries": len(self.visit_counts),
+            "evictions": self.evictions,
+        }
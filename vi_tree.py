@@ -1,9 +1,14 @@
-from function_utils import (check_function, FunctionProfiler, merge_constraints, get_tight_constraints,
-                            check_smallest_intervals)
-from sqlite_utils import read_from_sqlite, SQLiteReader
-from vertex_utils import create_lookup_table, process_new_vertices
+import numpy as np
 
-init_constraints = []  # Global variable to store initial constraints
+from function_utils import (check_function, FunctionProfiler, get_tight_constraints,
+                            check_smallest_intervals, prune_constraints, box_bounds, box_crossing)
+from sqlite_utils import read_from_sqlite, SQLiteReader
+from vertex_utils import create_lookup_table, process_new_vertices, VertexBudget
+from tree_export import print_tree_by_layer
+from tree_stats import TreeStats
+from cell_adjacency import LeafAdjacency
+from function_order import FunctionOrder
+from tree_query import box_constraints, cells_in_polytope
 
 class TreeNode:
     def __init__(self, intersection_id, constraints=None, vertices=None):
@@ -12,13 +17,111 @@ class TreeNode:
         self.vertices = vertices if vertices is not None else []  # Associated vertices, defaults to []
         self.left_children = None  # Left child
         self.right_children = None  # Right child
+        self.parent = None  # Node this one was split from, None for the root
         self.skip_flag = False  # Flag to indicate if this node should be skipped
+        self.node_id = None  # Creation order, assigned by TreeStats
+        self.depth = 0  # Depth in the tree, assigned by TreeStats
         self.not_enough_vertices = False
+        self.bucket = []  # Crossing record IDs a leaf of a bucketed tree has not split on yet, in insertion order
+        self.arrivals = []  # Record IDs that reached this node of a bucketed tree while it was a leaf, in order
+
+
+def same_cell(vertices, other_vertices):
+    """
+    Whether two vertex lists describe the same cell. The lists are compared as multisets, since cdd lists the
+    vertices in an order that depends on the order of the constraints and not only on the cell.
+    """
+    return sorted(vertices) == sorted(other_vertices)
+
+
+def keeps_split(vertices, left_children_vertices, right_children_vertices, min_vertices=4):
+    """
+    Split rule shared by the tree engines: a leaf is split only if both sides have at least min_vertices vertices and
+    neither side is the whole cell.
+    """
+    if len(left_children_vertices) < min_vertices or len(right_children_vertices) < min_vertices:
+        return False
+    return not (same_cell(vertices, left_children_vertices) or same_cell(vertices, right_children_vertices))
 
 
 class VITree:
-    def __init__(self):
+    def __init__(self, track_adjacency=False, memory_budget=None, prune_constraints=False, min_vertices=4, pairs=None,
+                 bucket_size=0, buffer_size=0, records=None):
         self.root = None  # Initialize the tree with no root
+        self.init_constraints = []  # Constraints of the initial domain, set by the first insert
+        # Records the tree splits on, row i holding record ID i + 1; None reads the records loaded in SQLiteReader
+        self.records = records
+        # A leaf holds up to bucket_size crossing records and splits only when one more arrives, like the leaf size of
+        # a kd-tree; 0 splits a leaf on every crossing record. Queries resolve buckets with tree_query.bucket_signs
+        self.bucket_size = bucket_size
+        self.bucket_nodes = {}  # Reverse index: record ID -> leaves holding it in their bucket
+        # Reverse index: record ID -> nodes it reached as a leaf. Bucket overflows depend on every record a leaf has
+        # seen, so delete replays them (see _replay_arrivals)
+        self.arrival_nodes = {}
+        # With a buffer size, insert appends records to a buffer at the root, and a buffer is pushed one level down when
+        # it fills or a query or export reaches its node (buffer-tree style bulk loading, see flush_node)
+        self.buffer_size = buffer_size
+        self.buffers = {}  # Node -> record IDs that reached it and are not tested against it yet, oldest first
+        self.buffer_orders = {}  # Node -> function order of its path, for buffered nodes when pairs is set
+        self.min_vertices = min_vertices  # A split is skipped if either child has fewer vertices
+        # Function pair of every record. Only for records with zero constants: a record whose sign is implied by the
+        # function order along the path (see function_order) is skipped before any vertex work
+        self.pairs = pairs
+        self.implied_skips = 0  # Nodes skipped because the order implied the record's sign
+        self.crossing_tests = 0  # Geometric crossing tests run
+        self._stats = TreeStats()  # Incrementally maintained statistics
+        # Reduce each new node's constraints to its facet-defining records, so cdd inputs stay small at depth
+        self.prune_constraints = prune_constraints
+        self.track_adjacency = track_adjacency
+        self.adjacency = None  # LeafAdjacency between leaf cells, created with the root if track_adjacency is set
+        # With a memory budget (in bytes) the vertex sets of cold nodes are evicted and recomputed on demand
+        self.vertex_budget = VertexBudget(memory_budget, self._recompute_vertices) if memory_budget is not None else None
+        self.root_bounds = None  # (lower, upper) if the initial domain is a box, for the closed-form root test
+        self.record_nodes = {}  # Reverse index: record ID -> nodes split by that record
+        self.insert_order = {}  # Inserted record IDs -> position in the insertion sequence
+        self._next_position = 0
+
+    def _record(self, record_id):
+        """
+        Return a record as (coefficient1, ..., coefficientd, constant).
+        """
+        if self.records is None:
+            return SQLiteReader.get_record_by_id(record_id)
+        return tuple(self.records[record_id - 1].tolist())
+
+    def _records_array(self):
+        """
+        Return the records as an array, row i holding record ID i + 1.
+        """
+        return SQLiteReader.get_records_array() if self.records is None else self.records
+
+    def get_vertices(self, node):
+        """
+        Return the vertices of a node, recomputing them if they were evicted under the memory budget.
+        """
+        if self.vertex_budget is None:
+            return node.vertices
+        return self.vertex_budget.vertices(node)
+
+    def _recompute_vertices(self, node):
+        """
+        Recompute evicted vertices from the node's constraint path.
+        """
+        return self._cell_vertices(node.constraints)
+
+    def _prune(self, *nodes):
+        """
+        Replace the constraints of freshly created nodes by their facet-defining subset.
+        """
+        for node in nodes:
+            node.constraints = prune_constraints(node.constraints, node.vertices, self.init_constraints,
+                                                 records=self.records)
+
+    def _cell_vertices(self, node_constraints):
+        """
+        Compute the vertices of the cell described by a list of signed record IDs.
+        """
+        return FunctionProfiler.compute_cell_vertices(node_constraints, self.init_constraints, records=self.records)
 
     def insert(self, record_id, constraints, vertices=None, m=None, n=None, db_name=None, conn=None, manager=None):
         """
@@ -32,17 +135,16 @@ class VITree:
             db_name (str): Database file name.
             conn: SQLite database connection.
         """
-        global init_constraints
-
         new_node = TreeNode(record_id, None, vertices)
 
         if self.root is None:
             # Set the root if the tree is empty
             self.root = new_node
 
-            # Update the global variable and node properties
-            init_constraints = constraints
-            print(f"Initial constraints for record {record_id}: {init_constraints}")
+            # Update the domain and node properties
+            self.init_constraints = constraints
+            print(f"Initial constraints for record {record_id}: {self.init_constraints}")
+            self.root_bounds = box_bounds(self.init_constraints)
 
             # Explicitly set root node properties
             self.root.intersection_id = record_id
@@ -51,21 +153,61 @@ class VITree:
             # Initialize left and right children with constraints
             self.root.left_children = TreeNode(-record_id, [-record_id])
             self.root.right_children = TreeNode(record_id, [record_id])
+            self.root.left_children.parent = self.root
+            self.root.right_children.parent = self.root
 
-            left_merged_constraints = merge_constraints(self.root.left_children.constraints, init_constraints, m, n, db_name, conn)
-            # print(f"Left merged constraints: {left_merged_constraints}")
-            right_merged_constraints = merge_constraints(self.root.right_children.constraints, init_constraints, m, n, db_name, conn)
-            # print(f"Right merged constraints: {right_merged_constraints}")
-
-            self.root.left_children.vertices = FunctionProfiler.compute_vertices(left_merged_constraints)
+            self.root.left_children.vertices = FunctionProfiler.compute_cell_vertices(
+                self.root.left_children.constraints, self.init_constraints, m, n, db_name, conn, self.records)
             # print(f"Left children vertices: {self.root.left_children.vertices}")
-            self.root.right_children.vertices = FunctionProfiler.compute_vertices(right_merged_constraints)
+            self.root.right_children.vertices = FunctionProfiler.compute_cell_vertices(
+                self.root.right_children.constraints, self.init_constraints, m, n, db_name, conn, self.records)
             # print(f"Right children vertices: {self.root.right_children.vertices}")
 
+            if self.prune_constraints:
+                self._prune(self.root.left_children, self.root.right_children)
+
+            self._stats.add_root(self.root)
+            self._stats.add_children(self.root, self.root.left_children, self.root.right_children)
+            self._register(record_id)
+            self.record_nodes[record_id] = [self.root]
+            if self.vertex_budget is not None:
+                # The root keeps its vertices, only the cells below it are evictable
+                self.vertex_budget.track(self.root.left_children)
+                self.vertex_budget.track(self.root.right_children)
+
+            if self.track_adjacency:
+                self.adjacency = LeafAdjacency(len(self.init_constraints[0]) - 1, self._cell_vertices,
+                                               get_vertices=self.get_vertices, get_record=self._record)
+                self.adjacency.add_root(self.root)
+                self.adjacency.on_split(self.root, self.root.left_children, self.root.right_children, record_id)
+
             return
 
+        self._register(record_id)
+        if self.buffer_size:
+            self._buffer(self.root, [record_id], FunctionOrder.from_constraints(self.root.constraints, self.pairs)
+                         if self.pairs is not None else None)
+            if len(self.buffers[self.root]) >= self.buffer_size:
+                self.flush_node(self.root, m, n, db_name, conn)
+            return
+        self._insert_from(self.root, record_id, m, n, db_name, conn)
+
+    def _register(self, record_id):
+        """
+        Append a record to the insertion sequence.
+        """
+        self.insert_order[record_id] = self._next_position
+        self._next_position += 1
+
+    def _insert_from(self, start, record_id, m=None, n=None, db_name=None, conn=None):
+        """
+        Insert a record into the subtree rooted at start.
+        """
         # Use a stack to manage nodes for non-recursive traversal
-        stack = [self.root]
+        stack = [start]
+        # Function order of every node on the stack, extended by one record per level
+        orders = {start: FunctionOrder.from_constraints(start.constraints, self.pairs)} if self.pairs is not None else None
+        record_pair = self.pairs[record_id - 1].tolist() if self.pairs is not None else None
 
         # Set to store previously computed vertices
         previously_computed_vertices = set()
@@ -76,135 +218,422 @@ class VITree:
             current = stack.pop()
             # Get the record from the database
             # insert_record = FunctionProfiler.read_from_sqlite(m=m, n=n, db_name=db_name, record_id=record_id, conn=conn)
-            insert_record = SQLiteReader.get_record_by_id(record_id)
+            insert_record = self._record(record_id)
             # print(f"Processing record {record_id}: {insert_record}")
 
-            if not FunctionProfiler.check_function(insert_record, current.vertices, cache=cache):
+            if orders is not None:
+                order = orders.pop(current)
+                if order.implies(*record_pair):
+                    self.implied_skips += 1
+                    continue
+
+            self.crossing_tests += 1
+            current_vertices = self.get_vertices(current)
+            if current is self.root and self.root_bounds is not None:
+                # The root is the box domain, so its 2^d corners need not be tested one by one
+                if not box_crossing(insert_record, *self.root_bounds)[0]:
+                    continue
+            elif not FunctionProfiler.check_function(insert_record, current_vertices, cache=cache):
                 continue  # Skip to the next iteration if not satisfied
 
             if current.left_children is None and current.right_children is None:
-                left_merged_constraints = merge_constraints(current.constraints + [-record_id], init_constraints, m, n, db_name, conn)
-                # print(f"Left merged constraints: {left_merged_constraints}")
-                right_merged_constraints = merge_constraints(current.constraints + [record_id], init_constraints, m, n, db_name, conn)
-                # print(f"Right merged constraints: {right_merged_constraints}")
+                self._reach_leaf(current, record_id, current_vertices, m, n, db_name, conn)
+                continue
 
-                left_children_vertices = FunctionProfiler.compute_vertices(left_merged_constraints)
-                # print(f"Left children vertices: {left_children_vertices}")
-                right_children_vertices = FunctionProfiler.compute_vertices(right_merged_constraints)
-                # print(f"Right children vertices: {right_children_vertices}")
+            stack.append(current.left_children)
+            stack.append(current.right_children)
+            if orders is not None:
+                orders[current.left_children] = order.with_record(current.left_children.intersection_id, self.pairs)
+                orders[current.right_children] = order.with_record(current.right_children.intersection_id, self.pairs)
 
-                if len(left_children_vertices) <= 3 or len(right_children_vertices) <= 3:
-                    continue
+    def _reach_leaf(self, leaf, record_id, vertices, m=None, n=None, db_name=None, conn=None):
+        """
+        Handle a record crossing a leaf: split the leaf, or add the record to its bucket in a bucketed tree.
+        """
+        if not self.bucket_size:
+            self._split(leaf, record_id, vertices, m, n, db_name, conn)
+            return
+        leaf.arrivals.append(record_id)
+        self.arrival_nodes.setdefault(record_id, []).append(leaf)
+        if len(leaf.bucket) < self.bucket_size:
+            leaf.bucket.append(record_id)
+            self.bucket_nodes.setdefault(record_id, []).append(leaf)
+        else:
+            self._flush_bucket(leaf, record_id, m, n, db_name, conn)
+
+    def _buffer(self, node, record_ids, order=None):
+        """
+        Append records to the buffer of a node.
+        """
+        self.buffers.setdefault(node, []).extend(record_ids)
+        if order is not None:
+            self.buffer_orders.setdefault(node, order)
 
-                # print([current.vertices].count(left_children_vertices),[current.vertices].count(right_children_vertices))
-                if [current.vertices].count(left_children_vertices) > 0 or [current.vertices].count(right_children_vertices) > 0:
-                    continue
-                # result = manager.process_vertex_set(current.vertices)
-                # if result:
-                #     # print(f"Skipping record {current.intersection_id}: Marked as skippable.")
-                #     continue
+    def flush_node(self, node, m=None, n=None, db_name=None, conn=None):
+        """
+        Push the buffered records of a node one level down, and then every child buffer that fills up.
+        The records are tested against the node in one vectorized crossing test, after the transitivity check of
+        _insert_from. At an internal node the crossing records are appended to both children's buffers. At a leaf they
+        are handled in order as in _insert_from, and once one of them splits the leaf, the rest go to the new children.
+        Buffers only ever hold records newer than those below them, so every leaf sees its records in insertion order
+        and the tree is the same as with unbuffered inserts; only the node IDs follow the order of creation.
+        """
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            record_ids = self.buffers.pop(current, None)
+            order = self.buffer_orders.pop(current, None)
+            if not record_ids:
+                continue
+
+            ids = np.asarray(record_ids, dtype=np.int64)
+            if order is not None:
+                implied = np.array([order.implies(i, j) != 0 for i, j in self.pairs[ids - 1].tolist()], dtype=bool)
+                self.implied_skips += int(implied.sum())
+                ids = ids[~implied]
+            self.crossing_tests += len(ids)
+            records = self._records_array()[ids - 1]
+            vertices = self.get_vertices(current)
+            if current is self.root and self.root_bounds is not None:
+                crossing = ids[box_crossing(records, *self.root_bounds)].tolist()
+            else:
+                crossing = ids[FunctionProfiler.check_functions(records, vertices)].tolist()
+
+            position = 0
+            while position < len(crossing) and current.left_children is None and current.right_children is None:
+                self._reach_leaf(current, crossing[position], vertices, m, n, db_name, conn)
+                position += 1
+            if position == len(crossing):
+                continue
+            for child in (current.left_children, current.right_children):
+                self._buffer(child, crossing[position:],
+                             order.with_record(child.intersection_id, self.pairs) if order is not None else None)
+                if len(self.buffers[child]) >= self.buffer_size:
+                    stack.append(child)
+
+    def flush_buffers(self, m=None, n=None, db_name=None, conn=None):
+        """
+        Push every buffered record down to the leaves, parents before children.
+        """
+        stack = [self.root] if self.buffers else []
+        while stack:
+            node = stack.pop()
+            if node in self.buffers:
+                self.flush_node(node, m, n, db_name, conn)
+            if node.left_children is not None:
+                stack.append(node.left_children)
+                stack.append(node.right_children)
 
+    def _split(self, node, record_id, vertices, m=None, n=None, db_name=None, conn=None):
+        """
+        Split a leaf crossed by a record into its two sides, unless a side is too thin or equals the leaf.
+        Returns:
+            bool: Whether the leaf was split.
+        """
+        left_children_vertices = FunctionProfiler.compute_cell_vertices(
+            node.constraints + [-record_id], self.init_constraints, m, n, db_name, conn, self.records)
+        # print(f"Left children vertices: {left_children_vertices}")
+        right_children_vertices = FunctionProfiler.compute_cell_vertices(
+            node.constraints + [record_id], self.init_constraints, m, n, db_name, conn, self.records)
+        # print(f"Right children vertices: {right_children_vertices}")
+
+        # print([vertices].count(left_children_vertices),[vertices].count(right_children_vertices))
+        if not keeps_split(vertices, left_children_vertices, right_children_vertices, self.min_vertices):
+            return False
+        # result = manager.process_vertex_set(node.vertices)
+        # if result:
+        #     # print(f"Skipping record {node.intersection_id}: Marked as skippable.")
+        #     continue
+
+
+        node.left_children = TreeNode(
+            -record_id,
+            constraints=[-record_id] + node.constraints
+        )
+
+        node.right_children = TreeNode(
+            record_id,
+            constraints=[record_id] + node.constraints
+        )
+
+        node.left_children.parent = node
+        node.right_children.parent = node
+        node.left_children.vertices = left_children_vertices
+        node.right_children.vertices = right_children_vertices
+        if self.prune_constraints:
+            self._prune(node.left_children, node.right_children)
+        self._stats.add_children(node, node.left_children, node.right_children)
+        if self.vertex_budget is not None:
+            self.vertex_budget.track(node.left_children)
+            self.vertex_budget.track(node.right_children)
+        if self.adjacency is not None:
+            self.adjacency.on_split(node, node.left_children, node.right_children, record_id)
+        self.record_nodes.setdefault(record_id, []).append(node)
+        return True
+
+    def _flush_bucket(self, leaf, record_id, m=None, n=None, db_name=None, conn=None):
+        """
+        Empty the overflowing bucket of a leaf, together with the record that overflowed it.
+        The earliest record that passes the checks of _split splits the leaf and the records after it are inserted
+        into the new children, whose buckets have room for them; records before it are dropped, as an unbucketed tree
+        skips them at this cell. All of them stay in the leaf's arrivals for delete.
+        """
+        pending = leaf.bucket + [record_id]
+        self._unbucket(leaf)
+        for position, pending_id in enumerate(pending):
+            if self._split(leaf, pending_id, self.get_vertices(leaf), m, n, db_name, conn):
+                for later_id in pending[position + 1:]:
+                    self._insert_from(leaf, later_id, m, n, db_name, conn)
+                return
+
+    def _unbucket(self, leaf):
+        """
+        Empty the bucket of a leaf and drop it from the reverse index.
+        """
+        for record_id in leaf.bucket:
+            self.bucket_nodes[record_id].remove(leaf)
+            if not self.bucket_nodes[record_id]:
+                del self.bucket_nodes[record_id]
+        leaf.bucket = []
 
-                current.left_children = TreeNode(
-                    -record_id,
-                    constraints=[-record_id] + current.constraints
-                )
+    def _clear_arrivals(self, node):
+        """
+        Forget the records that reached a node as a leaf and drop it from the reverse index.
+        """
+        for record_id in node.arrivals:
+            self.arrival_nodes[record_id].remove(node)
+            if not self.arrival_nodes[record_id]:
+                del self.arrival_nodes[record_id]
+        node.arrivals = []
 
-                current.right_children = TreeNode(
-                    record_id,
-                    constraints=[record_id] + current.constraints
-                )
+    def _path(self, node):
+        """
+        Nodes from the root down to a node.
+        """
+        path = [node]
+        while path[-1].parent is not None:
+            path.append(path[-1].parent)
+        return path[::-1]
 
-                current.left_children.vertices = left_children_vertices
-                current.right_children.vertices = right_children_vertices
+    def _reaching(self, node, record_ids):
+        """
+        The records that an insert from the root would deliver to a node, in their given order.
+        Every node on the path applies the tests of _insert_from: the transitivity check, then the crossing test.
+        Testing only the node itself is not enough, as a record can cross the rounded vertices of a cell but not
+        those of an ancestor.
+        """
+        ids = np.asarray(record_ids, dtype=np.int64)
+        order = FunctionOrder.from_constraints(self.root.constraints, self.pairs) if self.pairs is not None else None
+        for current in self._path(node):
+            if ids.size == 0:
+                break
+            if order is not None:
+                if current is not self.root:
+                    order = order.with_record(current.intersection_id, self.pairs)
+                implied = np.array([order.implies(i, j) != 0 for i, j in self.pairs[ids - 1].tolist()], dtype=bool)
+                ids = ids[~implied]
+            records = self._records_array()[ids - 1]
+            if current is self.root and self.root_bounds is not None:
+                ids = ids[box_crossing(records, *self.root_bounds)]
+            else:
+                ids = ids[FunctionProfiler.check_functions(records, self.get_vertices(current))]
+        return ids
+
+    def _collapse(self, node):
+        """
+        Remove the subtree below a split node, so that the node is a leaf again.
+        Returns:
+            list: The removed nodes.
+        """
+        removed = []
+        stack = [node.left_children, node.right_children]
+        while stack:
+            current = stack.pop()
+            is_leaf = current.left_children is None and current.right_children is None
+            if current.vertices is None:
+                # Evicted under the memory budget, the statistics need the vertex count
+                current.vertices = self.vertex_budget.recompute(current)
+            removed.append((current, is_leaf))
+            if current.bucket:
+                self._unbucket(current)
+            if current.arrivals:
+                self._clear_arrivals(current)
+            if self.vertex_budget is not None:
+                self.vertex_budget.untrack(current)
+            if not is_leaf:
+                split_id = abs(current.right_children.intersection_id)
+                self.record_nodes[split_id].remove(current)
+                if not self.record_nodes[split_id]:
+                    del self.record_nodes[split_id]
+                stack.append(current.left_children)
+                stack.append(current.right_children)
+
+        node.left_children = None
+        node.right_children = None
+        self._stats.collapse(node, removed)
+        if self.adjacency is not None:
+            self.adjacency.on_collapse(node, [current for current, is_leaf in removed if is_leaf])
+        return [current for current, is_leaf in removed]
+
+    def delete(self, record_id, m=None, n=None, db_name=None, conn=None):
+        """
+        Remove a record from the tree.
+        Every node split by the record is collapsed back into one cell, and the records inserted after it that reach
+        that cell from the root (see _reaching) are re-inserted there, in their original order. Records inserted
+        earlier were either rejected by the cell or split one of its ancestors, so the rest of the tree is the same as
+        after a full rebuild. In a bucketed tree the overflows of a leaf depend on every record it has seen, so
+        instead every node the record reached as a leaf is collapsed and replays the other records that reached it
+        (see _replay_arrivals).
+        Parameters:
+            record_id (int): ID of the record to remove.
+            m (int): Number of functions.
+            n (int): Dimension of functions.
+            db_name (str): Database file name.
+            conn: SQLite database connection.
+        Returns:
+            int: Number of records re-inserted.
+        """
+        if record_id not in self.insert_order:
+            raise KeyError(f"Record {record_id} is not in the tree.")
+        self.flush_buffers(m, n, db_name, conn)
+        position = self.insert_order.pop(record_id)
+        for leaf in self.bucket_nodes.pop(record_id, []):
+            leaf.bucket.remove(record_id)
+
+        if self.root in self.record_nodes.get(record_id, []):
+            # The first record splits the root without the usual checks, so its successor has to take that role
+            remaining = sorted(self.insert_order, key=self.insert_order.get)
+            root_vertices = self.root.vertices
+            init_constraints = self.init_constraints
+            VITree.__init__(self, self.track_adjacency, None if self.vertex_budget is None else self.vertex_budget.max_bytes,
+                            self.prune_constraints, self.min_vertices, self.pairs, self.bucket_size, self.buffer_size,
+                            self.records)
+            for remaining_id in remaining:
+                self.insert(remaining_id, init_constraints, root_vertices, m, n, db_name, conn)
+            self.flush_buffers(m, n, db_name, conn)
+            return len(remaining)
+
+        if self.bucket_size:
+            # The nodes split by the record are among those it reached, they stop being split nodes when collapsed
+            reinserted = self._replay_arrivals(record_id, position, m, n, db_name, conn)
+            self.record_nodes.pop(record_id, None)
+            return reinserted
+
+        later_ids = np.array([i for i, p in self.insert_order.items() if p > position], dtype=np.int64)
+        reinserted = 0
+        for node in self.record_nodes.pop(record_id, []):
+            self._collapse(node)
+            if later_ids.size == 0:
+                continue
+            crossing = self._reaching(node, later_ids)
+            for later_id in crossing.tolist():
+                self._insert_from(node, later_id, m, n, db_name, conn)
+            reinserted += len(crossing)
+        return reinserted
 
+    def _replay_arrivals(self, record_id, position, m=None, n=None, db_name=None, conn=None):
+        """
+        Rebuild, without a deleted record, every node of a bucketed tree the record reached as a leaf.
+        Such a node is collapsed and the records that reached it as a leaf are inserted again from it, in their
+        original order, followed by the later records that reach it from the root, which had gone on to its children.
+        Nodes are handled from the top, so one inside an already collapsed subtree is skipped.
+        Parameters:
+            record_id (int): ID of the deleted record.
+            position (int): Position the record had in the insertion sequence.
+        Returns:
+            int: Number of records re-inserted.
+        """
+        nodes = sorted(self.arrival_nodes.get(record_id, []), key=lambda node: node.depth)
+        removed = set()
+        reinserted = 0
+        for node in nodes:
+            if node in removed:
                 continue
+            last = max(self.insert_order.get(arrival_id, position) for arrival_id in node.arrivals)
+            replay_ids = [arrival_id for arrival_id in node.arrivals if arrival_id != record_id]
+            self._clear_arrivals(node)
+            self._unbucket(node)
+            if node.left_children is not None:
+                removed.update(self._collapse(node))
+                later_ids = np.array([i for i, p in self.insert_order.items() if p > last], dtype=np.int64)
+                if later_ids.size:
+                    replay_ids += self._reaching(node, later_ids).tolist()
+            for replay_id in replay_ids:
+                self._insert_from(node, replay_id, m, n, db_name, conn)
+            reinserted += len(replay_ids)
+        return reinserted
+
+    def update(self, record_id, new_coeffs, m=None, n=None, db_name=None, conn=None):
+        """
+        Replace the coefficients of a record: it is deleted, changed in SQLiteReader (and in the table if a
+        connection is given) and inserted again, as the most recent record.
+        Parameters:
+            record_id (int): ID of the record to change.
+            new_coeffs (tuple): New record as (coefficient1, ..., coefficientd, constant).
+            m (int): Number of functions.
+            n (int): Dimension of functions.
+            db_name (str): Database file name.
+            conn: SQLite database connection.
+        """
+        self.delete(record_id, m, n, db_name, conn)
+        SQLiteReader.update_record(record_id, new_coeffs, m, n, conn)
+        self._register(record_id)
+        self._insert_from(self.root, record_id, m, n, db_name, conn)
 
-            stack.append(current.left_children)
-            stack.append(current.right_children)
+    def cells_in(self, box):
+        """
+        Leaves whose cells intersect an axis-aligned box, streamed as (node_id, vertices).
+        Parameters:
+            box (tuple): (lower, upper) corners of the box.
+        """
+        lower, upper = box
+        return self.cells_in_polytope(box_constraints(lower, upper))
 
+    def cells_in_polytope(self, constraints):
+        """
+        Leaves whose cells intersect a convex polytope given as constraints (a1, ..., ad, b) meaning a·x + b >= 0,
+        streamed as (node_id, vertices) by tree_query.cells_in_polytope.
+        """
+        return cells_in_polytope(self, constraints, self._records_array(), self.init_constraints)
 
     def print_tree_by_layer(self, m, n, db_name, conn):
         """
-        Print the VI Tree layer by layer, showing each node's ID, vertices, and database record.
-        Handles negative IDs by converting them to positive when fetching records.
+        Print the tree layer by layer, showing each node's ID, vertices, and database record.
+        Nodes are streamed by tree_export.iter_nodes and their records are fetched in batches.
         Parameters:
             m (int): Number of functions.
             n (int): Dimension of functions.
             db_name (str): Database file name.
             conn: SQLite database connection.
         """
-        if self.root is None:
-            print("The tree is empty.")
-            return
-
-        # Use a queue to implement level-order traversal, along with layer tracking
-        queue = [(self.root, 0)]  # Each element is a tuple (node, layer)
-        current_layer = 0
-        layer_output = []
-
-        while queue:
-            current, layer = queue.pop(0)  # Dequeue the front node
-
-            # Check if we've moved to a new layer
-            if layer > current_layer:
-                # Print all nodes in the previous layer
-                print(f"Layer {current_layer}:")
-                for node_output in layer_output:
-                    print(node_output)
-                print()  # Blank line between layers
-                layer_output = []  # Reset the layer output
-                current_layer = layer
-
-            # Fetch record from the database
-            record_id = abs(current.intersection_id)  # Use positive ID for fetching
-            record = read_from_sqlite(m, n, db_name=db_name, record_id=record_id, conn=conn)
-
-            # Add the current node's details to the layer output
-            layer_output.append(
-                f"Node ID: {current.intersection_id}, Vertices: {current.vertices}, Record: {record}"
-            )
-
-            # Enqueue the left and right children if they exist, with incremented layer
-            if current.left_children:
-                queue.append((current.left_children, layer + 1))
-            if current.right_children:
-                queue.append((current.right_children, layer + 1))
-
-        # Print the last layer
-        print(f"Layer {current_layer}:")
-        for node_output in layer_output:
-            print(node_output)
+        print_tree_by_layer(self, m, n, db_name, conn)
 
     def get_height(self):
-        if self.root is None:
-            return 0
-        # Iterative approach using a queue (BFS)
-        from collections import deque
-        queue = deque([(self.root, 1)])
-        max_depth = 0
-        while queue:
-            node, depth = queue.popleft()
-            if node is not None:
-                max_depth = max(max_depth, depth)
-                queue.append((node.left_children, depth + 1))
-                queue.append((node.right_children, depth + 1))
-        return max_depth
+        """
+        Height of the tree as the number of layers, maintained incrementally during insert.
+        """
+        return self._stats.height
 
     def get_leaf_count(self):
-        if self.root is None:
-            return 0
-        # Iterative approach using a stack (DFS)
-        stack = [self.root]
-        leaf_count = 0
-        while stack:
-            node = stack.pop()
-            if node is not None:
-                # Check if it is a leaf and not flagged as not_enough_vertices
-                if node.left_children is None and node.right_children is None and not node.not_enough_vertices:
-                    leaf_count += 1
-                else:
-                    stack.append(node.left_children)
-                    stack.append(node.right_children)
-        return leaf_count
+        """
+        Number of leaf nodes in the tree, maintained incrementally during insert.
+        """
+        return self._stats.leaf_count
 
+    def stats(self):
+        """
+        Snapshot of the node count, leaf count, height, depth histogram and vertex total.
+        Cheap enough to poll during a long build.
+        """
+        tree_stats = self._stats.as_dict()
+        if self.vertex_budget is not None:
+            tree_stats.update(self.vertex_budget.stats())
+        if self.pairs is not None:
+            tree_stats["implied_skips"] = self.implied_skips
+            tree_stats["crossing_tests"] = self.crossing_tests
+        if self.bucket_size:
+            tree_stats["bucket_size"] = self.bucket_size
+            tree_stats["bucketed_records"] = sum(len(leaves) for leaves in self.bucket_nodes.values())
+        if self.buffer_size:
+            tree_stats["buffered_records"] = sum(len(record_ids) for record_ids in self.buffers.values())
+        return tree_stats
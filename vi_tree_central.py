@@ -0,0 +1,150 @@
+import numpy as np
+
+import vi_tree
+from function_utils import FunctionProfiler, generate_constraints, box_bounds
+from sqlite_utils import SQLiteReader
+from tree_query import ROUNDING_SLACK, cells_in_polytope
+
+
+def is_central(records, var_min):
+    """
+    Whether the records form a central arrangement over the domain [var_min, var_max]^d with its corner at the
+    origin: every hyperplane a·x = 0 passes through the origin, so every cell is a cone with apex 0.
+    """
+    records = np.asarray(records)
+    return var_min == 0 and len(records) > 0 and not np.any(records[:, -1])
+
+
+def slice_records(records, scale):
+    """
+    Restrict central records to the slice x1 + ... + xd = scale of the non-negative orthant.
+    Eliminating xd = scale - (x1 + ... + x(d-1)) turns a·x >= 0 into
+    (a1 - ad) x1 + ... + (a(d-1) - ad) x(d-1) - (-ad * scale) >= 0, a record of dimension d - 1 with a constant.
+    Every point x >= 0 other than the origin scales onto the slice without changing its signs, so a record crosses
+    a cone exactly when the sliced record crosses the sliced cell. The sliced records are scaled to unit coefficient
+    norm, as the mix of small coefficients and large constants otherwise makes cdd lose non-empty cells.
+    Parameters:
+        records (numpy.ndarray): Records of shape (num_records, d + 1) with zero constants.
+        scale (float): Sum of the coordinates on the slice. Any positive value gives the same signs; a larger one
+            leaves more room for the integer rounding of compute_vertices.
+    Returns:
+        numpy.ndarray: Sliced records of shape (num_records, d).
+    """
+    records = np.asarray(records, dtype=np.float64)
+    coefficients = records[:, :-1]
+    last = coefficients[:, -1:]
+    sliced = np.hstack((coefficients[:, :-1] - last, -last * scale))
+    norms = np.linalg.norm(sliced[:, :-1], axis=1, keepdims=True)
+    return sliced / np.where(norms > 0, norms, 1.0)
+
+
+def slice_constraints(n, scale):
+    """
+    Constraints of the sliced domain, the simplex x1, ..., x(n-1) >= 0 and x1 + ... + x(n-1) <= scale, in the
+    format of generate_constraints.
+    """
+    constraints = []
+    for i in range(n - 1):
+        lower_bound = [0] * (n - 1)
+        lower_bound[i] = 1
+        constraints.append((*lower_bound, 0))
+    constraints.append((*([-1] * (n - 1)), scale))
+    return constraints
+
+
+def lift_vertices(vertices, scale):
+    """
+    Map vertices of the slice back to the original space by appending xd = scale - (x1 + ... + x(d-1)).
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(len(vertices), -1)
+    return np.hstack((vertices, scale - vertices.sum(axis=1, keepdims=True)))
+
+
+class CentralVITree(vi_tree.VITree):
+    """
+    VI tree of a central arrangement, built on the slice x1 + ... + xd = scale instead of the box.
+
+    The cells of a central arrangement in [0, var_max]^d are cones sharing the origin as a vertex, which makes cdd
+    work on degenerate input in dimension d. On the slice the same cells are polytopes of dimension d - 1 without a
+    shared vertex, and the domain is a simplex with d vertices instead of a box with 2^d. The tree splits on its own
+    sliced records and never touches the records loaded in SQLiteReader, so other trees in the process are not
+    affected. Nodes carry the same signed record IDs as in a VITree, so tree_query.locate_points works with the
+    original records; node vertices are in slice coordinates (see lift_vertices). Updates and range queries take
+    records and regions in the original space.
+    """
+
+    def __init__(self, records, scale, track_adjacency=False, memory_budget=None, prune_constraints=False, pairs=None,
+                 bucket_size=0, buffer_size=0, domain=None):
+        """
+        Parameters:
+            records (numpy.ndarray): Records of the dataset, row i holding record ID i + 1, with zero constants.
+            scale (float): Sum of the coordinates on the slice, BuildPipeline uses n * var_max (the far corner).
+            track_adjacency, memory_budget, prune_constraints, pairs, bucket_size, buffer_size: As for VITree.
+            domain (list): Constraints of the original domain, which bounds range queries; defaults to the box
+                [0, scale / d]^d, whose far corner lies on the slice.
+        """
+        n = np.shape(records)[1] - 1
+        # A full-dimensional cell of the (n - 1)-dimensional slice has at least n vertices
+        super().__init__(track_adjacency, memory_budget, prune_constraints, min_vertices=n, pairs=pairs,
+                         bucket_size=bucket_size, buffer_size=buffer_size, records=slice_records(records, scale))
+        self.scale = scale
+        self.constraints = slice_constraints(n, scale)
+        self.vertices = FunctionProfiler.compute_vertices(self.constraints)
+        self.domain = domain if domain is not None else generate_constraints(n, 0, scale / n)
+
+    def insert(self, record_id, constraints=None, vertices=None, m=None, n=None, db_name=None, conn=None, manager=None):
+        """
+        Insert a record. The domain passed by the caller is replaced by the slice.
+        """
+        super().insert(record_id, self.constraints, self.vertices, m, n, db_name, conn, manager)
+
+    def update(self, record_id, new_coeffs, m=None, n=None, db_name=None, conn=None):
+        """
+        Replace the coefficients of a record, as VITree.update does. The new record is changed in SQLiteReader (and in
+        the table if a connection is given) and sliced again before it is inserted.
+        Parameters:
+            record_id (int): ID of the record to change.
+            new_coeffs (tuple): New record as (coefficient1, ..., coefficientd, constant), with a zero constant.
+            m, n, db_name, conn: As for VITree.update.
+        """
+        new_coeffs = tuple(new_coeffs)
+        if new_coeffs[-1]:
+            raise ValueError(f"Record {record_id} must keep a zero constant in a central tree, got {new_coeffs[-1]}.")
+        self.delete(record_id, m, n, db_name, conn)
+        SQLiteReader.update_record(record_id, new_coeffs, m, n, conn)
+        self.records[record_id - 1] = slice_records([new_coeffs], self.scale)[0]
+        self._register(record_id)
+        self._insert_from(self.root, record_id, m, n, db_name, conn)
+
+    def cells_in_polytope(self, constraints):
+        """
+        Leaves whose cells intersect a convex polytope in the original space, given as constraints (a1, ..., ad, b)
+        meaning a·x + b >= 0, streamed as (node_id, vertices) by tree_query.cells_in_polytope.
+        A cell within the domain lies in its cone below the slice through the domain's far corner, so the pruning
+        tests use the origin and the lifted vertices (see cone_vertices), which are also the vertices yielded. The
+        final test of a leaf uses the original records and is exact.
+        """
+        bounds = box_bounds(self.domain)
+        if bounds is not None:
+            far = bounds[1].sum()
+        else:
+            far = max(sum(vertex) for vertex in FunctionProfiler.compute_vertices(self.domain))
+        reach = max(1.0, far / self.scale)
+        # Slice coordinates are rounded to integers, and the last lifted coordinate sums their errors
+        rounding = reach * ROUNDING_SLACK * max(1, len(self.domain[0]) - 2)
+        return cells_in_polytope(self, constraints, SQLiteReader.get_records_array(), self.domain,
+                                 get_vertices=lambda node: self.cone_vertices(node, reach), rounding=rounding)
+
+    def lifted_vertices(self, node):
+        """
+        Vertices of a node's cell on the slice, in the coordinates of the original space.
+        """
+        return lift_vertices(self.get_vertices(node), self.scale)
+
+    def cone_vertices(self, node, reach=1.0):
+        """
+        Vertices of the part of a node's cone below the slice scaled by reach: the origin and the lifted vertices
+        times reach.
+        """
+        lifted = self.lifted_vertices(node)
+        return np.vstack((np.zeros((1, lifted.shape[1])), reach * lifted))
@@ -0,0 +1,137 @@
+import numpy as np
+
+from function_utils import FunctionProfiler
+from sqlite_utils import SQLiteReader
+from tree_export import print_tree_by_layer
+from tree_stats import TreeStats
+from cell_adjacency import LeafAdjacency
+from vi_tree import TreeNode, keeps_split
+
+
+class ConflictVITree:
+    """
+    VI tree built by randomized incremental construction with conflict lists.
+
+    Every leaf keeps the IDs of the not-yet-inserted records that cross its cell (its conflict list), and every
+    pending record knows the leaves it crosses. Inserting a record therefore visits only those leaves instead of
+    descending from the root, and splitting a leaf redistributes its conflict list to the two children with one
+    vectorized crossing test per child. The leaves in one record's conflict list are independent of each other.
+
+    The split rules are those of vi_tree.VITree (vi_tree.keeps_split), so for the same insertion order and
+    min_vertices both engines build the same tree.
+    """
+
+    def __init__(self, track_adjacency=False, min_vertices=4):
+        self.root = None  # Initialize the tree with no root
+        self.min_vertices = min_vertices  # A split is skipped if either child has fewer vertices, as in VITree
+        self.init_constraints = []  # Domain constraints shared by all nodes
+        self._stats = TreeStats()  # Incrementally maintained statistics
+        self.crossing_tests = 0  # Number of (record, cell) crossing tests performed
+        self.track_adjacency = track_adjacency
+        self.adjacency = None  # LeafAdjacency between leaf cells, created with the root if track_adjacency is set
+
+    def _cell_vertices(self, node_constraints):
+        """
+        Compute the vertices of the cell described by a list of signed record IDs.
+        """
+        return FunctionProfiler.compute_cell_vertices(node_constraints, self.init_constraints)
+
+    def build(self, record_ids, constraints, vertices, m=None, n=None, db_name=None, conn=None):
+        """
+        Build the tree from records in insertion order.
+        Parameters:
+            record_ids (list): Record IDs in insertion order. The first one splits the root.
+            constraints (list): Constraints of the initial domain.
+            vertices (list): Vertices of the initial domain.
+            m (int): Number of functions.
+            n (int): Dimension of functions.
+            db_name (str): Database file name.
+            conn: SQLite database connection.
+        """
+        record_ids = np.asarray(record_ids, dtype=np.int64)
+        if record_ids.size == 0:
+            return
+
+        self.init_constraints = constraints
+        self._records = SQLiteReader.get_records_array()
+        self._pending = {}  # Record ID -> leaves whose conflict list contains it
+
+        first_id = int(record_ids[0])
+        self.root = TreeNode(first_id, None, vertices)
+        self._stats.add_root(self.root)
+        if self.track_adjacency:
+            self.adjacency = LeafAdjacency(len(constraints[0]) - 1, self._cell_vertices)
+            self.adjacency.add_root(self.root)
+
+        left, right = self._children_vertices(self.root, first_id, m, n, db_name, conn)
+        self._split(self.root, first_id, left, right, record_ids[1:])
+
+        for record_id in record_ids[1:].tolist():
+            for leaf in self._pending.pop(record_id, []):
+                # The entry is stale if the leaf was split since it was registered
+                if leaf.left_children is not None:
+                    continue
+                # Conflict lists stay in insertion order and earlier records were already resolved,
+                # so the record being inserted is always at the front
+                remaining = leaf.conflicts[1:]
+
+                left, right = self._children_vertices(leaf, record_id, m, n, db_name, conn)
+                if not keeps_split(leaf.vertices, left, right, self.min_vertices):
+                    leaf.conflicts = remaining
+                    continue
+
+                self._split(leaf, record_id, left, right, remaining)
+
+        # Conflict lists are empty once every record is inserted
+        self._pending = {}
+
+    def _children_vertices(self, leaf, record_id, m, n, db_name, conn):
+        return (FunctionProfiler.compute_cell_vertices(leaf.constraints + [-record_id], self.init_constraints, m, n, db_name, conn),
+                FunctionProfiler.compute_cell_vertices(leaf.constraints + [record_id], self.init_constraints, m, n, db_name, conn))
+
+    def _split(self, leaf, record_id, left_vertices, right_vertices, candidates):
+        """
+        Split a leaf by a record and hand each child the candidates that cross it.
+        """
+        leaf.left_children = TreeNode(-record_id, constraints=[-record_id] + leaf.constraints, vertices=left_vertices)
+        leaf.right_children = TreeNode(record_id, constraints=[record_id] + leaf.constraints, vertices=right_vertices)
+        self._stats.add_children(leaf, leaf.left_children, leaf.right_children)
+        if self.adjacency is not None:
+            self.adjacency.on_split(leaf, leaf.left_children, leaf.right_children, record_id)
+        leaf.conflicts = None
+
+        for child in (leaf.left_children, leaf.right_children):
+            if candidates.size:
+                crosses = FunctionProfiler.check_functions(self._records[candidates - 1], child.vertices)
+                self.crossing_tests += candidates.size
+                child.conflicts = candidates[crosses]
+            else:
+                child.conflicts = candidates
+            for other in child.conflicts.tolist():
+                self._pending.setdefault(other, []).append(child)
+
+    def print_tree_by_layer(self, m, n, db_name, conn):
+        """
+        Print the tree layer by layer, showing each node's ID, vertices, and database record.
+        """
+        print_tree_by_layer(self, m, n, db_name, conn)
+
+    def get_height(self):
+        """
+        Height of the tree as the number of layers.
+        """
+        return self._stats.height
+
+    def get_leaf_count(self):
+        """
+        Number of leaf nodes in the tree.
+        """
+        return self._stats.leaf_count
+
+    def stats(self):
+        """
+        Snapshot of the tree statistics plus the number of crossing tests performed.
+        """
+        tree_stats = self._stats.as_dict()
+        tree_stats["crossing_tests"] = self.crossing_tests
+        return tree_stats
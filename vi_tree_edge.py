@@ -1,7 +1,9 @@
 from edge_utils import get_edges_from_hull, compute_intersection_points
-from function_utils import check_function, compute_vertices, merge_constraints, get_tight_constraints, \
+from function_utils import check_function, merge_constraints, get_tight_constraints, \
     check_smallest_intervals
 from sqlite_utils import read_from_sqlite
+from tree_export import print_tree_by_layer
+from tree_stats import TreeStats
 
 
 init_constraints = []  # Global variable to store initial constraints
@@ -15,11 +17,14 @@ class TreeNode:
         self.left_children = None  # Left child
         self.right_children = None  # Right child
         self.skip_flag = False  # Flag to indicate if this node should be skipped
+        self.node_id = None  # Creation order, assigned by TreeStats
+        self.depth = 0  # Depth in the tree, assigned by TreeStats
 
 
 class VIETree:
     def __init__(self):
         self.root = None  # Initialize the tree with no root
+        self._stats = TreeStats()  # Incrementally maintained statistics
 
     def insert(self, record_id, constraints, vertices=None, m=None, n=None, db_name=None, conn=None, var_min=0, var_max=10):
         """
@@ -50,6 +55,7 @@ class VIETree:
             self.root.vertices = vertices if vertices is not None else []
             self.root.edges, _ = get_edges_from_hull(self.root.vertices)
 
+            self._stats.add_root(self.root)
             return
 
         # Use a stack to manage nodes for non-recursive traversal
@@ -84,6 +90,7 @@ class VIETree:
                     vertices = vertex_larger,
                     edges = segment_larger
                 )
+                self._stats.add_children(current, current.left_children, current.right_children)
                 continue
 
 
@@ -96,82 +103,31 @@ class VIETree:
 
     def print_tree_by_layer(self, m, n, db_name, conn):
         """
-        Print the VI Tree layer by layer, showing each node's ID, vertices, and database record.
-        Handles negative IDs by converting them to positive when fetching records.
+        Print the tree layer by layer, showing each node's ID, vertices, and database record.
+        Nodes are streamed by tree_export.iter_nodes and their records are fetched in batches.
         Parameters:
             m (int): Number of functions.
             n (int): Dimension of functions.
             db_name (str): Database file name.
             conn: SQLite database connection.
         """
-        if self.root is None:
-            print("The tree is empty.")
-            return
-
-        # Use a queue to implement level-order traversal, along with layer tracking
-        queue = [(self.root, 0)]  # Each element is a tuple (node, layer)
-        current_layer = 0
-        layer_output = []
-
-        while queue:
-            current, layer = queue.pop(0)  # Dequeue the front node
-
-            # Check if we've moved to a new layer
-            if layer > current_layer:
-                # Print all nodes in the previous layer
-                print(f"Layer {current_layer}:")
-                for node_output in layer_output:
-                    print(node_output)
-                print()  # Blank line between layers
-                layer_output = []  # Reset the layer output
-                current_layer = layer
-
-            # Fetch record from the database
-            record_id = abs(current.intersection_id)  # Use positive ID for fetching
-            record = read_from_sqlite(m, n, db_name=db_name, record_id=record_id, conn=conn)
-
-            # Add the current node's details to the layer output
-            layer_output.append(
-                f"Node ID: {current.intersection_id}, Vertices: {current.vertices}, Record: {record}"
-            )
-
-            # Enqueue the left and right children if they exist, with incremented layer
-            if current.left_children:
-                queue.append((current.left_children, layer + 1))
-            if current.right_children:
-                queue.append((current.right_children, layer + 1))
-
-        # Print the last layer
-        print(f"Layer {current_layer}:")
-        for node_output in layer_output:
-            print(node_output)
+        print_tree_by_layer(self, m, n, db_name, conn)
 
     def get_height(self):
         """
-        Calculate the height of the VI Tree.
-        Returns:
-            int: Height of the tree (max depth of any node).
+        Height of the tree as the number of layers, maintained incrementally during insert.
         """
-        def _height(node):
-            if node is None:
-                return 0
-            left_height = _height(node.left_children)
-            right_height = _height(node.right_children)
-            return max(left_height, right_height) + 1
-
-        return _height(self.root)
+        return self._stats.height
 
     def get_leaf_count(self):
         """
-        Count the number of leaf nodes in the VI Tree.
-        Returns:
-            int: Number of leaf nodes in the tree.
+        Number of leaf nodes in the tree, maintained incrementally during insert.
+        """
+        return self._stats.leaf_count
+
+    def stats(self):
+        """
+        Snapshot of the node count, leaf count, height, depth histogram and vertex total.
+        Cheap enough to poll during a long build.
         """
-        def _leaf_count(node):
-            if node is None:
-                return 0
-            if node.left_children is None and node.right_children is None:
-                return 1
-            return _leaf_count(node.left_children) + _leaf_count(node.right_children)
-
-        return _leaf_count(self.root)
\ No newline at end of file
+        return self._stats.as_dict()
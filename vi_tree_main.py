@@ -1,14 +1,12 @@
 import argparse
 import random
 
-from sqlite_utils import read_from_sqlite, get_all_ids, SQLiteReader
-from function_utils import generate_constraints, check_function, FunctionProfiler
-from tqdm import tqdm  # Import the progress bar library
-import time  # Import time for measuring execution
-import sqlite3
+from build_pipeline import BuildPipeline
+from function_utils import FunctionProfiler
+from insertion_order import STRATEGIES
 
 from vertex_utils import create_lookup_table, VertexManager
-from vi_tree import VITree
+from tree_export import export_tree
 from visualization_utils import plot_linear_equations
 
 
@@ -20,6 +18,21 @@ if __name__ == '__main__':
     parser.add_argument("--db", type=str, default="test_intersections.db", help="Database file (default: intersections.db)")
     parser.add_argument("--var_min", type=float, default=0, help="Minimum value for variables (default: 0)")
     parser.add_argument("--var_max", type=float, default=1000, help="Maximum value for variables (default: 10)")
+    parser.add_argument("--engine", type=str, default="insert", choices=["auto", "insert", "central", "conflict", "paged"], help="Construction engine: root-to-leaf insert, insert on a slice of a central arrangement, conflict lists, or insert into a tree stored in the database; auto picks central when all constants are zero and var_min is 0, insert otherwise (default: insert)")
+    parser.add_argument("--cache_size", type=int, default=100000, help="Nodes kept in memory by the paged engine (default: 100000)")
+    parser.add_argument("--adjacency", type=str, default=None, help="Maintain the leaf adjacency graph and save it as CSR arrays to this .npz file")
+    parser.add_argument("--memory_budget", type=float, default=None, help="Memory budget in MB for node vertex sets; cold sets are evicted and recomputed (insert and central engines only)")
+    parser.add_argument("--prune", action="store_true", help="Prune node constraints to their facet-defining records (insert and central engines only)")
+    parser.add_argument("--transitivity", action="store_true", help="Skip records whose sign is implied by the function order of a node (insert and central engines, zero constants only)")
+    parser.add_argument("--bucket_size", type=int, default=0, help="Crossing records a leaf holds before it splits; 0 splits on every record (insert and central engines only, default: 0)")
+    parser.add_argument("--buffer_size", type=int, default=0, help="Buffer inserted records at the nodes and push a buffer one level down when it holds this many; the tree is the same (insert and central engines only, default: 0)")
+    parser.add_argument("--export", type=str, default=None, help="Stream the built tree to a .jsonl file or chunked .npz files with this prefix")
+    parser.add_argument("--order", type=str, default="prefix", choices=STRATEGIES, help="Insertion order strategy (default: prefix)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for randomised insertion orders (default: 0)")
+    parser.add_argument("--workers", type=int, default=None, help="Prefilter the records in this many processes while loading them (default: in-process)")
+    parser.add_argument("--chunk_size", type=int, default=1 << 20, help="Records per parallel prefilter task (default: 1048576)")
+    parser.add_argument("--cell_cache", action="store_true", help="Reuse cell vertices across runs through a cache file next to the database (<db>.cells)")
+    parser.add_argument("--cell_cache_size", type=int, default=1000000, help="Cells kept in the cache file (default: 1000000)")
     args = parser.parse_args()
 
     m = args.m
@@ -31,48 +44,27 @@ if __name__ == '__main__':
     # Dynamically construct the table name
     table_name = f"intersections_m{m}_n{n}"
 
-    # Open a single connection to the database
-    conn = sqlite3.connect(db_name)
+    # Load the records once and prefilter them against the initial domain
+    pipeline = BuildPipeline(m, n, db_name, var_min, var_max, workers=args.workers, chunk_size=args.chunk_size,
+                             cell_cache=f"{db_name}.cells" if args.cell_cache else None, cell_cache_size=args.cell_cache_size)
+    conn = pipeline.conn
+    constraints = pipeline.constraints
+    print(f"Found {len(pipeline.ids)} IDs in table {table_name}.")
+    engine = pipeline.resolve(args.engine)
+    print(f"Construction engine: {engine}")
 
-    # Get all IDs from the table
-    ids = get_all_ids(m, n, db_name=db_name)
-    print(f"Found {len(ids)} IDs in table {table_name}.")
-
-    # Generate constraints using n (as dimensionality), var_min, and var_max
-    constraints = generate_constraints(n, var_min, var_max)
     print("Generated constraints as tuples:")
     for constraint in constraints:
         print(constraint)
+    print(f"Computed vertices of the initial domain: {pipeline.vertices}")
 
-    # Compute vertices for the initial domain
-    vertices = FunctionProfiler.compute_vertices(constraints)
-    print(f"Computed vertices of the initial domain: {vertices}")
-
-    SQLiteReader.read_all_from_sqlite(m, n)
-
-    # Collect IDs of records that satisfy the condition
-    satisfying_ids = []
-
-    # Process records with progress tracking
-    for record_id in ids:
-        # record = read_from_sqlite(m, n, conn=conn, record_id=record_id)
-        record = SQLiteReader.get_record_by_id(record_id)
-        if check_function(record, vertices):
-            satisfying_ids.append(record_id)
-
-    # Calculate the number of IDs to sample (20% of the total)
-    sample_size = int(0.2 * len(ids))
-    sampled_ids = satisfying_ids[:sample_size]
-
-    # Initialize the VI Tree
-    vi_tree = VITree()
+    # Take 20% of the total number of IDs from the records crossing the domain
+    sampled_ids = pipeline.order(args.order, fraction=0.2, seed=args.seed)
+    print(f"Insertion order: {args.order}")
 
     # Fetch and process records by ID
     print("Processing records:")
 
-    # Set a counter for the number of intersection partitions the domain
-    counter = 0
-
     interval = 0.1
     # Create lookup table
     # lookup_table = create_lookup_table(var_min, var_max, interval, n)
@@ -80,36 +72,44 @@ if __name__ == '__main__':
     # Initialize with precision
     manager = VertexManager(precision=0.1)
 
-    # Start the timer
-    start_time = time.time()
-
-    records_to_draw = []
-
-    # Insert records into the VI Tree with progress tracking
-    for record_id in tqdm(sampled_ids, desc="Processing Records", unit="sampled_records"):
-        # record = FunctionProfiler.read_from_sqlite(m, n, conn=conn, record_id=record_id)
-        record = SQLiteReader.get_record_by_id(record_id)
-        if FunctionProfiler.check_function(record, vertices):
-            counter += 1
-            # records_to_draw.append(record)
-            # print(f"Record with ID {record_id} satisfies the condition: {record}")
-            # Insert the record into the VI Tree
-            vi_tree.insert(record_id, constraints, vertices, m=m, n=n, db_name=db_name, conn=conn, manager=manager)
-        # if counter > 5:
-        #     break
-
-    # Stop the timer
-    end_time = time.time()
+    # Build the VI Tree with the selected engine
+    track_adjacency = args.adjacency is not None
+    memory_budget = None if args.memory_budget is None else int(args.memory_budget * 1024 * 1024)
+    vi_tree, counter, elapsed = pipeline.build(engine, sampled_ids, manager=manager, progress=True,
+                                               track_adjacency=track_adjacency, memory_budget=memory_budget,
+                                               prune_constraints=args.prune, transitivity=args.transitivity,
+                                               bucket_size=args.bucket_size, buffer_size=args.buffer_size,
+                                               cache_size=args.cache_size)
 
     # Print the number of intersection partitions
     print(f"Number of intersection partitions: {counter}")
 
     # Print the time taken to insert all records
-    print(f"Time taken to insert all records into the VI Tree: {end_time - start_time:.2f} seconds")
+    print(f"Time taken to insert all records into the VI Tree: {elapsed:.2f} seconds")
 
     # print("\nVI Tree Structure (Layer by Layer with Records):")
     # vi_tree.print_tree_by_layer(m, n, db_name, conn)
 
+    if memory_budget is not None and engine in ("insert", "central"):
+        tree_stats = vi_tree.stats()
+        print(f"Vertex sets evicted: {tree_stats['evictions']}, recomputed: {tree_stats['recomputes']}")
+
+    tree_stats = vi_tree.stats()
+    if "implied_skips" in tree_stats:
+        skipped = tree_stats["implied_skips"]
+        total = skipped + tree_stats["crossing_tests"]
+        print(f"Crossing tests skipped by transitivity: {skipped} of {total} ({skipped / max(total, 1):.1%})")
+    if "bucketed_records" in tree_stats:
+        print(f"Bucket size {tree_stats['bucket_size']}: {tree_stats['nodes']} nodes in {elapsed:.2f} seconds, "
+              f"{tree_stats['bucketed_records']} records held in leaf buckets")
+
+    if args.adjacency:
+        vi_tree.adjacency.save(args.adjacency)
+        print(f"Saved leaf adjacency graph to {args.adjacency}")
+
+    if args.export:
+        export_tree(vi_tree, args.export, m, n, db_name, conn)
+
     # Print the height of the tree
     print(f"Height of the VI Tree: {vi_tree.get_height()}")
 
@@ -120,8 +120,11 @@ if __name__ == '__main__':
     print("Total time in check_function:", FunctionProfiler.total_time_check_function)
     print("Total time in read_from_sqlite:", FunctionProfiler.total_time_read_from_sqlite)
 
+    if pipeline.cell_cache is not None:
+        print("Cell cache:", pipeline.cell_cache.stats())
+
     # Close the database connection
-    conn.close()
+    pipeline.close()
     print("Database connection closed.")
 
     # plot_linear_equations(records_to_draw)
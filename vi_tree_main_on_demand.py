@@ -1,14 +1,12 @@
 import argparse
-import random
 
-from sqlite_utils import read_from_sqlite, get_all_ids
-from function_utils import generate_constraints, check_function, FunctionProfiler
-from tqdm import tqdm  # Import the progress bar library
-import time  # Import time for measuring execution
-import sqlite3
+import numpy as np
+
+from build_pipeline import BuildPipeline
+from function_utils import FunctionProfiler
+from insertion_order import STRATEGIES
 
 from vertex_utils import create_lookup_table, VertexManager
-from vi_tree_on_demand import VITree
 from visualization_utils import plot_linear_equations
 
 
@@ -20,6 +18,15 @@ if __name__ == '__main__':
     parser.add_argument("--db", type=str, default="test_intersections.db", help="Database file (default: intersections.db)")
     parser.add_argument("--var_min", type=float, default=0, help="Minimum value for variables (default: 0)")
     parser.add_argument("--var_max", type=float, default=10, help="Maximum value for variables (default: 10)")
+    parser.add_argument("--points", type=str, default=None, help="Query points as a .npy or .csv file of shape (num_points, n)")
+    parser.add_argument("--num_points", type=int, default=1000, help="Number of random query points if --points is not given (default: 1000)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for random query points (default: 0)")
+    parser.add_argument("--prune", action="store_true", help="Prune node constraints to their facet-defining records")
+    parser.add_argument("--order", type=str, default="prefix", choices=STRATEGIES, help="Insertion order strategy (default: prefix)")
+    parser.add_argument("--workers", type=int, default=None, help="Prefilter the records in this many processes while loading them (default: in-process)")
+    parser.add_argument("--chunk_size", type=int, default=1 << 20, help="Records per parallel prefilter task (default: 1048576)")
+    parser.add_argument("--cell_cache", action="store_true", help="Reuse cell vertices across runs through a cache file next to the database (<db>.cells)")
+    parser.add_argument("--cell_cache_size", type=int, default=1000000, help="Cells kept in the cache file (default: 1000000)")
     args = parser.parse_args()
 
     m = args.m
@@ -31,45 +38,35 @@ if __name__ == '__main__':
     # Dynamically construct the table name
     table_name = f"intersections_m{m}_n{n}"
 
-    # Open a single connection to the database
-    conn = sqlite3.connect(db_name)
-
-    # Get all IDs from the table
-    ids = get_all_ids(m, n, db_name=db_name)
-    print(f"Found {len(ids)} IDs in table {table_name}.")
+    # Load the records once and prefilter them against the initial domain
+    pipeline = BuildPipeline(m, n, db_name, var_min, var_max, workers=args.workers, chunk_size=args.chunk_size,
+                             cell_cache=f"{db_name}.cells" if args.cell_cache else None, cell_cache_size=args.cell_cache_size)
+    conn = pipeline.conn
+    constraints = pipeline.constraints
+    print(f"Found {len(pipeline.ids)} IDs in table {table_name}.")
 
-    # Generate constraints using n (as dimensionality), var_min, and var_max
-    constraints = generate_constraints(n, var_min, var_max)
     print("Generated constraints as tuples:")
     for constraint in constraints:
         print(constraint)
-
-    # Compute vertices for the initial domain
-    vertices = FunctionProfiler.compute_vertices(constraints)
-    print(f"Computed vertices of the initial domain: {vertices}")
-
-    # Collect IDs of records that satisfy the condition
-    satisfying_ids = []
-
-    # Process records with progress tracking
-    for record_id in ids:
-        record = read_from_sqlite(m, n, conn=conn, record_id=record_id)
-        if check_function(record, vertices):
-            satisfying_ids.append(record_id)
-
-    # Calculate the number of IDs to sample (20% of the total)
-    sample_size = int(0.2 * len(ids))
-    sampled_ids = satisfying_ids[:sample_size]
-
-    # Initialize the VI Tree
-    vi_tree = VITree()
+    print(f"Computed vertices of the initial domain: {pipeline.vertices}")
+
+    # Load or draw the batch of query points
+    if args.points is None:
+        rng = np.random.default_rng(args.seed)
+        query_points = rng.uniform(var_min, var_max, size=(args.num_points, n))
+    elif args.points.endswith(".npy"):
+        query_points = np.load(args.points)
+    else:
+        query_points = np.loadtxt(args.points, delimiter=",", ndmin=2)
+    print(f"Using {len(query_points)} query points.")
+
+    # Take 20% of the total number of IDs from the records crossing the domain
+    sampled_ids = pipeline.order(args.order, fraction=0.2, seed=args.seed)
+    print(f"Insertion order: {args.order}")
 
     # Fetch and process records by ID
     print("Processing records:")
 
-    # Set a counter for the number of intersection partitions the domain
-    counter = 0
-
     interval = 0.1
     # Create lookup table
     # lookup_table = create_lookup_table(var_min, var_max, interval, n)
@@ -77,32 +74,20 @@ if __name__ == '__main__':
     # Initialize with precision
     manager = VertexManager(precision=0.01)
 
-    # Start the timer
-    start_time = time.time()
-
-    records_to_draw = []
-    given_vertex = [1.0, 1.0, 5.0, 1.0, 1.0]
-
-    # Insert records into the VI Tree with progress tracking
-    for record_id in tqdm(sampled_ids, desc="Processing Records", unit="sampled_records"):
-        record = FunctionProfiler.read_from_sqlite(m, n, conn=conn, record_id=record_id)
-        if FunctionProfiler.check_function(record, vertices):
-            counter += 1
-            # records_to_draw.append(record)
-            # print(f"Record with ID {record_id} satisfies the condition: {record}")
-            # Insert the record into the VI Tree
-            vi_tree.insert(record_id, constraints, vertices, m=m, n=n, db_name=db_name, conn=conn, manager=manager, given_vertex=given_vertex)
-        # if counter > 5:
-        #     break
-
-    # Stop the timer
-    end_time = time.time()
+    # Build the VI Tree
+    vi_tree, counter, elapsed = pipeline.build("on_demand", sampled_ids, manager=manager,
+                                               query_points=query_points, prune_constraints=args.prune, progress=True)
 
     # Print the number of intersection partitions
     print(f"Number of intersection partitions: {counter}")
 
     # Print the time taken to insert all records
-    print(f"Time taken to insert all records into the VI Tree: {end_time - start_time:.2f} seconds")
+    print(f"Time taken to insert all records into the VI Tree: {elapsed:.2f} seconds")
+
+    # Report the cell of every query point
+    leaves = vi_tree.locate_points()
+    located = [leaf for leaf in leaves if leaf is not None]
+    print(f"Located {len(located)} of {len(leaves)} query points in {len({id(leaf) for leaf in located})} distinct cells")
 
     # print("\nVI Tree Structure (Layer by Layer with Records):")
     # vi_tree.print_tree_by_layer(m, n, db_name, conn)
@@ -118,8 +103,11 @@ if __name__ == '__main__':
     print("Total time in read_from_sqlite:", FunctionProfiler.total_time_read_from_sqlite)
     print("Total time in total_time_satisfies_all_constraints:", FunctionProfiler.total_time_satisfies_all_constraints)
 
+    if pipeline.cell_cache is not None:
+        print("Cell cache:", pipeline.cell_cache.stats())
+
     # Close the database connection
-    conn.close()
+    pipeline.close()
     print("Database connection closed.")
 
     # plot_linear_equations(records_to_draw)
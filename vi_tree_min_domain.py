@@ -1,7 +1,9 @@
-from function_utils import (check_function, FunctionProfiler, merge_constraints, get_tight_constraints,
+from function_utils import (check_function, FunctionProfiler, get_tight_constraints,
                             check_smallest_intervals)
 from sqlite_utils import read_from_sqlite, SQLiteReader
 from vertex_utils import create_lookup_table, process_new_vertices
+from tree_export import print_tree_by_layer
+from tree_stats import TreeStats
 
 init_constraints = []  # Global variable to store initial constraints
 
@@ -13,12 +15,15 @@ class TreeNode:
         self.left_children = None  # Left child
         self.right_children = None  # Right child
         self.skip_flag = False  # Flag to indicate if this node should be skipped
+        self.node_id = None  # Creation order, assigned by TreeStats
+        self.depth = 0  # Depth in the tree, assigned by TreeStats
         self.not_enough_vertices = False
 
 
 class VITree:
     def __init__(self):
         self.root = None  # Initialize the tree with no root
+        self._stats = TreeStats()  # Incrementally maintained statistics
 
     def insert(self, record_id, constraints, vertices=None, m=None, n=None, db_name=None, conn=None, manager=None):
         """
@@ -52,16 +57,14 @@ class VITree:
             self.root.left_children = TreeNode(-record_id, [-record_id])
             self.root.right_children = TreeNode(record_id, [record_id])
 
-            left_merged_constraints = merge_constraints(self.root.left_children.constraints, init_constraints, m, n, db_name, conn)
-            # print(f"Left merged constraints: {left_merged_constraints}")
-            right_merged_constraints = merge_constraints(self.root.right_children.constraints, init_constraints, m, n, db_name, conn)
-            # print(f"Right merged constraints: {right_merged_constraints}")
-
-            self.root.left_children.vertices = FunctionProfiler.compute_vertices(left_merged_constraints)
+            self.root.left_children.vertices = FunctionProfiler.compute_cell_vertices(self.root.left_children.constraints, init_constraints, m, n, db_name, conn)
             # print(f"Left children vertices: {self.root.left_children.vertices}")
-            self.root.right_children.vertices = FunctionProfiler.compute_vertices(right_merged_constraints)
+            self.root.right_children.vertices = FunctionProfiler.compute_cell_vertices(self.root.right_children.constraints, init_constraints, m, n, db_name, conn)
             # print(f"Right children vertices: {self.root.right_children.vertices}")
 
+            self._stats.add_root(self.root)
+            self._stats.add_children(self.root, self.root.left_children, self.root.right_children)
+
             return
 
         # Use a stack to manage nodes for non-recursive traversal
@@ -83,14 +86,9 @@ class VITree:
                 continue  # Skip to the next iteration if not satisfied
 
             if current.left_children is None and current.right_children is None:
-                left_merged_constraints = merge_constraints(current.constraints + [-record_id], init_constraints, m, n, db_name, conn)
-                # print(f"Left merged constraints: {left_merged_constraints}")
-                right_merged_constraints = merge_constraints(current.constraints + [record_id], init_constraints, m, n, db_name, conn)
-                # print(f"Right merged constraints: {right_merged_constraints}")
-
-                left_children_vertices = FunctionProfiler.compute_vertices(left_merged_constraints)
+                left_children_vertices = FunctionProfiler.compute_cell_vertices(current.constraints + [-record_id], init_constraints, m, n, db_name, conn)
                 # print(f"Left children vertices: {left_children_vertices}")
-                right_children_vertices = FunctionProfiler.compute_vertices(right_merged_constraints)
+                right_children_vertices = FunctionProfiler.compute_cell_vertices(current.constraints + [record_id], init_constraints, m, n, db_name, conn)
                 # print(f"Right children vertices: {right_children_vertices}")
 
                 if len(left_children_vertices) <= 2 or len(right_children_vertices) <= 2:
@@ -117,6 +115,7 @@ class VITree:
 
                 current.left_children.vertices = left_children_vertices
                 current.right_children.vertices = right_children_vertices
+                self._stats.add_children(current, current.left_children, current.right_children)
 
                 continue
 
@@ -126,85 +125,31 @@ class VITree:
 
     def print_tree_by_layer(self, m, n, db_name, conn):
         """
-        Print the VI Tree layer by layer, showing each node's ID, vertices, and database record.
-        Handles negative IDs by converting them to positive when fetching records.
+        Print the tree layer by layer, showing each node's ID, vertices, and database record.
+        Nodes are streamed by tree_export.iter_nodes and their records are fetched in batches.
         Parameters:
             m (int): Number of functions.
             n (int): Dimension of functions.
             db_name (str): Database file name.
             conn: SQLite database connection.
         """
-        if self.root is None:
-            print("The tree is empty.")
-            return
-
-        # Use a queue to implement level-order traversal, along with layer tracking
-        queue = [(self.root, 0)]  # Each element is a tuple (node, layer)
-        current_layer = 0
-        layer_output = []
-
-        while queue:
-            current, layer = queue.pop(0)  # Dequeue the front node
-
-            # Check if we've moved to a new layer
-            if layer > current_layer:
-                # Print all nodes in the previous layer
-                print(f"Layer {current_layer}:")
-                for node_output in layer_output:
-                    print(node_output)
-                print()  # Blank line between layers
-                layer_output = []  # Reset the layer output
-                current_layer = layer
-
-            # Fetch record from the database
-            record_id = abs(current.intersection_id)  # Use positive ID for fetching
-            record = read_from_sqlite(m, n, db_name=db_name, record_id=record_id, conn=conn)
-
-            # Add the current node's details to the layer output
-            layer_output.append(
-                f"Node ID: {current.intersection_id}, Vertices: {current.vertices}, Record: {record}"
-            )
-
-            # Enqueue the left and right children if they exist, with incremented layer
-            if current.left_children:
-                queue.append((current.left_children, layer + 1))
-            if current.right_children:
-                queue.append((current.right_children, layer + 1))
-
-        # Print the last layer
-        print(f"Layer {current_layer}:")
-        for node_output in layer_output:
-            print(node_output)
+        print_tree_by_layer(self, m, n, db_name, conn)
 
     def get_height(self):
-        if self.root is None:
-            return 0
-        # Iterative approach using a queue (BFS)
-        from collections import deque
-        queue = deque([(self.root, 1)])
-        max_depth = 0
-        while queue:
-            node, depth = queue.popleft()
-            if node is not None:
-                max_depth = max(max_depth, depth)
-                queue.append((node.left_children, depth + 1))
-                queue.append((node.right_children, depth + 1))
-        return max_depth
+        """
+        Height of the tree as the number of layers, maintained incrementally during insert.
+        """
+        return self._stats.height
 
     def get_leaf_count(self):
-        if self.root is None:
-            return 0
-        # Iterative approach using a stack (DFS)
-        stack = [self.root]
-        leaf_count = 0
-        while stack:
-            node = stack.pop()
-            if node is not None:
-                # Check if it is a leaf and not flagged as not_enough_vertices
-                if node.left_children is None and node.right_children is None and not node.not_enough_vertices:
-                    leaf_count += 1
-                else:
-                    stack.append(node.left_children)
-                    stack.append(node.right_children)
-        return leaf_count
+        """
+        Number of leaf nodes in the tree, maintained incrementally during insert.
+        """
+        return self._stats.leaf_count
 
+    def stats(self):
+        """
+        Snapshot of the node count, leaf count, height, depth histogram and vertex total.
+        Cheap enough to poll during a long build.
+        """
+        return self._stats.as_dict()
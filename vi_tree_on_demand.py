@@ -1,28 +1,63 @@
-from function_utils import (check_function, FunctionProfiler, merge_constraints, get_tight_constraints,
-                            check_smallest_intervals)
-from sqlite_utils import read_from_sqlite
+import numpy as np
+
+from function_utils import (check_function, FunctionProfiler, get_tight_constraints,
+                            check_smallest_intervals, prune_constraints)
+from sqlite_utils import read_from_sqlite, SQLiteReader
 from vertex_utils import create_lookup_table, process_new_vertices
+from tree_export import print_tree_by_layer
+from tree_stats import TreeStats
 
 init_constraints = []  # Global variable to store initial constraints
 
 class TreeNode:
-    def __init__(self, intersection_id, constraints=None, vertices=None):
+    def __init__(self, intersection_id, constraints=None, vertices=None, point_ids=None):
         self.intersection_id = intersection_id  # ID of the intersection (record_id)
         self.constraints = constraints if constraints is not None else []  # Constraints for this node, defaults to []
         self.vertices = vertices if vertices is not None else []  # Associated vertices, defaults to []
+        self.point_ids = point_ids if point_ids is not None else np.empty(0, dtype=np.int64)  # Query points in this cell
         self.left_children = None  # Left child
         self.right_children = None  # Right child
         self.skip_flag = False  # Flag to indicate if this node should be skipped
+        self.node_id = None  # Creation order, assigned by TreeStats
+        self.depth = 0  # Depth in the tree, assigned by TreeStats
         self.not_enough_vertices = False
 
 
 class VITree:
-    def __init__(self):
+    def __init__(self, query_points=None, prune_constraints=False):
         self.root = None  # Initialize the tree with no root
+        # Reduce each materialised node's constraints to its facet-defining records, inherited by its children
+        self.prune_constraints = prune_constraints
+        # Query points of shape (num_points, d); only cells holding at least one of them are refined
+        self.query_points = None if query_points is None else np.asarray(query_points, dtype=np.float64)
+        self._stats = TreeStats()  # Incrementally maintained statistics
 
-    def insert(self, record_id, constraints, vertices=None, m=None, n=None, db_name=None, conn=None, manager=None, given_vertex=None):
+    def _split(self, node, record_id, record):
+        """
+        Create the children of a leaf and hand each of them the query points on its side of the record.
+        Points lying on the hyperplane go to the right (non-negative) side so that every point keeps a cell.
+        """
+        *coefficients, constant = record
+        points = self.query_points[node.point_ids]
+        on_right = points @ np.asarray(coefficients, dtype=np.float64) - constant >= 0
+
+        node.left_children = TreeNode(
+            -record_id,
+            constraints=[-record_id] + node.constraints,
+            point_ids=node.point_ids[~on_right]
+        )
+        node.right_children = TreeNode(
+            record_id,
+            constraints=[record_id] + node.constraints,
+            point_ids=node.point_ids[on_right]
+        )
+        self._stats.add_children(node, node.left_children, node.right_children)
+
+    def insert(self, record_id, constraints, vertices=None, m=None, n=None, db_name=None, conn=None, manager=None,
+               given_vertex=None, query_points=None):
         """
         Insert a node into the VI tree using a non-recursive method.
+        Only cells that contain at least one query point are materialised and refined.
         Parameters:
             record_id (int): Intersection ID for the node.
             constraints (list): Constraints for the node.
@@ -31,209 +66,131 @@ class VITree:
             n (int): Dimension of functions.
             db_name (str): Database file name.
             conn: SQLite database connection.
+            manager (VertexManager): Optional manager used to skip vertex sets that were already visited.
+            given_vertex (list): Single query point, kept for backwards compatibility.
+            query_points (array-like): Batch of query points of shape (num_points, d).
         """
         global init_constraints
 
-        new_node = TreeNode(record_id, None, vertices)
-
         if self.root is None:
-            # Set the root if the tree is empty
-            self.root = new_node
+            if query_points is not None:
+                self.query_points = np.asarray(query_points, dtype=np.float64)
+            elif given_vertex is not None:
+                self.query_points = np.asarray([given_vertex], dtype=np.float64)
+            if self.query_points is None:
+                raise ValueError("The on-demand VITree needs query points before the first insert.")
 
             # Update the global variable and node properties
             init_constraints = constraints
             print(f"Initial constraints for record {record_id}: {init_constraints}")
 
-            # Explicitly set root node properties
-            self.root.intersection_id = record_id
-            self.root.vertices = vertices if vertices is not None else []
+            # Keep the query points that lie in the (closed) initial domain
+            in_domain = FunctionProfiler.points_satisfying_constraints(self.query_points, init_constraints, strict=False)
+            self.root = TreeNode(record_id, None, vertices, point_ids=np.flatnonzero(in_domain))
+            self._stats.add_root(self.root)
 
             # Initialize left and right children with constraints
-            self.root.left_children = TreeNode(-record_id, [-record_id])
-            self.root.right_children = TreeNode(record_id, [record_id])
+            self._split(self.root, record_id, SQLiteReader.get_record_by_id(record_id))
 
             return
 
+        # Get the record once for the whole descent
+        insert_record = SQLiteReader.get_record_by_id(record_id)
+
         # Use a stack to manage nodes for non-recursive traversal
         stack = [self.root]
-
-        # Set to store previously computed vertices
-        previously_computed_vertices = set()
         cache = {}
 
         while stack:
-            # print(len(cache))
             current = stack.pop()
-            # Get the record from the database
-            insert_record = FunctionProfiler.read_from_sqlite(m=m, n=n, db_name=db_name, record_id=record_id, conn=conn)
-            # print(f"Processing record {record_id}: {insert_record}")
 
-            # Check for vertices that should be skipped
             # Skip nodes marked with the skip_flag
             if current.skip_flag:
-                # print(f"Skipping record {current.intersection_id}: Marked as skippable.")
                 continue
 
-            if len(current.vertices) != 0:
-                # print(f"current vertices: {current.vertices}")
-                # print(insert_record)
-                if not FunctionProfiler.check_function(insert_record, current.vertices, atol=1e-4, cache=cache):
-                    continue  # Skip to the next iteration if not satisfied
-                # print("satisfied")
-                # Add left and right children to the stack for further traversal
-                if current.left_children is not None and current.right_children is not None:
-                    stack.append(current.left_children)
-                    stack.append(current.right_children)
-                    continue
-
-                if current.left_children is None and current.right_children is None:
-                    current.left_children = TreeNode(
-                        -record_id,
-                        constraints=[-record_id] + current.constraints
-                    )
-                    current.right_children = TreeNode(
-                        record_id,
-                        constraints=[record_id] + current.constraints
-                    )
-                    continue
-
-
-            # If current.vertices is empty
+            # Materialise the cell on first visit, unless no query point lies in it
             if not current.vertices:
-                # Merge node.constraints with init_constraints
-                merged_constraints = merge_constraints(current.constraints, init_constraints, m, n, db_name, conn)
-                if not FunctionProfiler.satisfies_all_constraints(given_vertex, merged_constraints):
+                if current.point_ids.size == 0:
                     current.skip_flag = True
                     continue
 
-                # Compute vertices
-                current.vertices = FunctionProfiler.compute_vertices(merged_constraints)
-                # print(f"Computed vertices for record {record_id}: {current.vertices}")
-                # current.constraints = get_tight_constraints(current.constraints, current.vertices, m, n, db_name, conn)
-                # print("current constraints: ", current.constraints)
+                # Compute vertices from node.constraints within init_constraints
+                self._stats.set_vertices(current, FunctionProfiler.compute_cell_vertices(current.constraints, init_constraints, m, n, db_name, conn))
+                if self.prune_constraints and len(current.vertices) > 2:
+                    current.constraints = prune_constraints(current.constraints, current.vertices, init_constraints)
 
                 # Check if the number of vertices is less than or equal to 2
                 if len(current.vertices) <= 2:
-                    # print(f"Skipping record {record_id}: Not enough vertices.")
-                    # print(f"Vertices: {current.vertices}")
-                    # print(f"Skipping record {record_id}: Not enough vertices.")
                     current.skip_flag = True  # Mark this node to be skipped in future iterations
-                    current.not_enough_vertices = True
+                    self._stats.exclude_leaf(current)
                     continue
 
-
-                result = manager.process_vertex_set(current.vertices)
-                if result == True:
-                    # print(f"Skipping record {record_id}: Not enough vertices.")
+                if manager is not None and manager.process_vertex_set(current.vertices):
                     current.skip_flag = True
                     continue
 
-                # print(f"Processed vertices for record {record_id}: {current.vertices}")
-
-                # if check_smallest_intervals(current.vertices, interval):
-                #     current.skip_flag = True
-                #     continue
+            if not FunctionProfiler.check_function(insert_record, current.vertices, cache=cache):
+                continue  # Skip to the next iteration if not satisfied
 
+            # Add left and right children to the stack for further traversal
+            if current.left_children is not None and current.right_children is not None:
+                stack.append(current.left_children)
+                stack.append(current.right_children)
+                continue
 
-                # Check if the input record_id satisfies the condition
-                # if not check_function(insert_record, current.vertices, atol=1e-4):
-                #     continue  # Skip to the next iteration if not satisfied
-
-                # If the current node has no left child and no right child
-                if current.left_children is None and current.right_children is None:
-                    current.left_children = TreeNode(
-                        -record_id,
-                        constraints=[-record_id] + current.constraints
-                    )
-                    current.right_children = TreeNode(
-                        record_id,
-                        constraints=[record_id] + current.constraints
-                    )
-                    continue
+            self._split(current, record_id, insert_record)
 
+    def locate_points(self):
+        """
+        Return, for every query point, the leaf node whose cell contains it.
+        Points outside the initial domain map to None.
+        Returns:
+            list: One TreeNode or None per query point, in query order.
+        """
+        results = [None] * (0 if self.query_points is None else len(self.query_points))
+        if self.root is None:
+            return results
 
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.point_ids.size == 0:
+                continue
+            if node.left_children is None and node.right_children is None:
+                for point_id in node.point_ids.tolist():
+                    results[point_id] = node
+                continue
+            stack.append(node.left_children)
+            stack.append(node.right_children)
+        return results
 
     def print_tree_by_layer(self, m, n, db_name, conn):
         """
-        Print the VI Tree layer by layer, showing each node's ID, vertices, and database record.
-        Handles negative IDs by converting them to positive when fetching records.
+        Print the tree layer by layer, showing each node's ID, vertices, and database record.
+        Nodes are streamed by tree_export.iter_nodes and their records are fetched in batches.
         Parameters:
             m (int): Number of functions.
             n (int): Dimension of functions.
             db_name (str): Database file name.
             conn: SQLite database connection.
         """
-        if self.root is None:
-            print("The tree is empty.")
-            return
-
-        # Use a queue to implement level-order traversal, along with layer tracking
-        queue = [(self.root, 0)]  # Each element is a tuple (node, layer)
-        current_layer = 0
-        layer_output = []
-
-        while queue:
-            current, layer = queue.pop(0)  # Dequeue the front node
-
-            # Check if we've moved to a new layer
-            if layer > current_layer:
-                # Print all nodes in the previous layer
-                print(f"Layer {current_layer}:")
-                for node_output in layer_output:
-                    print(node_output)
-                print()  # Blank line between layers
-                layer_output = []  # Reset the layer output
-                current_layer = layer
-
-            # Fetch record from the database
-            record_id = abs(current.intersection_id)  # Use positive ID for fetching
-            record = read_from_sqlite(m, n, db_name=db_name, record_id=record_id, conn=conn)
-
-            # Add the current node's details to the layer output
-            layer_output.append(
-                f"Node ID: {current.intersection_id}, Vertices: {current.vertices}, Record: {record}"
-            )
-
-            # Enqueue the left and right children if they exist, with incremented layer
-            if current.left_children:
-                queue.append((current.left_children, layer + 1))
-            if current.right_children:
-                queue.append((current.right_children, layer + 1))
-
-        # Print the last layer
-        print(f"Layer {current_layer}:")
-        for node_output in layer_output:
-            print(node_output)
+        print_tree_by_layer(self, m, n, db_name, conn)
 
     def get_height(self):
-        if self.root is None:
-            return 0
-        # Iterative approach using a queue (BFS)
-        from collections import deque
-        queue = deque([(self.root, 1)])
-        max_depth = 0
-        while queue:
-            node, depth = queue.popleft()
-            if node is not None:
-                max_depth = max(max_depth, depth)
-                queue.append((node.left_children, depth + 1))
-                queue.append((node.right_children, depth + 1))
-        return max_depth
+        """
+        Height of the tree as the number of layers, maintained incrementally during insert.
+        """
+        return self._stats.height
 
     def get_leaf_count(self):
-        if self.root is None:
-            return 0
-        # Iterative approach using a stack (DFS)
-        stack = [self.root]
-        leaf_count = 0
-        while stack:
-            node = stack.pop()
-            if node is not None:
-                # Check if it is a leaf and not flagged as not_enough_vertices
-                if node.left_children is None and node.right_children is None and not node.not_enough_vertices:
-                    leaf_count += 1
-                else:
-                    stack.append(node.left_children)
-                    stack.append(node.right_children)
-        return leaf_count
+        """
+        Number of leaf nodes in the tree, maintained incrementally during insert.
+        """
+        return self._stats.leaf_count
 
+    def stats(self):
+        """
+        Snapshot of the node count, leaf count, height, depth histogram and vertex total.
+        Cheap enough to poll during a long build.
+        """
+        return self._stats.as_dict()
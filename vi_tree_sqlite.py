@@ -0,0 +1,335 @@
+import json
+import sqlite3
+from collections import OrderedDict
+
+import numpy as np
+
+from function_utils import FunctionProfiler
+from sqlite_utils import SQLiteReader
+from tree_export import print_tree_by_layer
+from tree_stats import TreeStats
+from vi_tree import keeps_split
+
+
+class PagedNode:
+    """
+    Tree node held in an SQLiteNodeStore. Children are referenced by node ID and faulted in on access.
+    """
+
+    def __init__(self, store, intersection_id, constraints=None, vertices=None):
+        self._store = store
+        self.node_id = None  # Assigned by TreeStats
+        self.depth = 0  # Assigned by TreeStats
+        self.intersection_id = intersection_id  # ID of the intersection (record_id)
+        self.constraints = constraints if constraints is not None else []  # Signed record IDs of this cell
+        self.vertices = vertices if vertices is not None else []  # Associated vertices
+        self.left_id = None  # Node ID of the left child
+        self.right_id = None  # Node ID of the right child
+        self.skip_flag = False
+        self.not_enough_vertices = False
+
+    @property
+    def left_children(self):
+        return None if self.left_id is None else self._store.get(self.left_id)
+
+    @property
+    def right_children(self):
+        return None if self.right_id is None else self._store.get(self.right_id)
+
+
+class SQLiteNodeStore:
+    """
+    Node table in SQLite with a bounded in-memory working set.
+
+    Nodes are kept in least-recently-used order. Evicted dirty nodes are queued and written back in batched
+    transactions. Faulting a node in also prefetches its subtree a few levels down with one query per level.
+    """
+
+    def __init__(self, conn, table_name, cache_size=100000, write_batch=1000, prefetch_depth=2):
+        """
+        Parameters:
+            conn: SQLite database connection, usually the one holding the records.
+            table_name (str): Prefix of the node and metadata tables.
+            cache_size (int): Maximum number of nodes kept in memory.
+            write_batch (int): Number of queued dirty nodes that triggers a write-back.
+            prefetch_depth (int): Number of levels below a faulted node that are loaded with it.
+        """
+        self.conn = conn
+        self.nodes_table = f"{table_name}_nodes"
+        self.meta_table = f"{table_name}_meta"
+        self.cache_size = cache_size
+        self.write_batch = write_batch
+        self.prefetch_depth = prefetch_depth
+        self.cache = OrderedDict()  # node_id -> PagedNode
+        self.dirty = set()  # IDs of cached nodes modified since they were loaded
+        self.write_queue = {}  # Evicted dirty nodes waiting to be written back
+        self.faults = 0
+        self.writes = 0
+        self._dimension = None
+
+        self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.nodes_table} (
+                node_id INTEGER PRIMARY KEY,
+                intersection_id INTEGER,
+                left_id INTEGER,
+                right_id INTEGER,
+                skip_flag INTEGER,
+                not_enough_vertices INTEGER,
+                depth INTEGER,
+                constraints BLOB,
+                vertices BLOB
+            )
+        """)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {self.meta_table} (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute(f"SELECT value FROM {self.meta_table} WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        self.conn.execute(f"INSERT OR REPLACE INTO {self.meta_table} VALUES (?, ?)", (key, json.dumps(value)))
+
+    def _to_row(self, node):
+        vertices = np.asarray(node.vertices, dtype=np.float64)
+        return (node.node_id, node.intersection_id, node.left_id, node.right_id, int(node.skip_flag),
+                int(node.not_enough_vertices), node.depth, np.asarray(node.constraints, dtype=np.int64).tobytes(),
+                vertices.tobytes() if vertices.size else b"")
+
+    def _from_row(self, row, dimension):
+        node_id, intersection_id, left_id, right_id, skip_flag, not_enough_vertices, depth, constraints, vertices = row
+        node = PagedNode(self, intersection_id, np.frombuffer(constraints, dtype=np.int64).tolist(),
+                         np.frombuffer(vertices, dtype=np.float64).reshape(-1, dimension).tolist())
+        node.node_id = node_id
+        node.left_id = left_id
+        node.right_id = right_id
+        node.skip_flag = bool(skip_flag)
+        node.not_enough_vertices = bool(not_enough_vertices)
+        node.depth = depth
+        return node
+
+    def _cache_node(self, node):
+        self.cache[node.node_id] = node
+        self.cache.move_to_end(node.node_id)
+        while len(self.cache) > self.cache_size:
+            node_id, evicted = self.cache.popitem(last=False)
+            if node_id in self.dirty:
+                self.dirty.discard(node_id)
+                self.write_queue[node_id] = evicted
+        if len(self.write_queue) >= self.write_batch:
+            self._write_back(list(self.write_queue.values()))
+            self.write_queue.clear()
+
+    def _write_back(self, nodes):
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {self.nodes_table} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._to_row(node) for node in nodes]
+            )
+        self.writes += len(nodes)
+
+    def put(self, node):
+        """
+        Add a new or modified node to the working set and mark it dirty.
+        """
+        self.write_queue.pop(node.node_id, None)
+        self.dirty.add(node.node_id)
+        self._cache_node(node)
+
+    def get(self, node_id):
+        """
+        Return a node, faulting it and part of its subtree in from SQLite if it is not in memory.
+        """
+        node = self.cache.get(node_id)
+        if node is not None:
+            self.cache.move_to_end(node_id)
+            return node
+
+        node = self.write_queue.pop(node_id, None)
+        if node is not None:
+            # Still waiting for write-back, so it stays dirty
+            self.dirty.add(node_id)
+            self._cache_node(node)
+            return node
+
+        self.faults += 1
+        if self._dimension is None:
+            self._dimension = self.get_meta("dimension")
+        dimension = self._dimension
+        row = self.conn.execute(f"SELECT * FROM {self.nodes_table} WHERE node_id = ?", (node_id,)).fetchone()
+        if row is None:
+            return None
+        node = self._from_row(row, dimension)
+        self._cache_node(node)
+
+        # Prefetch the subtree below the node, one query per level
+        level = [i for i in (node.left_id, node.right_id) if i is not None]
+        for _ in range(self.prefetch_depth):
+            missing = [i for i in level if i not in self.cache and i not in self.write_queue]
+            if not missing:
+                break
+            placeholders = ", ".join(["?"] * len(missing))
+            rows = self.conn.execute(f"SELECT * FROM {self.nodes_table} WHERE node_id IN ({placeholders})", missing).fetchall()
+            level = []
+            for row in rows:
+                loaded = self._from_row(row, dimension)
+                self._cache_node(loaded)
+                level.extend(i for i in (loaded.left_id, loaded.right_id) if i is not None)
+
+        # Touch the requested node last so that prefetching cannot leave it evicted
+        self._cache_node(node)
+        return node
+
+    def flush(self):
+        """
+        Write every dirty node back in one transaction.
+        """
+        nodes = list(self.write_queue.values()) + [self.cache[node_id] for node_id in self.dirty]
+        if nodes:
+            self._write_back(nodes)
+        self.write_queue.clear()
+        self.dirty.clear()
+
+
+class PagedVITree:
+    """
+    VI tree whose nodes live in SQLite, next to the records, with a bounded working set in memory.
+    It follows the same split rules (vi_tree.keeps_split) and exposes the same insert/get_height/get_leaf_count API
+    as vi_tree.VITree, and reopening the same tables continues a previously persisted tree.
+    """
+
+    def __init__(self, conn, m, n, table_name=None, cache_size=100000, write_batch=1000, prefetch_depth=2,
+                 min_vertices=4):
+        """
+        Parameters:
+            conn: SQLite database connection.
+            m (int): Number of functions.
+            n (int): Dimension of functions.
+            table_name (str): Prefix of the tree tables, defaults to vitree_m{m}_n{n}.
+            cache_size (int): Maximum number of nodes kept in memory.
+            write_batch (int): Number of evicted dirty nodes written back per transaction.
+            prefetch_depth (int): Number of levels below a faulted node that are loaded with it.
+            min_vertices (int): A split is skipped if either child has fewer vertices, as in VITree.
+        """
+        self.min_vertices = min_vertices
+        self.store = SQLiteNodeStore(conn, table_name or f"vitree_m{m}_n{n}", cache_size, write_batch, prefetch_depth)
+        if self.store.get_meta("dimension") is None:
+            self.store.set_meta("dimension", n)
+            self.store.conn.commit()
+        self._stats = TreeStats()
+        saved_stats = self.store.get_meta("stats")
+        if saved_stats is not None:
+            self._stats.restore(saved_stats)
+        self.root_id = self.store.get_meta("root_id")
+        self.init_constraints = [tuple(constraint) for constraint in self.store.get_meta("init_constraints", [])]
+
+    @property
+    def root(self):
+        return None if self.root_id is None else self.store.get(self.root_id)
+
+    def _children_vertices(self, node, record_id, m=None, n=None, db_name=None, conn=None):
+        return (FunctionProfiler.compute_cell_vertices(node.constraints + [-record_id], self.init_constraints, m, n, db_name, conn),
+                FunctionProfiler.compute_cell_vertices(node.constraints + [record_id], self.init_constraints, m, n, db_name, conn))
+
+    def _split(self, node, record_id, left_vertices, right_vertices):
+        left = PagedNode(self.store, -record_id, [-record_id] + node.constraints, left_vertices)
+        right = PagedNode(self.store, record_id, [record_id] + node.constraints, right_vertices)
+        self._stats.add_children(node, left, right)
+        node.left_id = left.node_id
+        node.right_id = right.node_id
+        self.store.put(node)
+        self.store.put(left)
+        self.store.put(right)
+
+    def insert(self, record_id, constraints, vertices=None, m=None, n=None, db_name=None, conn=None):
+        """
+        Insert a record into the tree using a non-recursive descent, faulting nodes in as needed.
+        Parameters are the same as for vi_tree.VITree.insert; m, n, db_name and conn are passed on to
+        compute_cell_vertices.
+        """
+        if self.root_id is None:
+            self.init_constraints = constraints
+            root = PagedNode(self.store, record_id, None, vertices)
+            self._stats.add_root(root)
+            self.root_id = root.node_id
+            self.store.set_meta("root_id", self.root_id)
+            self.store.set_meta("init_constraints", [list(constraint) for constraint in constraints])
+
+            left, right = self._children_vertices(root, record_id, m, n, db_name, conn)
+            self._split(root, record_id, left, right)
+            return
+
+        insert_record = SQLiteReader.get_record_by_id(record_id)
+        cache = {}
+
+        # The stack holds node IDs so that nodes waiting on it can be paged out
+        stack = [self.root_id]
+        while stack:
+            current = self.store.get(stack.pop())
+
+            if not FunctionProfiler.check_function(insert_record, current.vertices, cache=cache):
+                continue
+
+            if current.left_id is None and current.right_id is None:
+                left, right = self._children_vertices(current, record_id, m, n, db_name, conn)
+                if keeps_split(current.vertices, left, right, self.min_vertices):
+                    self._split(current, record_id, left, right)
+                continue
+
+            stack.append(current.left_id)
+            stack.append(current.right_id)
+
+    def extend(self, record_ids, m=None, n=None, db_name=None, conn=None):
+        """
+        Insert records into a persisted tree, e.g. the records added by data_factory's append mode.
+        Records that do not cross the root domain are skipped with one vectorized test.
+        Returns:
+            int: Number of records inserted.
+        """
+        record_ids = np.asarray(record_ids, dtype=np.int64)
+        if self.root_id is None or record_ids.size == 0:
+            return 0
+        records = SQLiteReader.get_records_array()[record_ids - 1]
+        crossing = record_ids[FunctionProfiler.check_functions(records, self.root.vertices)]
+        for record_id in crossing.tolist():
+            self.insert(record_id, self.init_constraints, m=m, n=n, db_name=db_name, conn=conn)
+        self.flush()
+        return len(crossing)
+
+    def flush(self):
+        """
+        Write all dirty nodes and the tree statistics back to SQLite.
+        """
+        self.store.set_meta("stats", self._stats.as_dict())
+        self.store.flush()
+        self.store.conn.commit()
+
+    def print_tree_by_layer(self, m, n, db_name, conn):
+        """
+        Print the tree layer by layer, showing each node's ID, vertices, and database record.
+        """
+        print_tree_by_layer(self, m, n, db_name, conn)
+
+    def get_height(self):
+        """
+        Height of the tree as the number of layers.
+        """
+        return self._stats.height
+
+    def get_leaf_count(self):
+        """
+        Number of leaf nodes in the tree.
+        """
+        return self._stats.leaf_count
+
+    def stats(self):
+        """
+        Snapshot of the tree statistics plus working-set counters.
+        """
+        tree_stats = self._stats.as_dict()
+        tree_stats.update({
+            "resident_nodes": len(self.store.cache),
+            "faults": self.store.faults,
+            "node_writes": self.store.writes,
+        })
+        return tree_stats
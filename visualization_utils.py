@@ -1,5 +1,4 @@
 import numpy as np
-from matplotlib import pyplot as plt
 
 
 def plot_linear_equations(records, x_range=(0, 10)):
@@ -10,6 +9,8 @@ def plot_linear_equations(records, x_range=(0, 10)):
         records (list of tuples): Each tuple represents coefficients (a, b, c) of a linear equation.
         x_range (tuple): Range of x1 and x2, default is (0, 10).
     """
+    from matplotlib import pyplot as plt  # Imported on use, drivers load this module without plotting
+
     plt.figure(figsize=(10, 8))
     x1 = np.linspace(x_range[0], x_range[1], 500)  # Generate x1 values within the range
 